@@ -0,0 +1,590 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds each kind of upstream response stays fresh. Once stale, an entry
+# is still served (while a background refresh runs) until its hard expiry
+# at ``stale_factor`` times the TTL. Brackets, state schedules and
+# inflation factors change once a year; deduction data is keyed on income
+# buckets and turns over faster.
+DEFAULT_TTLS = {
+    'brackets': 24 * 3600,
+    'state_schedules': 24 * 3600,
+    'inflation': 24 * 3600,
+    'deductions': 3600
+}
+
+DEFAULT_TTL = 3600
+
+# How long one process may hold the host-wide fill lease for a key before
+# others stop waiting on it and fetch themselves
+FILL_LEASE_SECONDS = 5.0
+FILL_POLL_SECONDS = 0.02
+
+
+def cache_ttls() -> Dict[str, float]:
+    """DEFAULT_TTLS with API_CACHE_TTL_<NAMESPACE> overrides applied"""
+    return {
+        namespace: float(os.environ.get(f'API_CACHE_TTL_{namespace.upper()}', ttl))
+        for namespace, ttl in DEFAULT_TTLS.items()
+    }
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate footprint of a cached response, in bytes of its JSON form"""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(repr(value))
+
+
+class CacheBackend:
+    """Interface for TaxAPIIntegration response caches.
+
+    Keys are scoped by namespace ('brackets', 'state_schedules', ...) so each kind of
+    response can carry its own TTL.
+    """
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        entry = self.get_entry(namespace, key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, seconds until stale) for an entry that has not hit
+        its hard expiry; the second item is negative once the entry is stale"""
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, fetched_at: Optional[float] = None) -> None:
+        """Cache ``value``. With ``fetched_at`` (a time.time() of an earlier
+        fetch) it goes stale as if cached then, but stays servable for the
+        full hard TTL from now."""
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {}
+
+    def ttl_for(self, namespace: str) -> float:
+        return self.ttls.get(namespace, self.default_ttl)
+
+    def hard_ttl_for(self, namespace: str) -> float:
+        return self.ttl_for(namespace) * self.stale_factor
+
+    def acquire_lease(self, namespace: str, key: str, seconds: float) -> bool:
+        """Claim the right to fill ``key`` for this host. Process-local
+        backends have no other processes to coordinate with."""
+        return True
+
+    def release_lease(self, namespace: str, key: str) -> None:
+        pass
+
+    def wait_for(self, namespace: str, key: str, seconds: float) -> Optional[Any]:
+        """Poll for a value another process is filling"""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            time.sleep(FILL_POLL_SECONDS)
+            value = self.get(namespace, key)
+            if value is not None:
+                return value
+        return None
+
+    def sweep(self) -> int:
+        return 0
+
+    def _start_sweeper(self, interval: float) -> None:
+        self.sweep_interval = interval
+        self._stop = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name='api-cache-sweep', daemon=True)
+        self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                removed = self.sweep()
+            except Exception as e:
+                logger.warning(f"API cache sweep failed: {e}")
+                continue
+            if removed:
+                logger.debug(f"API cache sweep removed {removed} entries")
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+class _Shard:
+    """One lock-protected LRU segment of a MemoryCache"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (namespace, key) -> (value, expires_at, size, stale_at)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    def _drop(self, entry_key):
+        size = self.entries.pop(entry_key)[2]
+        self.bytes -= size
+
+    def get(self, entry_key, now):
+        with self.lock:
+            entry = self.entries.get(entry_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] <= now:
+                self._drop(entry_key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(entry_key)
+            self.hits += 1
+            return entry[0], entry[3] - now
+
+    def set(self, entry_key, value, expires_at, size, stale_at):
+        with self.lock:
+            if entry_key in self.entries:
+                self._drop(entry_key)
+            if size > self.max_bytes:
+                # Would flush the whole shard and still not fit
+                self.rejected += 1
+                return
+            self.entries[entry_key] = (value, expires_at, size, stale_at)
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def delete(self, entry_key):
+        with self.lock:
+            if entry_key in self.entries:
+                self._drop(entry_key)
+
+    def sweep(self, now) -> int:
+        with self.lock:
+            expired = [k for k, entry in self.entries.items() if entry[1] <= now]
+            for entry_key in expired:
+                self._drop(entry_key)
+            self.expired += len(expired)
+            return len(expired)
+
+
+class MemoryCache(CacheBackend):
+    """Bounded in-process TTL + LRU cache.
+
+    Entries are spread over ``stripes`` shards by key hash, each with its own
+    lock and an equal share of the entry and byte budgets, so concurrent
+    request threads rarely contend. Expired entries are dropped when read
+    and by a background sweep every ``sweep_interval`` seconds.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttls: Optional[Dict[str, float]] = None, default_ttl: float = DEFAULT_TTL,
+                 stripes: int = 16, sweep_interval: Optional[float] = None,
+                 stale_factor: Optional[float] = None):
+        self.max_entries = max_entries or int(os.environ.get('API_CACHE_MAX_ENTRIES', 10000))
+        self.max_bytes = max_bytes or int(os.environ.get('API_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+        self.ttls = ttls if ttls is not None else cache_ttls()
+        self.default_ttl = default_ttl
+        self.stale_factor = stale_factor or float(os.environ.get('API_CACHE_STALE_FACTOR', 4))
+        self._shards = [
+            _Shard(max(1, self.max_entries // stripes), max(1, self.max_bytes // stripes))
+            for _ in range(stripes)
+        ]
+        self._start_sweeper(sweep_interval or float(os.environ.get('API_CACHE_SWEEP_INTERVAL', 60)))
+
+    def _shard(self, entry_key) -> _Shard:
+        return self._shards[hash(entry_key) % len(self._shards)]
+
+    def get_entry(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        entry_key = (namespace, key)
+        return self._shard(entry_key).get(entry_key, time.monotonic())
+
+    def set(self, namespace: str, key: str, value: Any, fetched_at: Optional[float] = None) -> None:
+        entry_key = (namespace, key)
+        now = time.monotonic()
+        age = max(time.time() - fetched_at, 0.0) if fetched_at is not None else 0.0
+        self._shard(entry_key).set(entry_key, value, now + self.hard_ttl_for(namespace),
+                                   estimate_size(value), now - age + self.ttl_for(namespace))
+
+    def delete(self, namespace: str, key: str) -> None:
+        entry_key = (namespace, key)
+        self._shard(entry_key).delete(entry_key)
+
+    def clear(self) -> None:
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.bytes = 0
+
+    def sweep(self) -> int:
+        """Drop every expired entry; returns how many were removed"""
+        now = time.monotonic()
+        return sum(shard.sweep(now) for shard in self._shards)
+
+    def stats(self) -> Dict:
+        """Entry/byte usage and hit, miss, expiry and eviction counters"""
+        totals = {'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'rejected': 0}
+        for shard in self._shards:
+            with shard.lock:
+                totals['entries'] += len(shard.entries)
+                totals['bytes'] += shard.bytes
+                totals['hits'] += shard.hits
+                totals['misses'] += shard.misses
+                totals['expired'] += shard.expired
+                totals['evictions'] += shard.evictions
+                totals['rejected'] += shard.rejected
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = round(totals['hits'] / lookups, 4) if lookups else 0.0
+        totals['max_entries'] = self.max_entries
+        totals['max_bytes'] = self.max_bytes
+        totals['stripes'] = len(self._shards)
+        totals['backend'] = 'memory'
+        return totals
+
+
+class SQLiteCache(CacheBackend):
+    """Host-wide cache shared by every worker process through one SQLite
+    database in WAL mode.
+
+    Readers never block the single writer, each fill is one upsert (so a
+    reader sees either the old or the new response, never a partial one),
+    and the file outlives worker recycling and restarts. Expiry uses wall
+    clock time because entries are compared across processes. When the
+    sweep finds the cache over its entry or byte budget it drops the
+    entries closest to expiry first.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, ttls: Optional[Dict[str, float]] = None,
+                 default_ttl: float = DEFAULT_TTL, sweep_interval: Optional[float] = None,
+                 stale_factor: Optional[float] = None):
+        self.path = path or os.environ.get('API_CACHE_DB') \
+            or os.path.join(tempfile.gettempdir(), 'tax_agent_api_cache.db')
+        self.max_entries = max_entries or int(os.environ.get('API_CACHE_MAX_ENTRIES', 10000))
+        self.max_bytes = max_bytes or int(os.environ.get('API_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+        self.ttls = ttls if ttls is not None else cache_ttls()
+        self.default_ttl = default_ttl
+        self.stale_factor = stale_factor or float(os.environ.get('API_CACHE_STALE_FACTOR', 4))
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS api_cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    stale_at REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(api_cache)")]
+            if 'stale_at' not in columns:
+                # Caches written before soft TTLs: treat every entry as stale
+                conn.execute("ALTER TABLE api_cache ADD COLUMN stale_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS api_cache_expires ON api_cache (expires_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS api_cache_leases (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    holder INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+
+        self._start_sweeper(sweep_interval or float(os.environ.get('API_CACHE_SWEEP_INTERVAL', 60)))
+        logger.info(f"Shared API cache at {self.path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, **counters) -> None:
+        with self._lock:
+            for name, increment in counters.items():
+                setattr(self, name, getattr(self, name) + increment)
+
+    def get_entry(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        row = self._connect().execute(
+            "SELECT value, expires_at, stale_at FROM api_cache WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None:
+            self._count(misses=1)
+            return None
+        now = time.time()
+        if row[1] <= now:
+            # Left for the sweep; deleting here would turn reads into writes
+            self._count(misses=1, expired=1)
+            return None
+        self._count(hits=1)
+        return json.loads(row[0]), row[2] - now
+
+    def set(self, namespace: str, key: str, value: Any, fetched_at: Optional[float] = None) -> None:
+        payload = json.dumps(value, default=str)
+        now = time.time()
+        fetched_at = min(fetched_at, now) if fetched_at is not None else now
+        self._connect().execute(
+            "INSERT OR REPLACE INTO api_cache (namespace, key, value, expires_at, size, stale_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (namespace, key, payload, now + self.hard_ttl_for(namespace), len(payload),
+             fetched_at + self.ttl_for(namespace))
+        )
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._connect().execute("DELETE FROM api_cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def acquire_lease(self, namespace: str, key: str, seconds: float) -> bool:
+        """Take the fill lease unless another live process holds it"""
+        now = time.time()
+        cursor = self._connect().execute("""
+            INSERT INTO api_cache_leases (namespace, key, holder, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (namespace, key) DO UPDATE
+                SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE api_cache_leases.expires_at <= ?
+        """, (namespace, key, os.getpid(), now + seconds, now))
+        return cursor.rowcount == 1
+
+    def release_lease(self, namespace: str, key: str) -> None:
+        self._connect().execute(
+            "DELETE FROM api_cache_leases WHERE namespace = ? AND key = ? AND holder = ?",
+            (namespace, key, os.getpid())
+        )
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM api_cache")
+
+    def sweep(self) -> int:
+        """Drop expired entries, then trim to the entry and byte budgets"""
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM api_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        conn.execute("DELETE FROM api_cache_leases WHERE expires_at <= ?", (time.time(),))
+        self._count(expired=removed)
+
+        entries, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM api_cache").fetchone()
+        if entries > self.max_entries or total_bytes > self.max_bytes:
+            # Keep the longest-lived entries that fit both budgets
+            evicted = conn.execute("""
+                DELETE FROM api_cache WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid,
+                               ROW_NUMBER() OVER (ORDER BY expires_at DESC) AS rank,
+                               SUM(size) OVER (ORDER BY expires_at DESC) AS running_bytes
+                        FROM api_cache
+                    ) WHERE rank > ? OR running_bytes > ?
+                )
+            """, (self.max_entries, self.max_bytes)).rowcount
+            self._count(evictions=evicted)
+            removed += evicted
+        return removed
+
+    def stats(self) -> Dict:
+        """Shared entry/byte usage plus this process's hit and miss counters"""
+        entries, total_bytes = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM api_cache"
+        ).fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': 'sqlite',
+                'path': self.path,
+                'entries': entries,
+                'bytes': total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes
+            }
+
+
+class SingleFlight:
+    """Coalesce concurrent cache fills so each key is fetched once per host.
+
+    Within a process, the first thread to miss a key becomes the leader and
+    later threads wait on its Future. Across processes the leader also takes
+    the backend's fill lease; a leader that finds the lease held polls the
+    shared cache for the other process's result instead of fetching.
+    """
+
+    def __init__(self, cache: CacheBackend, lease_seconds: float = FILL_LEASE_SECONDS):
+        self.cache = cache
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, str], Future] = {}
+        self.fetches = 0
+        self.coalesced = 0
+        self.lease_waits = 0
+
+    def fill(self, namespace: str, key: str, fetch: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (value, fetched) where ``fetched`` is True only for the one
+        caller that actually ran ``fetch``; errors propagate to every waiter"""
+        call_key = (namespace, key)
+        with self._lock:
+            call = self._calls.get(call_key)
+            leader = call is None
+            if leader:
+                call = self._calls[call_key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return call.result(timeout=self.lease_seconds * 2), False
+
+        try:
+            value, fetched = self._fill_for_host(namespace, key, fetch)
+            call.set_result(value)
+            return value, fetched
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[call_key]
+
+    def refresh(self, namespace: str, key: str, fetch: Callable[[], Any]) -> bool:
+        """Re-fetch an entry that is still cached; skipped (returns False)
+        when another process on the host is already refreshing it"""
+        if not self.cache.acquire_lease(namespace, key, self.lease_seconds):
+            return False
+        try:
+            with self._lock:
+                self.fetches += 1
+            self.cache.set(namespace, key, fetch())
+            return True
+        finally:
+            self.cache.release_lease(namespace, key)
+
+    def _fill_for_host(self, namespace: str, key: str, fetch: Callable[[], Any]) -> Tuple[Any, bool]:
+        # A leader that finished just before this caller's miss has already filled it
+        value = self.cache.get(namespace, key)
+        if value is not None:
+            return value, False
+
+        if not self.cache.acquire_lease(namespace, key, self.lease_seconds):
+            value = self.cache.wait_for(namespace, key, self.lease_seconds)
+            if value is not None:
+                with self._lock:
+                    self.lease_waits += 1
+                return value, False
+            # The other filler died or is stuck; fetch without the lease
+
+        try:
+            with self._lock:
+                self.fetches += 1
+            value = fetch()
+            self.cache.set(namespace, key, value)
+            return value, True
+        finally:
+            self.cache.release_lease(namespace, key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'upstream_fetches': self.fetches,
+                'coalesced': self.coalesced,
+                'lease_waits': self.lease_waits,
+                'in_flight': len(self._calls)
+            }
+
+
+class BackgroundRefresher:
+    """Refreshes cache entries off the request path.
+
+    Stale entries are scheduled for refresh when they are served
+    (stale-while-revalidate); popular entries are scheduled shortly before
+    they go stale (refresh-ahead). A key is never queued twice at once.
+    """
+
+    def __init__(self, single_flight: SingleFlight, workers: int = 2):
+        self.single_flight = single_flight
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-cache-refresh')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.scheduled = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    def schedule(self, namespace: str, key: str, fetch: Callable[[], Any]) -> bool:
+        with self._lock:
+            if (namespace, key) in self._pending:
+                return False
+            self._pending.add((namespace, key))
+            self.scheduled += 1
+        self._executor.submit(self._refresh, namespace, key, fetch)
+        return True
+
+    def _refresh(self, namespace: str, key: str, fetch: Callable[[], Any]) -> None:
+        try:
+            refreshed = self.single_flight.refresh(namespace, key, fetch)
+            with self._lock:
+                self.refreshed += refreshed
+        except Exception as e:
+            # The stale value keeps being served until its hard expiry
+            logger.warning(f"Background refresh of {namespace}:{key} failed: {e}")
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._pending.discard((namespace, key))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'refreshes_scheduled': self.scheduled,
+                'refreshes_completed': self.refreshed,
+                'refreshes_failed': self.failed,
+                'refreshes_pending': len(self._pending)
+            }
+
+
+def create_cache() -> CacheBackend:
+    """Cache backend selected by API_CACHE_BACKEND ('sqlite' or 'memory').
+
+    The shared SQLite backend is the default so that all workers on a host
+    share one copy of each response; it falls back to the in-process cache
+    when the database cannot be opened.
+    """
+    backend = os.environ.get('API_CACHE_BACKEND', 'sqlite').lower()
+    if backend == 'sqlite':
+        try:
+            return SQLiteCache()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared API cache unavailable, using in-process cache: {e}")
+    return MemoryCache()
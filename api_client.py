@@ -0,0 +1,381 @@
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import deadlines
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth another attempt; everything else 4xx is the caller's fault
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+# Recent successful call latencies kept per client for the hedge delay
+LATENCY_WINDOW = 256
+
+# No hedging until this many latencies are known
+HEDGE_MIN_SAMPLES = 20
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream call fails after all retries"""
+
+
+class CircuitOpen(UpstreamError):
+    """Raised without calling the upstream while its circuit is open"""
+
+
+class RateLimited(UpstreamError):
+    """Raised without calling the upstream when its token bucket or daily
+    quota has nothing left within the allowed wait"""
+
+
+class DeadlineExceeded(UpstreamError):
+    """Raised when the request deadline leaves no time for (another) call"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After ``failure_threshold`` failed calls in a row the circuit opens and
+    calls fail immediately for ``reset_timeout`` seconds. Then one probe is
+    let through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            # Open, or half-open with the probe already in flight
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Give back a half-open probe that was let through but never
+        sent, so the next call can probe instead"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+
+class UpstreamClient:
+    """Keep-alive HTTP client for one upstream API.
+
+    Holds a pooled ``requests.Session``, applies connect/read timeouts to
+    every call, retries idempotent GETs with full-jitter exponential backoff
+    and trips a circuit breaker when the upstream keeps failing.
+
+    Timeouts are cut to the caller's deadline (see deadlines.py). With
+    ``hedge`` on, an attempt still unanswered after the recent
+    ``hedge_percentile`` latency is sent again, to the next of ``mirrors``
+    if any, otherwise to the same URL; the first answer wins. A losing
+    call is cancelled if it has not started, otherwise its connection is
+    dropped unread when it returns.
+    """
+
+    def __init__(self, name: str, connect_timeout: float = 1.0, read_timeout: float = 3.0,
+                 retries: int = 2, backoff: float = 0.1, max_backoff: float = 1.0,
+                 pool_size: int = 10, headers: Optional[Dict[str, str]] = None,
+                 breaker: Optional[CircuitBreaker] = None, rate_limiter=None,
+                 hedge: bool = False, hedge_percentile: float = 95.0, hedge_min_delay: float = 0.005,
+                 hedge_max_ratio: float = 0.1, mirrors: Optional[List[str]] = None):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.rate_limiter = rate_limiter
+
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        # Caps hedges as a share of requests, so a slow upstream is not
+        # sent double its traffic before the latency window catches up
+        self.hedge_max_ratio = hedge_max_ratio
+        self.mirrors = list(mirrors or [])
+        self._mirror_cycle = itertools.cycle(self.mirrors) if self.mirrors else None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._hedge_executor = ThreadPoolExecutor(max_workers=pool_size * 2, thread_name_prefix=f'{name}-hedge') \
+            if hedge else None
+
+        self.session = requests.Session()
+        # Retries are handled here so backoff and the breaker see every attempt
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.deadline_exceeded = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedge_saved_seconds = 0.0
+
+    def _count(self, **counters) -> None:
+        with self._lock:
+            for name, increment in counters.items():
+                setattr(self, name, getattr(self, name) + increment)
+
+    def get_json(self, url: str, params: Optional[Dict] = None) -> Dict:
+        """GET ``url`` and decode the JSON body.
+
+        Raises RateLimited when no token is available, CircuitOpen while the
+        circuit is open, DeadlineExceeded when the caller's deadline leaves
+        no time for a call and UpstreamError once the retries are used up.
+        Every attempt, retries and hedges included, spends a token; a call
+        refused by the open circuit spends none.
+        """
+        if self._attempt_timeout() is None:
+            self._count(deadline_exceeded=1)
+            raise DeadlineExceeded(f"{self.name} call skipped: request deadline already passed")
+        if not self.breaker.allow():
+            self._count(short_circuited=1)
+            raise CircuitOpen(f"{self.name} circuit is open")
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(self.name):
+            self.breaker.release()
+            raise RateLimited(f"{self.name} rate limit or daily quota reached")
+
+        last_error = None
+        attempts = 0
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                remaining = deadlines.remaining()
+                if remaining is not None and remaining <= delay:
+                    break
+                time.sleep(delay)
+                if self.rate_limiter is not None and not self.rate_limiter.acquire(self.name):
+                    break
+                self._count(retried=1)
+            timeout = self._attempt_timeout()
+            if timeout is None:
+                break
+            attempts += 1
+            self._count(requests=1)
+            try:
+                response = self._send(url, params, timeout)
+            except requests.RequestException as e:
+                last_error = e
+                continue
+
+            if response.status_code in RETRYABLE_STATUS:
+                response.close()
+                last_error = UpstreamError(f"{self.name} returned {response.status_code}")
+                continue
+            if response.status_code >= 400:
+                response.close()
+                # The upstream is healthy; the request itself was rejected
+                self.breaker.record_success()
+                raise UpstreamError(f"{self.name} rejected request: {response.status_code}")
+
+            try:
+                # With hedging the body is streamed, so read errors surface here
+                data = response.json()
+            except (ValueError, requests.RequestException) as e:
+                last_error = e
+                continue
+            finally:
+                response.close()
+            self.breaker.record_success()
+            return data
+
+        self._count(failures=1)
+        self.breaker.record_failure()
+        if self._attempt_timeout() is None:
+            self._count(deadline_exceeded=1)
+            raise DeadlineExceeded(f"{self.name} ran out of time after {attempts} attempts: {last_error}")
+        raise UpstreamError(f"{self.name} failed after {attempts} attempts: {last_error}")
+
+    def _attempt_timeout(self) -> Optional[Tuple[float, float]]:
+        """(connect, read) timeouts cut to the current deadline; None once
+        it has passed"""
+        remaining = deadlines.remaining()
+        if remaining is None:
+            return self.timeout
+        if remaining <= 0:
+            return None
+        return min(self.timeout[0], remaining), min(self.timeout[1], remaining)
+
+    def _timed_get(self, url: str, params: Optional[Dict], timeout) -> Tuple[requests.Response, float]:
+        started = time.perf_counter()
+        response = self.session.get(url, params=params, timeout=timeout, stream=self.hedge)
+        seconds = time.perf_counter() - started
+        if response.status_code < 400:
+            with self._lock:
+                self._latencies.append(seconds)
+        return response, seconds
+
+    def hedge_delay(self) -> Optional[float]:
+        """How long an attempt may run before it is hedged: the recent
+        hedge_percentile latency, or None while hedging is off or there is
+        too little history"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))
+        return max(self.hedge_min_delay, latencies[index])
+
+    def _hedge_url(self, url: str) -> str:
+        if self._mirror_cycle is None:
+            return url
+        mirror = urlsplit(next(self._mirror_cycle))
+        return urlunsplit((mirror.scheme, mirror.netloc) + tuple(urlsplit(url)[2:]))
+
+    def _send(self, url: str, params: Optional[Dict], timeout) -> requests.Response:
+        """One attempt, hedged when it outlives the hedge delay"""
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._timed_get(url, params, timeout)[0]
+
+        primary = self._hedge_executor.submit(self._timed_get, url, params, timeout)
+        done, _ = wait([primary], timeout=delay)
+        hedge_timeout = self._attempt_timeout()
+        with self._lock:
+            over_ratio = self.hedged >= self.hedge_max_ratio * self.requests
+        if done or hedge_timeout is None or over_ratio or (
+                self.rate_limiter is not None and not self.rate_limiter.acquire(self.name, max_wait=0)):
+            return primary.result()[0]
+
+        self._count(hedged=1)
+        hedge = self._hedge_executor.submit(self._timed_get, self._hedge_url(url), params, hedge_timeout)
+        pending = {primary, hedge}
+        fallback, last_error = None, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response, _ = future.result()
+                except requests.RequestException as e:
+                    last_error = e
+                    continue
+                if response.status_code in RETRYABLE_STATUS and pending:
+                    # Failed fast; the other call may still succeed
+                    fallback = response
+                    continue
+                if fallback is not None:
+                    fallback.close()
+                self._cancel_losers(pending, won_at=time.perf_counter())
+                if future is hedge:
+                    self._count(hedge_wins=1)
+                return response
+        if fallback is not None:
+            return fallback
+        raise last_error
+
+    def _cancel_losers(self, losers, won_at: float) -> None:
+        def discard(future):
+            if future.cancelled():
+                return
+            # Time the winner saved over this call, which would otherwise
+            # have been waited for
+            self._count(hedge_saved_seconds=time.perf_counter() - won_at)
+            try:
+                future.result()[0].close()
+            except Exception:
+                pass
+
+        for future in losers:
+            future.cancel()
+            future.add_done_callback(discard)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = {
+                'requests': self.requests,
+                'retried': self.retried,
+                'failures': self.failures,
+                'short_circuited': self.short_circuited,
+                'deadline_exceeded': self.deadline_exceeded,
+                'circuit': self.breaker.state,
+                'circuit_opened': self.breaker.times_opened
+            }
+            if self.hedge:
+                stats.update({
+                    'hedged': self.hedged,
+                    'hedge_rate': round(self.hedged / self.requests, 4) if self.requests else 0.0,
+                    'hedge_wins': self.hedge_wins,
+                    'hedge_saved_seconds': round(self.hedge_saved_seconds, 4)
+                })
+        if self.hedge:
+            delay = self.hedge_delay()
+            stats['hedge_delay'] = round(delay, 6) if delay is not None else None
+        if self.rate_limiter is not None:
+            stats['rate_limit'] = self.rate_limiter.stats(self.name)
+        return stats
+
+    def close(self) -> None:
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self.session.close()
+
+
+def client_from_env(name: str, api_key: str, rate_limiter=None) -> UpstreamClient:
+    """UpstreamClient configured from API_<NAME>_* environment variables"""
+    prefix = f'API_{name.upper()}_'
+    if rate_limiter is not None:
+        rate_limiter.configure_from_env(name)
+    return UpstreamClient(
+        name,
+        connect_timeout=float(os.environ.get(prefix + 'CONNECT_TIMEOUT', 1.0)),
+        read_timeout=float(os.environ.get(prefix + 'READ_TIMEOUT', 3.0)),
+        retries=int(os.environ.get(prefix + 'RETRIES', 2)),
+        pool_size=int(os.environ.get(prefix + 'POOL_SIZE', 10)),
+        headers={'Authorization': f'Bearer {api_key}'},
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.environ.get(prefix + 'BREAKER_THRESHOLD', 5)),
+            reset_timeout=float(os.environ.get(prefix + 'BREAKER_RESET', 30.0))
+        ),
+        rate_limiter=rate_limiter,
+        hedge=os.environ.get(prefix + 'HEDGE', '1') == '1',
+        hedge_percentile=float(os.environ.get(prefix + 'HEDGE_PERCENTILE', 95.0)),
+        hedge_max_ratio=float(os.environ.get(prefix + 'HEDGE_MAX_RATIO', 0.1)),
+        mirrors=[url for url in os.environ.get(prefix + 'MIRRORS', '').split(',') if url]
+    )
@@ -1,11 +1,31 @@
-from flask import Flask, render_template, request, redirect, url_for, session, make_response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, make_response, jsonify, Response, stream_with_context
+import codecs
+import io
 import json
 from datetime import datetime, timedelta
 import logging
+import math
 import os
 import secrets
+import threading
 import datetime as dt
 
+from bulk_export import EXPORT_RENDERER, RENDERERS, ExportJob, export_stats, job_progress
+from insight_rules import INSIGHT_ENGINE
+from pdf_forms import generate_pdf_form, pdf_stats
+from pdf_overlay import generate_overlay_pdf, overlay_stats
+from request_pipeline import RequestPipeline, Stage
+from result_store import ResultStore
+from session_store import SQLiteSessionInterface
+from reference_snapshot import warm_start
+from tax_engine import calculate_federal_tax, calculate_federal_tax_batch
+from third_party_apis import STATES, TaxAPIIntegration
+
+try:
+    from ml_tax_optimizer import TaxOptimizationML
+except ImportError:  # scikit-learn is optional; the rule engine covers insights without it
+    TaxOptimizationML = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,6 +41,61 @@ app.config.update(
     PERMANENT_SESSION_LIFETIME=timedelta(hours=2)
 )
 
+# Results are too big for a cookie; keep sessions server-side unless
+# SESSION_BACKEND=cookie asks for Flask's signed cookie sessions
+if os.environ.get('SESSION_BACKEND', 'sqlite') == 'sqlite':
+    app.session_interface = SQLiteSessionInterface()
+
+# Per-stage deadlines (seconds) for the /calculate pipeline
+STAGE_DEADLINES = {
+    name: float(os.environ.get(f'PIPELINE_DEADLINE_{name.upper()}', default))
+    for name, default in {
+        'tax': 2.0,
+        'insights': 2.0,
+        'state_tax': 0.5,
+        'enhanced_deductions': 0.5,
+        'inflation': 0.5,
+        'ml_scoring': 1.0
+    }.items()
+}
+
+# Freshness of successful /api/v1/calculate responses for HTTP caches
+API_RESPONSE_MAX_AGE = int(os.environ.get('API_RESPONSE_MAX_AGE', 300))
+
+# /api/v1/calculate/batch: returns computed per chunk, returns accepted per
+# request and the longest accepted record (characters)
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 1000))
+BATCH_MAX_RECORDS = int(os.environ.get('BATCH_MAX_RECORDS', 100000))
+BATCH_MAX_RECORD_SIZE = 64 * 1024
+BATCH_READ_SIZE = 64 * 1024
+
+# Batch chunks computed at once in this process; further chunks wait their
+# turn, so large batches cannot take every thread from interactive requests
+BATCH_SLOTS = threading.BoundedSemaphore(int(os.environ.get('BATCH_CONCURRENCY', 2)))
+
+# PDF renderer for /download_form: 'flow' (platypus layout) or 'overlay'
+# (fixed layout drawn straight onto prebuilt pages, see pdf_overlay)
+PDF_RENDERER = os.environ.get('PDF_RENDERER', 'flow')
+
+# /api/v1/export: stored returns per export, and exports running at once in
+# this process (each keeps the shared render pool busy)
+EXPORT_MAX_RESULTS = int(os.environ.get('EXPORT_MAX_RESULTS', 100000))
+EXPORT_SLOTS = threading.BoundedSemaphore(int(os.environ.get('EXPORT_CONCURRENCY', 1)))
+
+REQUEST_PIPELINE = RequestPipeline()
+RESULT_STORE = ResultStore()
+tax_api = TaxAPIIntegration()
+
+# Seed the API cache from the reference snapshot before serving traffic
+REFERENCE_WARM_START = warm_start(tax_api)
+
+ml_optimizer = None
+if TaxOptimizationML is not None:
+    try:
+        ml_optimizer = TaxOptimizationML()
+    except Exception as e:
+        logger.warning(f"ML models unavailable, serving rule-based insights only: {e}")
+
 def clean_numeric_input(value, default='0'):
     """Clean and convert numeric input to float"""
     if not value:
@@ -66,7 +141,7 @@ def validate_input(data):
             age = int(float(age_str))
             if age < 18 or age > 120:
                 errors.append("Age must be between 18 and 120")
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         errors.append("Invalid age - please enter a valid number")
     
     # Validate dependents
@@ -86,7 +161,7 @@ def validate_input(data):
         elif filing_status == 'head_of_household' and dependents == 0:
             errors.append("Head of Household filing status requires at least 1 dependent")
             
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         errors.append("Invalid number of dependents - please enter a valid number")
     
     # Validate deductions
@@ -114,8 +189,13 @@ def validate_input(data):
 @app.before_request
 def before_request():
     """Run before each request"""
-    session.permanent = True
-    app.permanent_session_lifetime = timedelta(hours=2)
+    if request.path.startswith('/api/'):
+        # The JSON API is stateless; touching the session would set a cookie
+        return
+    
+    if not session.permanent:
+        # Setting it unconditionally would mark every session modified
+        session.permanent = True
     
     if request.endpoint not in ['static']:
         logger.debug(f"Request to {request.endpoint}, Session has user_data: {'user_data' in session}")
@@ -138,183 +218,148 @@ def health_check():
         'version': '1.0.0'
     }), 200
 
+@app.route('/metrics')
+def metrics():
+    """Pipeline degradation rates, per-stage latency, API cache, result store, PDF render time, ML executor and refund surrogate counters"""
+    return jsonify({
+        'pipeline_requests': REQUEST_PIPELINE.request_stats(),
+        'pipeline_stages': REQUEST_PIPELINE.stats(),
+        'api_cache': tax_api.cache_stats(),
+        'api_upstreams': tax_api.client_stats(),
+        'reference_warm_start': REFERENCE_WARM_START,
+        'result_store': RESULT_STORE.stats(),
+        'pdf_forms': pdf_stats(),
+        'pdf_overlay': overlay_stats(),
+        'bulk_export': export_stats(),
+        'ml_executor': ml_optimizer.executor_stats() if ml_optimizer is not None else None,
+        'refund_surrogate': ml_optimizer.surrogate_stats() if ml_optimizer is not None else None
+    }), 200
+
 def generate_ai_insights(user_data, tax_result):
-    """Generate simplified AI insights based on tax data"""
-    
-    # Calculate optimization potential based on income and deductions
-    income = user_data.get('income', 0)
-    deductions = tax_result.get('total_deductions', 0)
-    dependents = user_data.get('dependents', 0)
-    age = user_data.get('age', 30)
-    
-    # Optimization potential logic
-    optimization_score = 0
-    if income > 50000 and deductions < income * 0.15:
-        optimization_score += 0.3
-    if dependents == 0 and income > 30000:
-        optimization_score += 0.2
-    if age < 65 and income > 40000:
-        optimization_score += 0.2
-    if user_data.get('itemized_deductions', 0) == 0:
-        optimization_score += 0.3
-    
-    if optimization_score >= 0.8:
-        optimization_potential = "high"
-        confidence = 0.85
-    elif optimization_score >= 0.5:
-        optimization_potential = "medium"
-        confidence = 0.75
-    else:
-        optimization_potential = "low"
-        confidence = 0.65
-    
-    # Audit risk assessment
-    risk_factors = []
-    risk_score = 0
-    
-    if income > 200000:
-        risk_score += 0.3
-        risk_factors.append("High income level")
-    
-    if user_data.get('itemized_deductions', 0) > income * 0.3:
-        risk_score += 0.4
-        risk_factors.append("High deduction ratio")
-    
-    if dependents > 3:
-        risk_score += 0.2
-        risk_factors.append("Multiple dependents")
-    
-    if age < 25 and income > 100000:
-        risk_score += 0.3
-        risk_factors.append("Young high earner")
-    
-    if risk_score >= 0.7:
-        risk_level = "high"
-        risk_probability = 0.25
-    elif risk_score >= 0.4:
-        risk_level = "medium"
-        risk_probability = 0.15
-    else:
-        risk_level = "low"
-        risk_probability = 0.05
-    
-    # Generate planning suggestions
-    planning_suggestions = []
-    
-    if user_data.get('itemized_deductions', 0) == 0:
-        planning_suggestions.append({
-            'category': 'Deductions',
-            'suggestion': 'Consider itemizing deductions if you have significant medical expenses, mortgage interest, or charitable contributions',
-            'potential_savings': min(income * 0.05, 5000),
-            'priority': 'high',
-            'effort': 'medium',
-            'implementation': 'Gather receipts and documentation for potential deductions'
-        })
+    """Generate simplified AI insights based on tax data
     
-    if dependents == 0 and income > 30000:
-        planning_suggestions.append({
-            'category': 'Credits',
-            'suggestion': 'Consider contributing to a retirement account to reduce taxable income',
-            'potential_savings': min(income * 0.03, 3000),
-            'priority': 'medium',
-            'effort': 'low',
-            'implementation': 'Open an IRA or increase 401(k) contributions'
+    The rules live in insight_rules; a single return is evaluated as a
+    batch of one so it shares the vectorized path with bulk jobs.
+    """
+    return INSIGHT_ENGINE.generate(user_data, tax_result)
+
+def generate_ai_insights_batch(user_records, tax_results):
+    """Generate AI insights for many returns in one vectorized pass"""
+    return INSIGHT_ENGINE.generate_batch(user_records, tax_results)
+
+def build_enhanced_deductions(processed_data):
+    """Rule-based deduction suggestions, used when the deductions API is unavailable"""
+    income = processed_data['income']
+    
+    enhanced_deductions = []
+    total_estimated_savings = 0
+    
+    # Add sample deductions based on user data
+    if processed_data.get('itemized_deductions', 0) == 0:
+        enhanced_deductions.append({
+            'type': 'Medical Expenses',
+            'description': 'Medical and dental expenses that exceed 7.5% of adjusted gross income',
+            'potential_deduction': min(income * 0.03, 3000),
+            'tax_savings': min(income * 0.03 * 0.22, 660)  # Assuming 22% tax bracket
         })
-    
-    if age < 65 and income > 40000:
-        planning_suggestions.append({
-            'category': 'Planning',
-            'suggestion': 'Consider health savings account (HSA) contributions if eligible',
-            'potential_savings': min(income * 0.02, 2000),
-            'priority': 'medium',
-            'effort': 'medium',
-            'implementation': 'Check HSA eligibility and contribution limits'
+        total_estimated_savings += min(income * 0.03 * 0.22, 660)
+    
+    if processed_data.get('dependents', 0) > 0:
+        enhanced_deductions.append({
+            'type': 'Child Care Credit',
+            'description': 'Child and dependent care credit for work-related expenses',
+            'potential_deduction': min(processed_data.get('dependents', 0) * 3000, 6000),
+            'tax_savings': min(processed_data.get('dependents', 0) * 600, 1200)
         })
+        total_estimated_savings += min(processed_data.get('dependents', 0) * 600, 1200)
     
     if income > 50000:
-        planning_suggestions.append({
-            'category': 'Investment',
-            'suggestion': 'Consider tax-loss harvesting to offset capital gains',
-            'potential_savings': min(income * 0.01, 1000),
-            'priority': 'low',
-            'effort': 'high',
-            'implementation': 'Review investment portfolio for loss opportunities'
+        enhanced_deductions.append({
+            'type': 'Retirement Contributions',
+            'description': 'Traditional IRA or 401(k) contributions to reduce taxable income',
+            'potential_deduction': min(income * 0.05, 6000),
+            'tax_savings': min(income * 0.05 * 0.22, 1320)
         })
-    
-    if dependents > 0:
-        planning_suggestions.append({
-            'category': 'Family',
-            'suggestion': 'Maximize child tax credit and dependent care benefits',
-            'potential_savings': min(dependents * 1500, 4500),
-            'priority': 'high',
-            'effort': 'low',
-            'implementation': 'Ensure proper documentation of dependent expenses'
+        total_estimated_savings += min(income * 0.05 * 0.22, 1320)
+    
+    if income > 40000:
+        enhanced_deductions.append({
+            'type': 'Student Loan Interest',
+            'description': 'Student loan interest deduction (up to $2,500)',
+            'potential_deduction': min(2500, income * 0.02),
+            'tax_savings': min(2500 * 0.22, 550)
         })
+        total_estimated_savings += min(2500 * 0.22, 550)
     
-    if income > 75000:
-        planning_suggestions.append({
-            'category': 'Advanced',
-            'suggestion': 'Consider tax-advantaged investment strategies',
-            'potential_savings': min(income * 0.02, 2000),
-            'priority': 'low',
-            'effort': 'high',
-            'implementation': 'Consult with a financial advisor for tax-efficient investing'
-        })
+    return {
+        'additional_deductions': enhanced_deductions,
+        'estimated_savings': total_estimated_savings
+    }
+
+def build_calculation_stages(processed_data):
+    """Stages for one /calculate request.
+    
+    Only the rule insights and model scoring wait for the tax result; the
+    API lookups start immediately, so the request takes as long as the
+    slowest stage rather than the sum of them. Enhanced deductions are the
+    local rule-based list; lookups degrade to the last value seen for the
+    same key.
+    """
+    income = processed_data['income']
+    state = processed_data['state']
+    
+    stages = [
+        Stage('tax', lambda inputs: calculate_federal_tax(processed_data),
+              STAGE_DEADLINES['tax'], required=True),
+        Stage('insights', lambda inputs: generate_ai_insights(processed_data, inputs['tax']),
+              STAGE_DEADLINES['insights'], depends_on=['tax'], required=True),
+        Stage('state_tax', lambda inputs: tax_api.get_state_tax_info(state, income),
+              STAGE_DEADLINES['state_tax'], cache_key=f"{state}_{int(income / 1000)}"),
+        Stage('enhanced_deductions', lambda inputs: build_enhanced_deductions(processed_data),
+              STAGE_DEADLINES['enhanced_deductions']),
+        Stage('inflation', lambda inputs: tax_api.get_inflation_adjustments(),
+              STAGE_DEADLINES['inflation'], cache_key='default')
+    ]
+    
+    if ml_optimizer is not None:
+        # No fallback needed: the rule insights stand in for the model scores
+        stages.append(Stage('ml_scoring', lambda inputs: {
+            'refund': ml_optimizer.predict_refund_optimization(processed_data, fast=True),
+            'audit_risk': ml_optimizer.assess_audit_risk(processed_data, inputs['tax'])
+        }, STAGE_DEADLINES['ml_scoring'], depends_on=['tax'], executor=ml_optimizer.executor))
+    
+    return stages
+
+def run_calculation(processed_data):
+    """Compute one return: tax result, insights and API enhancements.
     
-    # Generate optimization recommendations
-    recommendations = []
-    if optimization_potential == "high":
-        recommendations.append({
-            'type': 'deduction_optimization',
-            'description': 'High potential for additional deductions through itemization',
-            'estimated_savings': min(income * 0.08, 8000),
-            'effort': 'medium'
-        })
+    Runs the tax engine, enrichment lookups and ML scoring as concurrent
+    stages; each one that misses its deadline falls back or is dropped.
+    Shared by the form flow and the JSON API, and touches neither the
+    session nor templates.
+    """
+    outcome = REQUEST_PIPELINE.run(build_calculation_stages(processed_data))
+    values = outcome['values']
     
-    if dependents > 0:
-        recommendations.append({
-            'type': 'credit_optimization',
-            'description': 'Optimize child and dependent care credits',
-            'estimated_savings': min(dependents * 1000, 3000),
-            'effort': 'low'
-        })
+    tax_result = values['tax']
+    ml_insights = values['insights']
+    if values.get('ml_scoring'):
+        ml_insights['model_scores'] = values['ml_scoring']
     
-    if income > 50000 and user_data.get('itemized_deductions', 0) == 0:
-        recommendations.append({
-            'type': 'retirement_planning',
-            'description': 'Consider retirement account contributions to reduce taxable income',
-            'estimated_savings': min(income * 0.03, 3000),
-            'effort': 'low'
-        })
+    api_enhancements = {
+        'enhanced_deductions': values['enhanced_deductions']
+    }
+    if values.get('state_tax'):
+        api_enhancements['state_tax_info'] = values['state_tax']
+    if values.get('inflation'):
+        api_enhancements['inflation_adjustment'] = values['inflation']
     
-    if age < 65 and income > 40000:
-        recommendations.append({
-            'type': 'health_savings',
-            'description': 'Health savings account (HSA) contributions if eligible',
-            'estimated_savings': min(income * 0.02, 2000),
-            'effort': 'medium'
-        })
+    if outcome['degraded']:
+        api_enhancements['degraded_stages'] = outcome['degraded']
+        logger.warning(f"Calculation pipeline degraded: {outcome['degraded']} "
+                       f"(timed out {outcome['timed_out']}, errors {list(outcome['errors'])})")
     
-    return {
-        'optimization': {
-            'optimization_potential': optimization_potential,
-            'optimization_confidence': confidence,
-            'predicted_refund': max(0, tax_result.get('refund_or_owe', 0) + min(income * 0.05, 5000)),
-            'recommendations': recommendations
-        },
-        'audit_risk': {
-            'risk_level': risk_level,
-            'risk_probability': risk_probability,
-            'risk_factors': risk_factors,
-            'mitigation_suggestions': [
-                'Ensure all deductions are properly documented',
-                'Keep detailed records of income sources',
-                'Consider consulting a tax professional'
-            ] if risk_level != "low" else []
-        },
-        'planning_suggestions': planning_suggestions,
-        'confidence_score': confidence
-    }
+    return tax_result, ml_insights, api_enhancements, outcome
 
 @app.route('/calculate', methods=['POST'])
 def calculate_tax():
@@ -329,6 +374,8 @@ def calculate_tax():
         session.pop('tax_result', None)
         session.pop('ml_insights', None)
         session.pop('api_enhancements', None)
+        session.pop('result_id', None)
+        session.pop('result_version', None)
         
         # Get and clean form data
         print("Step 1: Processing form data...")
@@ -389,170 +436,36 @@ def calculate_tax():
         # Store in session
         session['user_data'] = processed_data
         
-        # Basic tax calculation (simplified for now)
-        # Standard deductions for 2023
-        standard_deductions = {
-            'single': 13850,
-            'married_joint': 27700,
-            'married_separate': 13850,
-            'head_of_household': 20800
-        }
-        
-        # Use standard deduction if itemized is less
-        deduction = max(standard_deductions.get(filing_status, 13850), itemized_deductions)
-        taxable_income = max(0, income - deduction)
-        
-        # Simplified tax calculation (2023 brackets)
-        tax_brackets = {
-            'single': [
-                (0, 11000, 0.10),
-                (11000, 44725, 0.12),
-                (44725, 95375, 0.22),
-                (95375, 182100, 0.24),
-                (182100, 231250, 0.32),
-                (231250, 578125, 0.35),
-                (578125, float('inf'), 0.37)
-            ],
-            'married_joint': [
-                (0, 22000, 0.10),
-                (22000, 89450, 0.12),
-                (89450, 190750, 0.22),
-                (190750, 364200, 0.24),
-                (364200, 462500, 0.32),
-                (462500, 693750, 0.35),
-                (693750, float('inf'), 0.37)
-            ],
-            'married_separate': [
-                (0, 11000, 0.10),
-                (11000, 44725, 0.12),
-                (44725, 95375, 0.22),
-                (95375, 182100, 0.24),
-                (182100, 231250, 0.32),
-                (231250, 346875, 0.35),
-                (346875, float('inf'), 0.37)
-            ],
-            'head_of_household': [
-                (0, 15700, 0.10),
-                (15700, 59850, 0.12),
-                (59850, 95350, 0.22),
-                (95350, 182100, 0.24),
-                (182100, 231250, 0.32),
-                (231250, 578100, 0.35),
-                (578100, float('inf'), 0.37)
-            ]
-        }
-        
-        brackets = tax_brackets.get(filing_status, tax_brackets['single'])
-        total_tax = 0
-        remaining_income = taxable_income
-        
-        for i, (min_income, max_income, rate) in enumerate(brackets):
-            if remaining_income <= 0:
-                break
-            
-            if i == 0:  # First bracket
-                bracket_income = min(remaining_income, max_income)
-            else:
-                bracket_income = min(remaining_income, max_income - brackets[i-1][1])
-            
-            total_tax += bracket_income * rate
-            remaining_income -= bracket_income
-        
-        # Child tax credit (simplified)
-        child_credit = min(dependents * 2000, total_tax)
-        final_tax = max(0, total_tax - child_credit)
-        
-        # Calculate refund/amount owed
-        refund_or_owe = withholding - final_tax
-        
-        # Store results
-        tax_result = {
-            'total_income': income,
-            'total_deductions': deduction,
-            'standard_deduction': standard_deductions.get(filing_status, 13850),
-            'taxable_income': taxable_income,
-            'federal_tax_before_credits': total_tax,
-            'child_tax_credit': child_credit,
-            'tax_owed': final_tax,
-            'withholding': withholding,
-            'refund_or_owe': refund_or_owe,
-            'is_refund': refund_or_owe > 0,
-            'effective_tax_rate': round((final_tax / income) * 100, 1) if income > 0 else 0,
-            'marginal_tax_rate': 0
-        }
-        
-        # Calculate marginal tax rate based on the highest bracket used
-        for min_income, max_income, rate in brackets:
-            if taxable_income > min_income:
-                tax_result['marginal_tax_rate'] = round(rate * 100, 1)
-            if taxable_income <= max_income:
-                break
-        
-        # Generate AI insights
         print("Step 3: Generating AI insights...")
-        ml_insights = generate_ai_insights(processed_data, tax_result)
+        tax_result, ml_insights, api_enhancements, outcome = run_calculation(processed_data)
+        refund_or_owe = tax_result['refund_or_owe']
         print(f"  AI insights generated: optimization={ml_insights['optimization']['optimization_potential']}, risk={ml_insights['audit_risk']['risk_level']}")
-        
-        # Generate sample enhanced deductions data
-        enhanced_deductions = []
-        total_estimated_savings = 0
-        
-        # Add sample deductions based on user data
-        if processed_data.get('itemized_deductions', 0) == 0:
-            enhanced_deductions.append({
-                'type': 'Medical Expenses',
-                'description': 'Medical and dental expenses that exceed 7.5% of adjusted gross income',
-                'potential_deduction': min(income * 0.03, 3000),
-                'tax_savings': min(income * 0.03 * 0.22, 660)  # Assuming 22% tax bracket
-            })
-            total_estimated_savings += min(income * 0.03 * 0.22, 660)
-        
-        if processed_data.get('dependents', 0) > 0:
-            enhanced_deductions.append({
-                'type': 'Child Care Credit',
-                'description': 'Child and dependent care credit for work-related expenses',
-                'potential_deduction': min(processed_data.get('dependents', 0) * 3000, 6000),
-                'tax_savings': min(processed_data.get('dependents', 0) * 600, 1200)
-            })
-            total_estimated_savings += min(processed_data.get('dependents', 0) * 600, 1200)
-        
-        if income > 50000:
-            enhanced_deductions.append({
-                'type': 'Retirement Contributions',
-                'description': 'Traditional IRA or 401(k) contributions to reduce taxable income',
-                'potential_deduction': min(income * 0.05, 6000),
-                'tax_savings': min(income * 0.05 * 0.22, 1320)
-            })
-            total_estimated_savings += min(income * 0.05 * 0.22, 1320)
-        
-        if income > 40000:
-            enhanced_deductions.append({
-                'type': 'Student Loan Interest',
-                'description': 'Student loan interest deduction (up to $2,500)',
-                'potential_deduction': min(2500, income * 0.02),
-                'tax_savings': min(2500 * 0.22, 550)
-            })
-            total_estimated_savings += min(2500 * 0.22, 550)
-        
-        api_enhancements = {
-            'enhanced_deductions': {
-                'additional_deductions': enhanced_deductions,
-                'estimated_savings': total_estimated_savings
-            }
-        }
+        logger.debug(f"Calculation pipeline finished in {outcome['total_seconds'] * 1000:.1f} ms: {outcome['timings']}")
         
         # Store enhanced results in session
         session['tax_result'] = tax_result
         session['ml_insights'] = ml_insights
         session['api_enhancements'] = api_enhancements
         
+        # Print, PDF and suggestion views are rendered once per result and
+        # served from the store after that
+        session['result_id'], session['result_version'] = RESULT_STORE.put({
+            'user_data': processed_data,
+            'tax_result': tax_result,
+            'ml_insights': ml_insights,
+            'api_enhancements': api_enhancements
+        })
+        
         print(f"  Calculation complete: refund/owe = ${refund_or_owe:,.2f}")
         
-        return render_template('results.html', 
+        response = make_response(render_template('results.html', 
                              user_data=processed_data, 
                              tax_result=tax_result,
                              ml_insights=ml_insights,
-                             api_enhancements=api_enhancements)
+                             api_enhancements=api_enhancements))
+        if outcome['degraded']:
+            response.headers['X-Degraded'] = ','.join(outcome['degraded'])
+        return response
         
     except Exception as e:
         print(f"  ERROR: {str(e)}")
@@ -560,18 +473,351 @@ def calculate_tax():
         return render_template('index.html', 
                              errors=[f"An error occurred during calculation: {str(e)}"])
 
-@app.route('/optimization_suggestions')
-def get_optimization_suggestions():
-    """Get AI-powered tax optimization suggestions"""
+def validate_api_input(data):
+    """validate_input plus the state code, which the form defaults, and
+    finite amounts ("nan" and "1e400" parse as floats but pass the range
+    checks)"""
+    errors = validate_input(data)
+    for field, error in (('income', "Invalid income amount"),
+                         ('itemized_deductions', "Invalid deduction amount"),
+                         ('withholding', "Invalid withholding amount")):
+        if not math.isfinite(clean_numeric_input(data.get(field, '0'))) and error not in errors:
+            errors.append(error)
+    if str(data.get('state') or 'CA').strip().upper() not in STATES:
+        errors.append("Invalid state")
+    return errors
+
+def process_api_input(data):
+    """Convert validated API input to the processed_data shape used by /calculate"""
+    return {
+        'income': clean_numeric_input(data.get('income', '0')),
+        'filing_status': data.get('filing_status'),
+        'age': int(float(str(data.get('age')).strip())),
+        'dependents': int(float(str(data.get('dependents', '0')).strip() or '0')),
+        'itemized_deductions': clean_numeric_input(data.get('itemized_deductions', '0')),
+        'withholding': clean_numeric_input(data.get('withholding', '0')),
+        'state': str(data.get('state') or 'CA').strip().upper()
+    }
+
+@app.route('/api/v1/calculate', methods=['GET', 'POST'])
+def api_calculate():
+    """Stateless JSON version of /calculate.
+    
+    Takes the form fields as a JSON object (POST) or query parameters
+    (GET) and returns the same tax_result, ml_insights and
+    api_enhancements the results page shows. Nothing is written to the
+    session, so any worker can answer and GET responses can be cached by
+    URL; the ETag lets clients revalidate without a new calculation. A
+    POST also keeps the result in RESULT_STORE under the returned
+    result_id, which /api/v1/export on the same host accepts; a GET
+    writes nothing.
+    """
+    data = request.args if request.method == 'GET' else request.get_json(silent=True)
+    if not isinstance(data, dict) and request.method == 'POST':
+        return jsonify({'errors': ['Request body must be a JSON object']}), 400
+    
+    errors = validate_api_input(data)
+    if errors:
+        return jsonify({'errors': errors}), 400
+    
+    try:
+        processed_data = process_api_input(data)
+        tax_result, ml_insights, api_enhancements, outcome = run_calculation(processed_data)
+    except Exception as e:
+        logger.error(f"API tax calculation error: {str(e)}")
+        return jsonify({'errors': [f"An error occurred during calculation: {str(e)}"]}), 500
+    
+    result = {
+        'user_data': processed_data,
+        'tax_result': tax_result,
+        'ml_insights': ml_insights,
+        'api_enhancements': api_enhancements
+    }
+    if request.method == 'POST':
+        result_id, _ = RESULT_STORE.put(result)
+        response = jsonify(dict(result, result_id=result_id))
+    else:
+        response = jsonify(result)
+    response.add_etag()
+    if outcome['degraded']:
+        # A degraded answer should be recomputed, not reused
+        response.headers['X-Degraded'] = ','.join(outcome['degraded'])
+        response.headers['Cache-Control'] = 'no-store'
+    elif request.method == 'POST':
+        # Stored under its result_id for this client; not for shared caches
+        response.headers['Cache-Control'] = 'private, no-cache'
+    else:
+        response.headers['Cache-Control'] = f'public, max-age={API_RESPONSE_MAX_AGE}'
+    return response.make_conditional(request)
+
+def iter_batch_records(stream):
+    """Yield the records of an NDJSON or JSON array request body as they
+    are read, so memory does not grow with the size of the body.
+    
+    A record that cannot be decoded is yielded as a ValueError in its
+    place. NDJSON continues with the next line; a broken JSON array ends
+    the stream.
+    """
+    if isinstance(stream, io.RawIOBase):
+        # Werkzeug's input stream is unbuffered and reads lines byte by byte
+        stream = io.BufferedReader(stream, BATCH_READ_SIZE)
+    first_line = stream.readline(BATCH_MAX_RECORD_SIZE)
+    while first_line and not first_line.strip():
+        # Leading blank lines do not tell NDJSON from an array
+        first_line = stream.readline(BATCH_MAX_RECORD_SIZE)
+    if first_line.lstrip().startswith(b'['):
+        yield from _iter_json_array(stream, first_line)
+        return
+    
+    line = first_line
+    while line:
+        if len(line) >= BATCH_MAX_RECORD_SIZE and not line.endswith(b'\n'):
+            # Skip the rest of an oversized line
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(BATCH_READ_SIZE)
+            yield ValueError(f"Record longer than {BATCH_MAX_RECORD_SIZE} bytes")
+        elif line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"Invalid JSON: {e}")
+        line = stream.readline(BATCH_MAX_RECORD_SIZE)
+
+def _iter_json_array(stream, head):
+    """Decode a JSON array one element at a time from a bounded buffer"""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = text.decode(head)
+    pos = buffer.index('[') + 1
+    eof = False
+    expect_value = True
+    empty = True
+    
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer) and not eof:
+            chunk = stream.read(BATCH_READ_SIZE)
+            eof = not chunk
+            buffer = text.decode(chunk, final=eof)
+            pos = 0
+            continue
+        if pos == len(buffer):
+            yield ValueError("JSON array is not closed")
+            return
+        
+        char = buffer[pos]
+        if char == ']' and (empty or not expect_value):
+            return
+        if not expect_value:
+            if char != ',':
+                yield ValueError(f"Expected ',' or ']' in JSON array, found {char!r}")
+                return
+            pos += 1
+            expect_value = True
+            continue
+        
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except ValueError as e:
+            value, end = e, None
+        if end is None or (end == len(buffer) and not eof):
+            # The element may be cut off at the end of the buffer
+            if eof or len(buffer) - pos > BATCH_MAX_RECORD_SIZE:
+                yield ValueError(f"Invalid JSON array element: {value}")
+                return
+            chunk = stream.read(BATCH_READ_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + text.decode(chunk, final=eof)
+            pos = 0
+            continue
+        
+        yield value
+        pos = end
+        expect_value = False
+        empty = False
+
+def predict_refunds_batch(processed):
+    """Refund predictions with intervals for a chunk, or None for each
+    return when the models are unavailable"""
+    if ml_optimizer is None:
+        return [None] * len(processed)
+    try:
+        return ml_optimizer.predict_refund_batch(processed)
+    except Exception as e:
+        logger.error(f"Batch refund prediction failed: {str(e)}")
+        return [None] * len(processed)
+
+def calculate_batch_chunk(items):
+    """NDJSON lines for one chunk of (index, record) pairs.
+    
+    Valid returns go through the vectorized tax engine, insight rules and
+    refund interval prediction together; invalid ones get their validation
+    errors. Lines keep the
+    input order, and echo the record's "id" when it has one.
+    """
+    results = [None] * len(items)
+    valid = []
+    for position, (index, record) in enumerate(items):
+        if isinstance(record, Exception):
+            errors = [str(record)]
+        elif not isinstance(record, dict):
+            errors = ["Record must be a JSON object"]
+        else:
+            errors = validate_api_input(record)
+        if errors:
+            results[position] = {'index': index, 'errors': errors}
+        else:
+            valid.append((position, index, record, process_api_input(record)))
+    
+    if valid:
+        with BATCH_SLOTS:
+            processed = [item[3] for item in valid]
+            tax_results = calculate_federal_tax_batch(processed)
+            insights = generate_ai_insights_batch(processed, tax_results)
+            refunds = predict_refunds_batch(processed)
+        for (position, index, record, _), tax_result, ml_insights, refund in zip(valid, tax_results, insights, refunds):
+            if refund is not None:
+                ml_insights['model_scores'] = {'refund': refund}
+            results[position] = {'index': index, 'tax_result': tax_result, 'ml_insights': ml_insights}
+    
+    lines = []
+    for (index, record), result in zip(items, results):
+        if isinstance(record, dict) and 'id' in record:
+            result['id'] = record['id']
+        try:
+            # NaN and Infinity are not JSON; strict clients reject the line
+            lines.append(json.dumps(result, separators=(',', ':'), allow_nan=False) + '\n')
+        except ValueError:
+            logger.error(f"Batch result {index} has a non-finite value")
+            error = {'index': index, 'errors': ["Result contains a non-finite number"]}
+            if 'id' in result:
+                error['id'] = result['id']
+            lines.append(json.dumps(error, separators=(',', ':')) + '\n')
+    return ''.join(lines)
+
+@app.route('/api/v1/calculate/batch', methods=['POST'])
+def api_calculate_batch():
+    """Calculate many returns in one request.
+    
+    The body is NDJSON (one return per line) or a JSON array of returns
+    with the /api/v1/calculate fields. Results stream back as NDJSON, one
+    line per return in input order, each chunk as soon as it is computed.
+    The federal tax result, rule insights and the refund prediction with
+    its interval are computed; the other model scores and API enrichment
+    stay with the single-return endpoint.
+    """
+    def generate():
+        chunk = []
+        count = 0
+        try:
+            for record in iter_batch_records(request.stream):
+                if count == BATCH_MAX_RECORDS:
+                    yield json.dumps({'error': f"Batch limited to {BATCH_MAX_RECORDS} returns"}) + '\n'
+                    break
+                chunk.append((count, record))
+                count += 1
+                if len(chunk) == BATCH_CHUNK_SIZE:
+                    yield calculate_batch_chunk(chunk)
+                    chunk = []
+            if chunk:
+                yield calculate_batch_chunk(chunk)
+        except Exception as e:
+            logger.error(f"Batch calculation error after {count} returns: {str(e)}")
+            yield json.dumps({'error': f"An error occurred during calculation: {str(e)}"}) + '\n'
+        logger.info(f"Batch calculation streamed {count} returns")
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/v1/export', methods=['POST'])
+def api_export():
+    """Stream a ZIP archive with the PDF of each stored return.
+    
+    Takes {"result_ids": [...], "renderer": "overlay" | "flow"}. PDFs are
+    rendered in a process pool and written to the response as they come
+    back; the archive ends with export_report.json (counts, throughput and
+    the ids that failed). Progress is at /api/v1/export/<X-Export-Job>.
+    """
+    data = request.get_json(silent=True)
+    result_ids = data.get('result_ids') if isinstance(data, dict) else None
+    if not isinstance(result_ids, list) or not all(isinstance(rid, str) for rid in result_ids):
+        return jsonify({'errors': ['Request body must be a JSON object with a list of result_ids']}), 400
+    if len(result_ids) > EXPORT_MAX_RESULTS:
+        return jsonify({'errors': [f"At most {EXPORT_MAX_RESULTS} returns per export"]}), 413
+    renderer = data.get('renderer', EXPORT_RENDERER)
+    if renderer not in RENDERERS:
+        return jsonify({'errors': [f"renderer must be one of: {', '.join(sorted(RENDERERS))}"]}), 400
+    
+    if not EXPORT_SLOTS.acquire(blocking=False):
+        response = jsonify({'errors': ['Another export is running; try again later']})
+        response.headers['Retry-After'] = '60'
+        return response, 429
+    
+    job = ExportJob(RESULT_STORE, result_ids, total=len(result_ids), renderer=renderer)
+    logger.info(f"Export {job.id} started: {len(result_ids)} returns, {renderer} renderer")
+    response = Response(job.stream_zip(), mimetype='application/zip')
+    response.call_on_close(EXPORT_SLOTS.release)
+    response.headers['Content-Disposition'] = f'attachment; filename=tax_returns_{dt.datetime.now().strftime("%Y%m%d")}.zip'
+    response.headers['X-Export-Job'] = job.id
+    return response
+
+@app.route('/api/v1/export/<job_id>')
+def api_export_status(job_id):
+    """Progress of an export running or recently run on this host"""
+    progress = job_progress(RESULT_STORE, job_id)
+    if progress is None:
+        return jsonify({'errors': ['Unknown export job']}), 404
+    return jsonify(progress)
+
+def session_result():
+    """The return computed for this session, as stored in RESULT_STORE"""
+    return {
+        'user_data': session['user_data'],
+        'tax_result': session['tax_result'],
+        'ml_insights': session.get('ml_insights', {}),
+        'api_enhancements': session.get('api_enhancements', {})
+    }
+
+def serve_artifact(kind, render, mimetype, headers=None, dated=False):
+    """Serve an artifact of the session's return from RESULT_STORE.
+    
+    ``render(result)`` runs only when the store does not have the artifact
+    yet. Responses carry the artifact's ETag and must be revalidated, so a
+    repeat view with a matching If-None-Match gets an empty 304. A
+    ``dated`` artifact prints the date it was rendered, so it is stored
+    per day and not served on later days; it prints no time of day, as
+    one copy serves the whole day.
+    """
     if 'user_data' not in session or 'tax_result' not in session:
         return redirect(url_for('index'))
     
-    ml_insights = session.get('ml_insights', {})
-    
-    return render_template('optimization_suggestions.html',
-                         user_data=session['user_data'],
-                         tax_result=session['tax_result'],
-                         ml_insights=ml_insights)
+    if 'result_id' not in session:
+        # Sessions from before the result store
+        session['result_id'], session['result_version'] = RESULT_STORE.put(session_result())
+    result_id, version = session['result_id'], session['result_version']
+    
+    def render_stored():
+        return render(RESULT_STORE.get(result_id) or session_result())
+    
+    if dated:
+        kind = f"{kind}@{dt.date.today().isoformat()}"
+    body, etag = RESULT_STORE.artifact(result_id, version, kind, render_stored)
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    return response.make_conditional(request)
+
+@app.route('/optimization_suggestions')
+def get_optimization_suggestions():
+    """Get AI-powered tax optimization suggestions"""
+    return serve_artifact('optimization_suggestions', lambda result: render_template(
+        'optimization_suggestions.html',
+        user_data=result['user_data'],
+        tax_result=result['tax_result'],
+        ml_insights=result['ml_insights']), 'text/html')
 
 @app.route('/clear_session')
 def clear_session():
@@ -594,343 +840,43 @@ def reset_form():
 @app.route('/tax_form')
 def generate_tax_form():
     """Generate a printable tax form"""
-    if 'user_data' not in session or 'tax_result' not in session:
-        return redirect(url_for('index'))
-    
-    user_data = session.get('user_data')
-    tax_result = session.get('tax_result')
-    ml_insights = session.get('ml_insights', {})
-    api_enhancements = session.get('api_enhancements', {})
-    
-    current_date = dt.datetime.now().strftime('%B %d, %Y')
-    
-    return render_template('tax_form.html',
-                         user_data=user_data,
-                         tax_result=tax_result,
-                         ml_insights=ml_insights,
-                         api_enhancements=api_enhancements,
-                         current_year=dt.datetime.now().year,
-                         current_date=current_date)
+    return serve_artifact('tax_form', lambda result: render_template(
+        'tax_form.html',
+        user_data=result['user_data'],
+        tax_result=result['tax_result'],
+        ml_insights=result['ml_insights'],
+        api_enhancements=result['api_enhancements'],
+        current_year=dt.datetime.now().year,
+        current_date=dt.datetime.now().strftime('%B %d, %Y')), 'text/html', dated=True)
 
 @app.route('/download_form')
 def download_form():
     """Download tax form as PDF file"""
-    user_data = session.get('user_data')
-    tax_result = session.get('tax_result')
-    ml_insights = session.get('ml_insights', {})
-    api_enhancements = session.get('api_enhancements', {})
-    
-    if not user_data or not tax_result:
-        return redirect(url_for('index'))
-    
     try:
-        pdf_buffer = generate_pdf_form(user_data, tax_result, ml_insights, api_enhancements)
-        response = make_response(pdf_buffer.getvalue())
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename=enhanced_tax_return_{dt.datetime.now().strftime("%Y%m%d")}.pdf'
-        return response
+        if PDF_RENDERER == 'overlay':
+            kind, render = 'pdf-overlay', lambda result: generate_overlay_pdf(
+                result['user_data'], result['tax_result'], result['ml_insights'], result['api_enhancements'])
+        else:
+            kind, render = 'pdf', lambda result: generate_pdf_form(
+                result['user_data'], result['tax_result'], result['ml_insights'], result['api_enhancements']
+            ).getvalue()
+        return serve_artifact(kind, render, 'application/pdf', {
+            'Content-Disposition': f'attachment; filename=enhanced_tax_return_{dt.datetime.now().strftime("%Y%m%d")}.pdf'
+        }, dated=True)
     except Exception as e:
         logger.error(f"Error generating PDF: {str(e)}")
         return download_form_text()
 
-def generate_pdf_form(user_data, tax_result, ml_insights=None, api_enhancements=None):
-    """Generate simplified PDF form content"""
-    try:
-        from reportlab.lib.pagesizes import letter
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch
-        from reportlab.lib import colors
-        from io import BytesIO
-        
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=72, leftMargin=72,
-                               topMargin=72, bottomMargin=18)
-        
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=1,
-            textColor=colors.darkblue
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=12,
-            textColor=colors.darkblue,
-            borderWidth=1,
-            borderColor=colors.darkblue,
-            borderPadding=5,
-            backColor=colors.lightgrey
-        )
-        
-        subheading_style = ParagraphStyle(
-            'SubHeading',
-            parent=styles['Heading3'],
-            fontSize=12,
-            spaceAfter=8,
-            textColor=colors.black,
-            fontName='Helvetica-Bold'
-        )
-        
-        story = []
-        
-        # Title
-        story.append(Paragraph(f"U.S. Individual Income Tax Return (AI Enhanced)", title_style))
-        story.append(Paragraph(f"Tax Year {dt.datetime.now().year - 1}", styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Personal Information Section
-        story.append(Paragraph("Personal Information", heading_style))
-        personal_data = [
-            ['Filing Status:', user_data.get('filing_status', 'N/A').replace('_', ' ').title()],
-            ['Age:', str(user_data.get('age', 'N/A'))],
-            ['Number of Dependents:', str(user_data.get('dependents', 'N/A'))],
-            ['State:', user_data.get('state', 'N/A')]
-        ]
-        personal_table = Table(personal_data, colWidths=[2*inch, 3*inch])
-        personal_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('BACKGROUND', (1, 0), (1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(personal_table)
-        story.append(Spacer(1, 20))
-        
-        # Income Section
-        story.append(Paragraph("Income", heading_style))
-        income_data = [
-            ['Line 1 - Total Income:', f"${user_data.get('income', 0):,.2f}"]
-        ]
-        income_table = Table(income_data, colWidths=[3*inch, 2*inch])
-        income_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('BACKGROUND', (1, 0), (1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(income_table)
-        story.append(Spacer(1, 20))
-        
-        # Deductions Section
-        story.append(Paragraph("Deductions", heading_style))
-        deductions_data = [
-            ['Line 2a - Standard Deduction:', f"${tax_result.get('standard_deduction', 0):,.2f}"],
-            ['Line 2b - Itemized Deductions:', f"${user_data.get('itemized_deductions', 0):,.2f}"],
-            ['Line 3 - Total Deductions:', f"${tax_result.get('total_deductions', 0):,.2f}"],
-            ['Line 4 - Taxable Income:', f"${tax_result.get('taxable_income', 0):,.2f}"]
-        ]
-        deductions_table = Table(deductions_data, colWidths=[3*inch, 2*inch])
-        deductions_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('BACKGROUND', (1, 0), (1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BACKGROUND', (0, 2), (-1, 3), colors.lightyellow),
-            ('FONTNAME', (0, 2), (-1, 3), 'Helvetica-Bold')
-        ]))
-        story.append(deductions_table)
-        story.append(Spacer(1, 20))
-        
-        # Tax Calculation Section
-        story.append(Paragraph("Tax Calculation", heading_style))
-        tax_calc_data = [
-            ['Line 5 - Tax on Taxable Income:', f"${tax_result.get('federal_tax_before_credits', 0):,.2f}"]
-        ]
-        
-        if tax_result.get('child_tax_credit', 0) > 0:
-            tax_calc_data.append(['Line 6 - Child Tax Credit:', f"${tax_result.get('child_tax_credit', 0):,.2f}"])
-            tax_calc_data.append(['Line 7 - Total Tax After Credits:', f"${tax_result.get('tax_owed', 0):,.2f}"])
-        else:
-            tax_calc_data.append(['Line 7 - Total Tax After Credits:', f"${tax_result.get('tax_owed', 0):,.2f}"])
-        
-        tax_calc_table = Table(tax_calc_data, colWidths=[3*inch, 2*inch])
-        tax_calc_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('BACKGROUND', (1, 0), (1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BACKGROUND', (0, -1), (-1, -1), colors.lightyellow),
-            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold')
-        ]))
-        story.append(tax_calc_table)
-        story.append(Spacer(1, 20))
-        
-        # Payments Section
-        story.append(Paragraph("Payments", heading_style))
-        payments_data = [
-            ['Line 8 - Federal Income Tax Withheld:', f"${user_data.get('withholding', 0):,.2f}"]
-        ]
-        payments_table = Table(payments_data, colWidths=[3*inch, 2*inch])
-        payments_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('BACKGROUND', (1, 0), (1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(payments_table)
-        story.append(Spacer(1, 20))
-        
-        # Final Result Section
-        story.append(Paragraph("Final Result", heading_style))
-        
-        if tax_result.get('refund_or_owe', 0) > 0:
-            result_text = f"REFUND: ${tax_result.get('refund_or_owe', 0):,.2f}"
-            result_color = colors.green
-        else:
-            result_text = f"AMOUNT OWED: ${abs(tax_result.get('refund_or_owe', 0)):,.2f}"
-            result_color = colors.red
-        
-        result_para = Paragraph(f"<b>{result_text}</b>", ParagraphStyle(
-            'Result',
-            parent=styles['Normal'],
-            fontSize=16,
-            textColor=result_color,
-            alignment=1,
-            backColor=colors.lightgrey,
-            borderWidth=2,
-            borderColor=result_color,
-            borderPadding=10
-        ))
-        story.append(result_para)
-        story.append(Spacer(1, 20))
-        
-        # AI Insights Section (if available)
-        if ml_insights:
-            story.append(PageBreak())
-            story.append(Paragraph("AI-Powered Tax Insights", heading_style))
-            
-            # Optimization insights
-            optimization = ml_insights.get('optimization', {})
-            if optimization:
-                story.append(Paragraph("Optimization Analysis", subheading_style))
-                opt_data = [
-                    ['Optimization Potential:', optimization.get('optimization_potential', 'Unknown').title()],
-                    ['Confidence Level:', f"{optimization.get('optimization_confidence', 0)*100:.0f}%"]
-                ]
-                opt_table = Table(opt_data, colWidths=[2*inch, 3*inch])
-                opt_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (0, -1), colors.lightsteelblue),
-                    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                    ('FONTSIZE', (0, 0), (-1, -1), 10),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-                    ('BACKGROUND', (1, 0), (1, -1), colors.white),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                ]))
-                story.append(opt_table)
-                story.append(Spacer(1, 15))
-            
-            # Audit risk insights
-            audit_risk = ml_insights.get('audit_risk', {})
-            if audit_risk:
-                story.append(Paragraph("Audit Risk Assessment", subheading_style))
-                risk_data = [
-                    ['Risk Level:', audit_risk.get('risk_level', 'Unknown').title()],
-                    ['Risk Probability:', f"{audit_risk.get('risk_probability', 0)*100:.1f}%"]
-                ]
-                risk_table = Table(risk_data, colWidths=[2*inch, 3*inch])
-                risk_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (0, -1), colors.lightcoral),
-                    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                    ('FONTSIZE', (0, 0), (-1, -1), 10),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-                    ('BACKGROUND', (1, 0), (1, -1), colors.white),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                ]))
-                story.append(risk_table)
-                story.append(Spacer(1, 15))
-            
-            # Planning suggestions
-            planning_suggestions = ml_insights.get('planning_suggestions', [])
-            if planning_suggestions:
-                story.append(Paragraph("Tax Planning Suggestions", subheading_style))
-                for i, suggestion in enumerate(planning_suggestions[:3], 1):
-                    sugg_data = [
-                        ['Category:', suggestion.get('category', 'General')],
-                        ['Suggestion:', suggestion.get('suggestion', 'No suggestion available')],
-                        ['Potential Savings:', f"${suggestion.get('potential_savings', 0):,.0f}"],
-                        ['Priority:', suggestion.get('priority', 'Medium').title()],
-                        ['Effort:', suggestion.get('effort', 'Medium').title()]
-                    ]
-                    sugg_table = Table(sugg_data, colWidths=[1.5*inch, 3.5*inch])
-                    sugg_table.setStyle(TableStyle([
-                        ('BACKGROUND', (0, 0), (0, -1), colors.lightsteelblue),
-                        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                        ('FONTSIZE', (0, 0), (-1, -1), 9),
-                        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                        ('BACKGROUND', (1, 0), (1, -1), colors.white),
-                        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                    ]))
-                    story.append(sugg_table)
-                    story.append(Spacer(1, 10))
-        
-        # Footer
-        footer_style = ParagraphStyle(
-            'Footer',
-            parent=styles['Normal'],
-            fontSize=8,
-            textColor=colors.grey,
-            alignment=1
-        )
-        
-        story.append(Spacer(1, 30))
-        story.append(Paragraph(f"Generated by AI Tax Return Agent on {dt.datetime.now().strftime('%B %d, %Y at %I:%M %p')}", footer_style))
-        story.append(Spacer(1, 10))
-        story.append(Paragraph("ENHANCED PROTOTYPE VERSION - FOR EDUCATIONAL PURPOSES ONLY", footer_style))
-        story.append(Paragraph("This AI-enhanced form includes predictive analytics and third-party integrations.", footer_style))
-        story.append(Paragraph("Not suitable for actual tax filing. Consult a qualified tax professional.", footer_style))
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
-        
-    except ImportError:
-        # If reportlab is not available, raise an exception to trigger fallback
-        raise Exception("PDF generation requires reportlab library")
-
 def download_form_text():
     """Enhanced fallback function for text download"""
-    user_data = session.get('user_data')
-    tax_result = session.get('tax_result')
-    ml_insights = session.get('ml_insights', {})
-    api_enhancements = session.get('api_enhancements', {})
-    
-    # Check if required data exists
-    if not user_data or not tax_result:
-        return redirect(url_for('index'))
+    return serve_artifact('text', render_text_form, 'text/plain', {
+        'Content-Disposition': 'attachment; filename=enhanced_tax_return.txt'
+    }, dated=True)
+
+def render_text_form(result):
+    """Plain-text version of the tax form"""
+    user_data = result['user_data']
+    tax_result = result['tax_result']
     
     # Generate enhanced form content
     form_content = f"""
@@ -963,17 +909,13 @@ def download_form_text():
     FINAL RESULT:
     {"Refund Due: $" + str(abs(tax_result.get('refund_or_owe', 0))) if tax_result.get('refund_or_owe', 0) > 0 else "Amount Owed: $" + str(abs(tax_result.get('refund_or_owe', 0)))}
     
-    Generated on: {dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    Generated on: {dt.date.today().isoformat()}
     Enhanced with AI and third-party API integrations
     
     DISCLAIMER: This is a prototype for educational purposes only.
     """
     
-    response = make_response(form_content)
-    response.headers['Content-Type'] = 'text/plain'
-    response.headers['Content-Disposition'] = 'attachment; filename=enhanced_tax_return.txt'
-    
-    return response
+    return form_content
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -981,6 +923,8 @@ def not_found_error(error):
 
 @app.errorhandler(500)
 def internal_error(error):
+    if request.path.startswith('/api/'):
+        return jsonify({'errors': ["An internal server error occurred. Please try again."]}), 500
     return render_template('index.html', errors=["An internal server error occurred. Please try again."]), 500
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from deadlines import run_with_context
+from third_party_apis import TaxAPIIntegration
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTaxAPIIntegration:
+    """asyncio front end for TaxAPIIntegration.
+
+    Each lookup runs the synchronous method (cache check, pooled client,
+    circuit breaker, fallback) on a dedicated thread pool, so caching and
+    failure behaviour are identical to the sync class. An asyncio semaphore
+    caps how many upstream calls are in flight per event loop, which keeps
+    concurrent lookups within the clients' connection pools.
+    """
+
+    def __init__(self, api: Optional[TaxAPIIntegration] = None, max_concurrency: Optional[int] = None):
+        self.api = api or TaxAPIIntegration()
+        self.max_concurrency = max_concurrency or int(os.environ.get('TAX_API_MAX_CONCURRENCY', 8))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='tax-api')
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Semaphores belong to the loop they are first awaited on
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def _call(self, method, *args):
+        # run_in_executor does not carry contextvars over; the request
+        # deadline has to follow the call onto the worker thread
+        async with self._semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, run_with_context(method, *args))
+
+    async def get_current_tax_brackets(self, filing_status: str, tax_year: int = 2023) -> Dict:
+        return await self._call(self.api.get_current_tax_brackets, filing_status, tax_year)
+
+    async def get_state_tax_info(self, state: str, income: float) -> Dict:
+        return await self._call(self.api.get_state_tax_info, state, income)
+
+    async def get_enhanced_deductions(self, filing_status: str, income: float, location: str = None) -> Dict:
+        return await self._call(self.api.get_enhanced_deductions, filing_status, income, location)
+
+    async def get_inflation_adjustments(self, base_year: int = 2022, current_year: int = 2023) -> float:
+        return await self._call(self.api.get_inflation_adjustments, base_year, current_year)
+
+    async def fetch_enrichment(self, filing_status: str, income: float, state: str,
+                               tax_year: int = 2023) -> Dict:
+        """Fetch brackets, state tax, deductions and inflation for one return
+        concurrently; total latency is that of the slowest lookup"""
+        brackets, state_tax, deductions, inflation = await asyncio.gather(
+            self.get_current_tax_brackets(filing_status, tax_year),
+            self.get_state_tax_info(state, income),
+            self.get_enhanced_deductions(filing_status, income, state),
+            self.get_inflation_adjustments(tax_year - 1, tax_year)
+        )
+        return {
+            'brackets': brackets,
+            'state_tax_info': state_tax,
+            'enhanced_deductions': deductions,
+            'inflation_adjustment': inflation
+        }
+
+    def fetch_enrichment_sync(self, filing_status: str, income: float, state: str,
+                              tax_year: int = 2023) -> Dict:
+        """Blocking wrapper around fetch_enrichment for sync views and scripts"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.fetch_enrichment(filing_status, income, state, tax_year))
+        raise RuntimeError("fetch_enrichment_sync called from a running event loop; await fetch_enrichment instead")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    import time
+
+    logging.basicConfig(level=logging.WARNING)
+    client = AsyncTaxAPIIntegration()
+
+    started = time.perf_counter()
+    for income in range(40000, 140000, 10000):
+        client.api.cache.clear()
+        client.fetch_enrichment_sync('single', income, 'CA')
+    concurrent_ms = (time.perf_counter() - started) * 100
+
+    started = time.perf_counter()
+    for income in range(40000, 140000, 10000):
+        client.api.cache.clear()
+        client.api.get_current_tax_brackets('single')
+        client.api.get_state_tax_info('CA', income)
+        client.api.get_enhanced_deductions('single', income, 'CA')
+        client.api.get_inflation_adjustments()
+    sequential_ms = (time.perf_counter() - started) * 100
+
+    print(f"enrichment per return: concurrent {concurrent_ms:.1f} ms, sequential {sequential_ms:.1f} ms")
@@ -0,0 +1,373 @@
+"""Bulk PDF export of stored returns as one ZIP archive.
+
+An export job reads results from the result store in chunks and renders
+their PDFs in a process pool, with a bounded number of chunks in flight.
+It writes each PDF into the archive as soon as it is back, so memory
+holds at most the chunks in flight whatever the size of the export. The
+archive goes to a file or is streamed as a response body. The last
+entry, export_report.json, lists the counts and any returns that could
+not be exported. Progress is published to the store, so another worker
+on the host can report it.
+
+    python bulk_export.py --out year_end.zip --all
+    python bulk_export.py --out some.zip RESULT_ID [RESULT_ID ...]
+"""
+import datetime as dt
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import sys
+import threading
+import time
+import types
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pdf_forms import generate_pdf_form
+from pdf_overlay import generate_overlay_pdf
+
+logger = logging.getLogger(__name__)
+
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 0)) or os.cpu_count() or 1
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 50))
+EXPORT_RENDERER = os.environ.get('EXPORT_RENDERER', 'overlay')
+PROGRESS_LOG_INTERVAL = 5.0
+PROGRESS_PUBLISH_INTERVAL = 1.0
+MAX_REPORTED_FAILURES = 1000
+RECENT_JOBS = 50
+
+RENDERERS = {
+    'overlay': lambda result: generate_overlay_pdf(
+        result['user_data'], result['tax_result'], result.get('ml_insights'), result.get('api_enhancements')),
+    'flow': lambda result: generate_pdf_form(
+        result['user_data'], result['tax_result'], result.get('ml_insights'), result.get('api_enhancements')
+    ).getvalue()
+}
+
+
+_BARE_MAIN = types.ModuleType('__main__')
+_spawn_lock = threading.Lock()
+
+
+class _RenderProcess(multiprocessing.context.SpawnProcess):
+    """Spawned render worker that does not run the parent's main script.
+
+    A spawned child normally imports the parent's __main__ again as
+    __mp_main__, which for app.py would load the models, warm the API
+    cache and start the store cleanup thread in every worker. With a bare
+    __main__ in place while the child is launched, it imports only what
+    unpickling its tasks needs, i.e. this module and the renderers.
+    """
+
+    @staticmethod
+    def _Popen(process_obj):
+        with _spawn_lock:
+            main = sys.modules['__main__']
+            sys.modules['__main__'] = _BARE_MAIN
+            try:
+                return multiprocessing.context.SpawnProcess._Popen(process_obj)
+            finally:
+                sys.modules['__main__'] = main
+
+
+class _RenderContext(multiprocessing.context.SpawnContext):
+    Process = _RenderProcess
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def export_pool() -> ProcessPoolExecutor:
+    """Render pool shared by the exports of this process, started on first
+    use. Workers are spawned rather than forked from a threaded server,
+    without re-running the server's main script (see _RenderProcess);
+    each builds its renderer's templates once and keeps them."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=_RenderContext())
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Drop the shared pool after a worker died, so the next export
+    starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_chunk(renderer: str, items: List[Tuple[str, Dict]]) -> List[Tuple[str, Optional[bytes], Optional[str]]]:
+    """Worker side: (result_id, pdf, error) for each stored result"""
+    render = RENDERERS[renderer]
+    rendered = []
+    for rid, result in items:
+        try:
+            rendered.append((rid, render(result), None))
+        except Exception as e:
+            rendered.append((rid, None, f"{type(e).__name__}: {e}"))
+    return rendered
+
+
+class _ChunkSink:
+    """Write-only file object that hands what the archive writes to a
+    response generator; having no tell() makes zipfile stream entries"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ExportJob:
+    """One bulk export: progress counters plus the render pipeline.
+
+    Chunks of EXPORT_CHUNK_SIZE results are submitted to the pool while
+    fewer than ``max_in_flight`` are outstanding, and collected in
+    submission order, so the archive lists returns in the order given.
+    """
+
+    def __init__(self, store, result_ids: Iterable[str], total: Optional[int] = None,
+                 renderer: Optional[str] = None, pool: Optional[ProcessPoolExecutor] = None,
+                 max_in_flight: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.id = secrets.token_hex(8)
+        self.store = store
+        self.result_ids = result_ids
+        self.total = total
+        self.renderer = renderer or EXPORT_RENDERER
+        if self.renderer not in RENDERERS:
+            raise ValueError(f"Unknown renderer: {self.renderer}")
+        self.pool = pool
+        self.max_in_flight = max_in_flight or EXPORT_WORKERS * 2
+        self.chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+        self.state = 'pending'
+        self.rendered = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.failures: List[Dict] = []
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        _register(self)
+        self._publish()
+
+    def progress(self) -> Dict:
+        with self._lock:
+            done = self.rendered + self.failed
+            elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+            return {
+                'job_id': self.id,
+                'state': self.state,
+                'renderer': self.renderer,
+                'total': self.total,
+                'done': done,
+                'rendered': self.rendered,
+                'failed': self.failed,
+                'bytes_written': self.bytes_written,
+                'elapsed_seconds': round(elapsed, 3),
+                'pdfs_per_second': round(self.rendered / elapsed, 1) if elapsed else 0.0
+            }
+
+    def _publish(self):
+        try:
+            self.store.put_export_progress(self.progress())
+        except Exception as e:
+            logger.warning(f"Export {self.id}: could not publish progress: {e}")
+
+    def _fail(self, rid: str, error: str):
+        with self._lock:
+            self.failed += 1
+            if len(self.failures) < MAX_REPORTED_FAILURES:
+                self.failures.append({'result_id': rid, 'error': error})
+
+    def _chunks(self) -> Iterator[List[Tuple[str, Dict]]]:
+        """(result_id, result) chunks from the store; unknown or expired
+        ids are recorded as failures"""
+        ids = iter(self.result_ids)
+        while True:
+            rids = list(islice(ids, self.chunk_size))
+            if not rids:
+                return
+            results = self.store.get_many(rids)
+            for rid in rids:
+                if rid not in results:
+                    self._fail(rid, 'not found')
+            yield [(rid, results[rid]) for rid in rids if rid in results]
+
+    def pdfs(self) -> Iterator[Tuple[str, bytes]]:
+        """(result_id, pdf) for every return that rendered, in input order"""
+        pool = self.pool or export_pool()
+        in_flight = deque()
+        chunks = self._chunks()
+        try:
+            while True:
+                while len(in_flight) < self.max_in_flight:
+                    items = next(chunks, None)
+                    if items is None:
+                        break
+                    in_flight.append(pool.submit(_render_chunk, self.renderer, items))
+                if not in_flight:
+                    return
+                for rid, pdf, error in in_flight.popleft().result():
+                    if error is not None:
+                        self._fail(rid, error)
+                        continue
+                    with self._lock:
+                        self.rendered += 1
+                    yield rid, pdf
+        except BrokenProcessPool:
+            if self.pool is None:
+                _discard_pool(pool)
+            raise
+        finally:
+            # Also reached when the client of a streamed export goes away
+            for future in in_flight:
+                future.cancel()
+
+    def _write(self, archive: zipfile.ZipFile, after_entry=None):
+        with self._lock:
+            self.state = 'running'
+            self.started_at = time.time()
+        self._publish()
+        last_log = last_publish = time.monotonic()
+        try:
+            for rid, pdf in self.pdfs():
+                archive.writestr(f"tax_return_{rid}.pdf", pdf)
+                with self._lock:
+                    self.bytes_written += len(pdf)
+                if after_entry is not None:
+                    yield after_entry()
+                if time.monotonic() - last_publish >= PROGRESS_PUBLISH_INTERVAL:
+                    last_publish = time.monotonic()
+                    self._publish()
+                if time.monotonic() - last_log >= PROGRESS_LOG_INTERVAL:
+                    last_log = time.monotonic()
+                    progress = self.progress()
+                    logger.info(f"Export {self.id}: {progress['done']}/{progress['total'] or '?'} returns, "
+                                f"{progress['failed']} failed, {progress['pdfs_per_second']} PDFs/s")
+            state = 'finished'
+        except GeneratorExit:
+            with self._lock:
+                self.state = 'cancelled'
+                self.finished_at = time.time()
+            self._publish()
+            logger.info(f"Export {self.id} cancelled after {self.rendered} PDFs")
+            raise
+        except Exception as e:
+            # The archive is still closed with its report, so what was
+            # written so far stays usable
+            logger.error(f"Export {self.id} aborted: {str(e)}")
+            with self._lock:
+                self.failures.append({'result_id': None, 'error': f"export aborted: {e}"})
+            state = 'aborted'
+
+        with self._lock:
+            self.state = state
+            self.finished_at = time.time()
+        report = dict(self.progress(), failures=self.failures,
+                      finished=dt.datetime.fromtimestamp(self.finished_at).isoformat())
+        archive.writestr('export_report.json', json.dumps(report, indent=2))
+        self._publish()
+        progress = self.progress()
+        logger.info(f"Export {self.id} {state}: {progress['rendered']} PDFs, {progress['failed']} failed "
+                    f"in {progress['elapsed_seconds']} s ({progress['pdfs_per_second']} PDFs/s)")
+
+    def stream_zip(self) -> Iterator[bytes]:
+        """The archive as response chunks, one per PDF written"""
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            entries = self._write(archive, after_entry=sink.drain)
+            try:
+                for chunk in entries:
+                    if chunk:
+                        yield chunk
+            finally:
+                entries.close()
+        yield sink.drain()
+
+    def write_zip(self, path: str) -> Dict:
+        """Write the archive to ``path`` (via a partial file, renamed once
+        complete); returns the final progress"""
+        partial = f"{path}.partial"
+        with zipfile.ZipFile(partial, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            for _ in self._write(archive):
+                pass
+        os.replace(partial, path)
+        return self.progress()
+
+
+_jobs_lock = threading.Lock()
+_jobs = OrderedDict()
+
+
+def _register(job: ExportJob):
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > RECENT_JOBS:
+            _jobs.popitem(last=False)
+
+
+def get_job(job_id: str) -> Optional[ExportJob]:
+    """A recent export started by this process"""
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def job_progress(store, job_id: str) -> Optional[Dict]:
+    """Progress of an export: live when this process runs it, otherwise
+    as last published to ``store`` by the worker that does"""
+    job = get_job(job_id)
+    if job is not None:
+        return job.progress()
+    return store.export_progress(job_id)
+
+
+def export_stats() -> Dict:
+    """Progress of the exports this process is running"""
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+    return {'running': [job.progress() for job in jobs if job.state in ('pending', 'running')],
+            'recent': len(jobs)}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from result_store import ResultStore
+
+    parser = argparse.ArgumentParser(description="Export stored returns as a ZIP of PDFs")
+    parser.add_argument('result_ids', nargs='*', help="ids of stored results")
+    parser.add_argument('--all', action='store_true', help="export every stored result")
+    parser.add_argument('--out', required=True, help="path of the ZIP archive")
+    parser.add_argument('--renderer', choices=sorted(RENDERERS), default=EXPORT_RENDERER)
+    parser.add_argument('--workers', type=int, default=EXPORT_WORKERS)
+    args = parser.parse_args()
+    if not args.all and not args.result_ids:
+        parser.error("give result ids or --all")
+
+    logging.basicConfig(level=logging.INFO)
+    store = ResultStore()
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        job = ExportJob(store, store.result_ids() if args.all else args.result_ids,
+                        total=None if args.all else len(args.result_ids), renderer=args.renderer,
+                        pool=pool, max_in_flight=args.workers * 2)
+        print(json.dumps(job.write_zip(args.out), indent=2))
@@ -0,0 +1,44 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# Absolute time.perf_counter() value by which the current request needs its
+# answer; None when the caller set no deadline
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left under the current deadline, or None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.perf_counter()
+
+
+@contextmanager
+def deadline_at(deadline: Optional[float]):
+    """Run the block under an absolute perf_counter deadline. A nested
+    deadline can only tighten the one already in effect."""
+    current = _deadline.get()
+    if deadline is None or (current is not None and current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def deadline_scope(seconds: Optional[float]):
+    """Run the block with at most ``seconds`` left on the clock"""
+    return deadline_at(None if seconds is None else time.perf_counter() + seconds)
+
+
+def run_with_context(fn, *args):
+    """Wrap ``fn`` to run in a copy of the caller's context, so the deadline
+    follows work handed to a thread pool"""
+    context = contextvars.copy_context()
+    return lambda: context.run(fn, *args)
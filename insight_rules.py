@@ -0,0 +1,601 @@
+import numpy as np
+import logging
+import operator
+from bisect import bisect_left
+from itertools import product
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rule tables
+#
+# A condition is (column, op, operand) where operand is either a constant or
+# (column, factor), meaning "that column times factor". A rule fires when all
+# of its conditions hold. Savings are either a constant or
+# (column, factor, cap[, rate]), i.e. min(column * factor, cap) * rate, with
+# cap None meaning uncapped. The savings value replaces the None placeholder
+# in the rule's output, which keeps the output's key order.
+#
+# The tables reproduce the hand-written checks that used to live in
+# app.generate_ai_insights, in the same order.
+
+OPTIMIZATION_SCORE_RULES = [
+    {'weight': 0.3, 'when': [('income', '>', 50000), ('total_deductions', '<', ('income', 0.15))]},
+    {'weight': 0.2, 'when': [('dependents', '==', 0), ('income', '>', 30000)]},
+    {'weight': 0.2, 'when': [('age', '<', 65), ('income', '>', 40000)]},
+    {'weight': 0.3, 'when': [('itemized_deductions', '==', 0)]}
+]
+
+# (minimum score, level, confidence), checked top to bottom
+OPTIMIZATION_LEVELS = [
+    (0.8, 'high', 0.85),
+    (0.5, 'medium', 0.75),
+    (None, 'low', 0.65)
+]
+
+RISK_SCORE_RULES = [
+    {'weight': 0.3, 'when': [('income', '>', 200000)], 'factor': 'High income level'},
+    {'weight': 0.4, 'when': [('itemized_deductions', '>', ('income', 0.3))], 'factor': 'High deduction ratio'},
+    {'weight': 0.2, 'when': [('dependents', '>', 3)], 'factor': 'Multiple dependents'},
+    {'weight': 0.3, 'when': [('age', '<', 25), ('income', '>', 100000)], 'factor': 'Young high earner'}
+]
+
+# (minimum score, level, probability), checked top to bottom
+RISK_LEVELS = [
+    (0.7, 'high', 0.25),
+    (0.4, 'medium', 0.15),
+    (None, 'low', 0.05)
+]
+
+RISK_MITIGATION_SUGGESTIONS = [
+    'Ensure all deductions are properly documented',
+    'Keep detailed records of income sources',
+    'Consider consulting a tax professional'
+]
+
+PLANNING_RULES = [
+    {
+        'when': [('itemized_deductions', '==', 0)],
+        'savings': ('income', 0.05, 5000),
+        'output': {
+            'category': 'Deductions',
+            'suggestion': 'Consider itemizing deductions if you have significant medical expenses, mortgage interest, or charitable contributions',
+            'potential_savings': None,
+            'priority': 'high',
+            'effort': 'medium',
+            'implementation': 'Gather receipts and documentation for potential deductions'
+        }
+    },
+    {
+        'when': [('dependents', '==', 0), ('income', '>', 30000)],
+        'savings': ('income', 0.03, 3000),
+        'output': {
+            'category': 'Credits',
+            'suggestion': 'Consider contributing to a retirement account to reduce taxable income',
+            'potential_savings': None,
+            'priority': 'medium',
+            'effort': 'low',
+            'implementation': 'Open an IRA or increase 401(k) contributions'
+        }
+    },
+    {
+        'when': [('age', '<', 65), ('income', '>', 40000)],
+        'savings': ('income', 0.02, 2000),
+        'output': {
+            'category': 'Planning',
+            'suggestion': 'Consider health savings account (HSA) contributions if eligible',
+            'potential_savings': None,
+            'priority': 'medium',
+            'effort': 'medium',
+            'implementation': 'Check HSA eligibility and contribution limits'
+        }
+    },
+    {
+        'when': [('income', '>', 50000)],
+        'savings': ('income', 0.01, 1000),
+        'output': {
+            'category': 'Investment',
+            'suggestion': 'Consider tax-loss harvesting to offset capital gains',
+            'potential_savings': None,
+            'priority': 'low',
+            'effort': 'high',
+            'implementation': 'Review investment portfolio for loss opportunities'
+        }
+    },
+    {
+        'when': [('dependents', '>', 0)],
+        'savings': ('dependents', 1500, 4500),
+        'output': {
+            'category': 'Family',
+            'suggestion': 'Maximize child tax credit and dependent care benefits',
+            'potential_savings': None,
+            'priority': 'high',
+            'effort': 'low',
+            'implementation': 'Ensure proper documentation of dependent expenses'
+        }
+    },
+    {
+        'when': [('income', '>', 75000)],
+        'savings': ('income', 0.02, 2000),
+        'output': {
+            'category': 'Advanced',
+            'suggestion': 'Consider tax-advantaged investment strategies',
+            'potential_savings': None,
+            'priority': 'low',
+            'effort': 'high',
+            'implementation': 'Consult with a financial advisor for tax-efficient investing'
+        }
+    }
+]
+
+# Recommendations may also test the derived 'optimization_level' column
+RECOMMENDATION_RULES = [
+    {
+        'when': [('optimization_level', '==', 'high')],
+        'savings': ('income', 0.08, 8000),
+        'output': {
+            'type': 'deduction_optimization',
+            'description': 'High potential for additional deductions through itemization',
+            'estimated_savings': None,
+            'effort': 'medium'
+        }
+    },
+    {
+        'when': [('dependents', '>', 0)],
+        'savings': ('dependents', 1000, 3000),
+        'output': {
+            'type': 'credit_optimization',
+            'description': 'Optimize child and dependent care credits',
+            'estimated_savings': None,
+            'effort': 'low'
+        }
+    },
+    {
+        'when': [('income', '>', 50000), ('itemized_deductions', '==', 0)],
+        'savings': ('income', 0.03, 3000),
+        'output': {
+            'type': 'retirement_planning',
+            'description': 'Consider retirement account contributions to reduce taxable income',
+            'estimated_savings': None,
+            'effort': 'low'
+        }
+    },
+    {
+        'when': [('age', '<', 65), ('income', '>', 40000)],
+        'savings': ('income', 0.02, 2000),
+        'output': {
+            'type': 'health_savings',
+            'description': 'Health savings account (HSA) contributions if eligible',
+            'estimated_savings': None,
+            'effort': 'medium'
+        }
+    }
+]
+
+# Column name -> (source, key, default) used to build columns from records
+INPUT_COLUMNS = {
+    'income': ('user_data', 'income', 0),
+    'dependents': ('user_data', 'dependents', 0),
+    'age': ('user_data', 'age', 30),
+    'itemized_deductions': ('user_data', 'itemized_deductions', 0),
+    'total_deductions': ('tax_result', 'total_deductions', 0),
+    'refund_or_owe': ('tax_result', 'refund_or_owe', 0)
+}
+
+OPERATORS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '==': np.equal,
+    '!=': np.not_equal
+}
+
+# Plain-Python equivalents for single-return lookups (NumPy ufuncs on
+# scalars cost about a microsecond each)
+SCALAR_OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne
+}
+
+
+def columns_from_records(user_records: Sequence[Dict], tax_results: Sequence[Dict]) -> Dict[str, np.ndarray]:
+    """Gather the rule inputs of many returns into column arrays"""
+    sources = {'user_data': user_records, 'tax_result': tax_results}
+    return {
+        name: np.array([record.get(key, default) for record in sources[source]], dtype=float)
+        for name, (source, key, default) in INPUT_COLUMNS.items()
+    }
+
+
+def row_from_record(user_data: Dict, tax_result: Dict) -> Dict:
+    """Gather the rule inputs of one return, keeping the caller's value types"""
+    sources = {'user_data': user_data, 'tax_result': tax_result}
+    return {
+        name: sources[source].get(key, default)
+        for name, (source, key, default) in INPUT_COLUMNS.items()
+    }
+
+
+def savings_function(spec) -> Callable[[Dict], float]:
+    """Compile a savings spec into a function of one return's row"""
+    if isinstance(spec, (int, float)):
+        return lambda row: spec
+    column, factor, cap, *rate = spec
+    if rate:
+        if cap is None:
+            return lambda row: row[column] * factor * rate[0]
+        return lambda row: min(row[column] * factor, cap) * rate[0]
+    if cap is None:
+        return lambda row: row[column] * factor
+    return lambda row: min(row[column] * factor, cap)
+
+
+def savings_array(spec, columns: Dict[str, np.ndarray], n: int) -> np.ndarray:
+    """Evaluate a savings spec over column arrays"""
+    if isinstance(spec, (int, float)):
+        return np.full(n, float(spec))
+    column, factor, cap, *rate = spec
+    value = columns[column] * factor
+    if cap is not None:
+        value = np.minimum(value, cap)
+    if rate:
+        value = value * rate[0]
+    return value
+
+
+def compile_outputs(rules: List[Dict], savings_key: str) -> List[Tuple[Dict, str, Callable]]:
+    """Pair each rule's output template with its compiled savings function"""
+    return [(rule['output'], savings_key, savings_function(rule['savings'])) for rule in rules]
+
+
+def fill_output(compiled: Tuple[Dict, str, Callable], row: Dict) -> Dict:
+    """Copy a rule's output template with its savings placeholder filled"""
+    template, key, savings = compiled
+    output = template.copy()
+    output[key] = savings(row)
+    return output
+
+
+class CompiledRules:
+    """Shared condition compiler: every distinct (column, op, operand)
+    condition across a set of rule tables becomes one atom"""
+
+    def __init__(self):
+        self.atoms = []
+        self._atom_index = {}
+
+    def _compile_conditions(self, conditions) -> List[int]:
+        indices = []
+        for condition in conditions:
+            column, op, operand = condition
+            if op not in OPERATORS:
+                raise ValueError(f"Unsupported operator '{op}' in rule condition {condition}")
+            key = (column, op, tuple(operand) if isinstance(operand, (list, tuple)) else operand)
+            if key not in self._atom_index:
+                self._atom_index[key] = len(self.atoms)
+                self.atoms.append(key)
+            indices.append(self._atom_index[key])
+        return indices
+
+    def _atom_masks(self, columns: Dict[str, np.ndarray],
+                    masks: Optional[Dict[int, np.ndarray]] = None) -> Dict[int, np.ndarray]:
+        """Compute the mask of every atom whose column is available and
+        that isn't already in ``masks``"""
+        masks = {} if masks is None else masks
+        for index, (column, op, operand) in enumerate(self.atoms):
+            if index in masks or column not in columns:
+                continue
+            if isinstance(operand, tuple):
+                rhs = columns[operand[0]] * operand[1]
+            else:
+                rhs = operand
+            masks[index] = OPERATORS[op](columns[column], rhs)
+        return masks
+
+    @staticmethod
+    def _fire(rule_atoms: List[int], masks: Dict[int, np.ndarray], n: int) -> np.ndarray:
+        fired = np.ones(n, dtype=bool)
+        for index in rule_atoms:
+            fired &= masks[index]
+        return fired
+
+
+class DecisionTable:
+    """Rule outcomes precomputed for every threshold bucket vector.
+    
+    Constant conditions only ever compare a column against a few thresholds,
+    so each numeric column is reduced to a bucket code: 2*i for values
+    strictly between threshold i-1 and i, 2*i+1 for values equal to
+    threshold i. Every operator is constant within a bucket. String columns
+    bucket by category, and conditions between two columns become one flag
+    bit each. The outcome of every combination is computed once up front,
+    leaving a few comparisons and one list lookup per return.
+    """
+
+    def __init__(self, atoms: List[Tuple], outcome_fn: Callable[[List[Optional[bool]]], object],
+                 derived_columns: Sequence[str] = ()):
+        thresholds = {}
+        categories = {}
+        self.flag_atoms = []
+        for index, (column, op, operand) in enumerate(atoms):
+            if column in derived_columns:
+                continue
+            if isinstance(operand, tuple):
+                self.flag_atoms.append(index)
+            elif isinstance(operand, str):
+                categories.setdefault(column, set()).add(operand)
+            else:
+                thresholds.setdefault(column, set()).add(operand)
+
+        self.numeric = [(column, sorted(values)) for column, values in sorted(thresholds.items())]
+        self.categorical = [(column, {value: code + 1 for code, value in enumerate(sorted(values))})
+                            for column, values in sorted(categories.items())]
+        self.atoms = atoms
+
+        # Mixed-radix layout of the bucket vector
+        self.radices = ([2 * len(values) + 1 for _, values in self.numeric]
+                        + [len(codes) + 1 for _, codes in self.categorical]
+                        + [2] * len(self.flag_atoms))
+
+        self.table = [outcome_fn(self._truths(digits)) for digits in product(*(range(r) for r in self.radices))]
+        logger.info(f"Decision table built: {len(self.table)} buckets over {len(atoms)} conditions")
+
+    @staticmethod
+    def _representative(values: List[float], code: int) -> float:
+        i, on_threshold = divmod(code, 2)
+        if on_threshold:
+            return values[i]
+        if i == 0:
+            return values[0] - 1
+        if i == len(values):
+            return values[-1] + 1
+        return (values[i - 1] + values[i]) / 2
+
+    def _truths(self, digits) -> List[Optional[bool]]:
+        """Atom truth values implied by one bucket vector (None for derived atoms)"""
+        digits = list(digits)
+        row = {}
+        for column, values in self.numeric:
+            row[column] = self._representative(values, digits.pop(0))
+        for column, codes in self.categorical:
+            code = digits.pop(0)
+            row[column] = next((value for value, c in codes.items() if c == code), None)
+        flags = dict(zip(self.flag_atoms, digits))
+
+        truths = []
+        for index, (column, op, operand) in enumerate(self.atoms):
+            if index in flags:
+                truths.append(bool(flags[index]))
+            elif column in row:
+                truths.append(SCALAR_OPERATORS[op](row[column], operand) if row[column] is not None
+                              else op == '!=')
+            else:
+                truths.append(None)
+        return truths
+
+    def index(self, row: Dict) -> int:
+        """Bucket vector of one return, as a flat table index"""
+        index = 0
+        for column, values in self.numeric:
+            x = row[column]
+            i = bisect_left(values, x)
+            index = index * (2 * len(values) + 1) + 2 * i + (i < len(values) and values[i] == x)
+        for column, codes in self.categorical:
+            index = index * (len(codes) + 1) + codes.get(row[column], 0)
+        for atom in self.flag_atoms:
+            column, op, (other, factor) = self.atoms[atom]
+            index = index * 2 + SCALAR_OPERATORS[op](row[column], row[other] * factor)
+        return index
+
+    def indices(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Flat table indices for column arrays"""
+        n = len(next(iter(columns.values())))
+        index = np.zeros(n, dtype=np.int64)
+        for column, values in self.numeric:
+            x = columns[column]
+            bounds = np.asarray(values, dtype=float)
+            i = np.searchsorted(bounds, x, side='left')
+            on_threshold = np.append(bounds, np.nan)[i] == x
+            index = index * (2 * len(values) + 1) + 2 * i + on_threshold
+        for column, codes in self.categorical:
+            code = np.zeros(n, dtype=np.int64)
+            for value, c in codes.items():
+                code[columns[column] == value] = c
+            index = index * (len(codes) + 1) + code
+        for atom in self.flag_atoms:
+            column, op, (other, factor) = self.atoms[atom]
+            index = index * 2 + OPERATORS[op](columns[column], columns[other] * factor)
+        return index
+
+    def lookup(self, row: Dict):
+        return self.table[self.index(row)]
+
+
+class InsightRuleEngine(CompiledRules):
+    """Evaluates the insight rule tables.
+
+    Every distinct condition in the tables is compiled once into an atom.
+    ``evaluate`` computes one boolean mask per atom over column arrays and
+    combines them per rule; ``generate``/``generate_batch`` go through a
+    DecisionTable built from the same rules, so a return costs a bucket
+    lookup plus the income-linear savings.
+    """
+
+    def __init__(self, score_rules=None, levels=None, risk_rules=None, risk_levels=None,
+                 planning_rules=None, recommendation_rules=None):
+        super().__init__()
+        self.score_rules = score_rules or OPTIMIZATION_SCORE_RULES
+        self.levels = levels or OPTIMIZATION_LEVELS
+        self.risk_rules = risk_rules or RISK_SCORE_RULES
+        self.risk_levels = risk_levels or RISK_LEVELS
+        self.planning_rules = planning_rules or PLANNING_RULES
+        self.recommendation_rules = recommendation_rules or RECOMMENDATION_RULES
+
+        self._compiled = {
+            name: [self._compile_conditions(rule['when']) for rule in rules]
+            for name, rules in (('score', self.score_rules), ('risk', self.risk_rules),
+                                ('planning', self.planning_rules),
+                                ('recommendation', self.recommendation_rules))
+        }
+        self._planning_outputs = compile_outputs(self.planning_rules, 'potential_savings')
+        self._recommendation_outputs = compile_outputs(self.recommendation_rules, 'estimated_savings')
+        self.table = DecisionTable(self.atoms, self._static_outcome, derived_columns=('optimization_level',))
+
+    @staticmethod
+    def _level(score: np.ndarray, levels):
+        conditions = [score >= minimum if minimum is not None else np.ones_like(score, dtype=bool)
+                      for minimum, _, _ in levels]
+        names = np.select(conditions, [name for _, name, _ in levels], default=levels[-1][1])
+        values = np.select(conditions, [value for _, _, value in levels], default=levels[-1][2])
+        return names, values
+
+    @staticmethod
+    def _scalar_level(score: float, levels):
+        for minimum, name, value in levels:
+            if minimum is None or score >= minimum:
+                return name, value
+        return levels[-1][1], levels[-1][2]
+
+    def _static_outcome(self, truths: List[Optional[bool]]) -> Dict:
+        """Everything about the insights that depends only on which
+        conditions hold (i.e. not on the income-linear savings)"""
+        def fires(atoms):
+            return all(truths[a] for a in atoms)
+
+        score = 0
+        for rule, atoms in zip(self.score_rules, self._compiled['score']):
+            if fires(atoms):
+                score += rule['weight']
+        level, confidence = self._scalar_level(score, self.levels)
+
+        risk_score = 0
+        risk_factors = []
+        for rule, atoms in zip(self.risk_rules, self._compiled['risk']):
+            if fires(atoms):
+                risk_score += rule['weight']
+                risk_factors.append(rule['factor'])
+        risk_level, risk_probability = self._scalar_level(risk_score, self.risk_levels)
+
+        # Resolve conditions on the derived optimization level
+        truths = list(truths)
+        for index, (column, op, operand) in enumerate(self.atoms):
+            if column == 'optimization_level':
+                truths[index] = SCALAR_OPERATORS[op](level, operand)
+
+        return {
+            'optimization_potential': level,
+            'optimization_confidence': confidence,
+            'risk_level': risk_level,
+            'risk_probability': risk_probability,
+            'risk_factors': tuple(risk_factors),
+            'mitigation_suggestions': tuple(RISK_MITIGATION_SUGGESTIONS) if risk_level != 'low' else (),
+            'planning': tuple(self._planning_outputs[i] for i, atoms in enumerate(self._compiled['planning'])
+                              if fires(atoms)),
+            'recommendations': tuple(self._recommendation_outputs[i]
+                                     for i, atoms in enumerate(self._compiled['recommendation']) if fires(atoms))
+        }
+
+    def _materialize(self, outcome: Dict, row: Dict) -> Dict:
+        income = row['income']
+        return {
+            'optimization': {
+                'optimization_potential': outcome['optimization_potential'],
+                'optimization_confidence': outcome['optimization_confidence'],
+                'predicted_refund': max(0, row['refund_or_owe'] + min(income * 0.05, 5000)),
+                'recommendations': [fill_output(compiled, row) for compiled in outcome['recommendations']]
+            },
+            'audit_risk': {
+                'risk_level': outcome['risk_level'],
+                'risk_probability': outcome['risk_probability'],
+                'risk_factors': list(outcome['risk_factors']),
+                'mitigation_suggestions': list(outcome['mitigation_suggestions'])
+            },
+            'planning_suggestions': [fill_output(compiled, row) for compiled in outcome['planning']],
+            'confidence_score': outcome['optimization_confidence']
+        }
+
+    def evaluate(self, columns: Dict[str, np.ndarray]) -> Dict:
+        """Evaluate every rule table over the given columns.
+
+        Returns column-oriented results: score/level arrays plus, for each
+        rule, its fired mask and savings array.
+        """
+        columns = dict(columns)
+        n = len(columns['income'])
+        masks = self._atom_masks(columns)
+
+        score = np.zeros(n)
+        for rule, atoms in zip(self.score_rules, self._compiled['score']):
+            score = score + np.where(self._fire(atoms, masks, n), rule['weight'], 0.0)
+        level, confidence = self._level(score, self.levels)
+
+        risk_score = np.zeros(n)
+        risk_fired = []
+        for rule, atoms in zip(self.risk_rules, self._compiled['risk']):
+            fired = self._fire(atoms, masks, n)
+            risk_fired.append(fired)
+            risk_score = risk_score + np.where(fired, rule['weight'], 0.0)
+        risk_level, risk_probability = self._level(risk_score, self.risk_levels)
+
+        # Recommendations can depend on the optimization level
+        columns['optimization_level'] = level
+        self._atom_masks(columns, masks)
+
+        return {
+            'n': n,
+            'optimization_score': score,
+            'optimization_level': level,
+            'optimization_confidence': confidence,
+            'predicted_refund': np.maximum(0, columns['refund_or_owe'] + np.minimum(columns['income'] * 0.05, 5000)),
+            'risk_score': risk_score,
+            'risk_level': risk_level,
+            'risk_probability': risk_probability,
+            'risk_fired': risk_fired,
+            'planning': [(self._fire(atoms, masks, n), savings_array(rule['savings'], columns, n))
+                         for rule, atoms in zip(self.planning_rules, self._compiled['planning'])],
+            'recommendations': [(self._fire(atoms, masks, n), savings_array(rule['savings'], columns, n))
+                                for rule, atoms in zip(self.recommendation_rules, self._compiled['recommendation'])]
+        }
+
+    def generate_batch(self, user_records: Sequence[Dict], tax_results: Sequence[Dict]) -> List[Dict]:
+        """Insights for many returns: bucket indices are computed in one
+        vectorized pass, then each return is a table lookup"""
+        if not user_records:
+            return []
+        indices = self.table.indices(columns_from_records(user_records, tax_results)).tolist()
+        return [
+            self._materialize(self.table.table[index], row_from_record(user_data, tax_result))
+            for index, user_data, tax_result in zip(indices, user_records, tax_results)
+        ]
+
+    def generate(self, user_data: Dict, tax_result: Dict) -> Dict:
+        """Insights for a single return"""
+        row = row_from_record(user_data, tax_result)
+        return self._materialize(self.table.lookup(row), row)
+
+
+class SuggestionTable(CompiledRules):
+    """Decision-table backed evaluation of a plain suggestion rule table
+    (rules with 'when', 'savings' and an 'output' template)"""
+
+    def __init__(self, rules: List[Dict], savings_key: str = 'potential_savings'):
+        super().__init__()
+        self.rules = rules
+        self.savings_key = savings_key
+        self._compiled = [self._compile_conditions(rule['when']) for rule in rules]
+        self._outputs = compile_outputs(rules, savings_key)
+        self.table = DecisionTable(self.atoms, self._static_outcome)
+
+    def _static_outcome(self, truths: List[Optional[bool]]) -> Tuple:
+        return tuple(self._outputs[i] for i, atoms in enumerate(self._compiled) if all(truths[a] for a in atoms))
+
+    def suggest(self, row: Dict) -> List[Dict]:
+        return [fill_output(compiled, row) for compiled in self.table.lookup(row)]
+
+
+INSIGHT_ENGINE = InsightRuleEngine()
@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+try:
+    from threadpoolctl import threadpool_info, threadpool_limits
+except ImportError:  # threadpoolctl ships with scikit-learn, but stay importable without it
+    threadpool_info = None
+    threadpool_limits = None
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the inference queue is already at its configured depth"""
+
+
+class MLExecutor:
+    """Dedicated, sized thread pool for model inference.
+
+    Each server process gets a CPU budget (cores divided by the number of
+    worker processes on the host). The budget is split into ``workers``
+    inference threads of ``threads_per_model`` native threads each, and
+    BLAS/OpenMP pools are capped to match, so request threads, sklearn's
+    ``n_jobs`` and BLAS never oversubscribe the cores.
+    """
+
+    def __init__(self, workers: Optional[int] = None, threads_per_model: Optional[int] = None,
+                 max_queue: Optional[int] = None):
+        processes = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+        self.cpu_budget = max(1, (os.cpu_count() or 1) // processes)
+
+        self.threads_per_model = threads_per_model or int(os.environ.get('ML_THREADS_PER_MODEL', 1))
+        self.workers = workers or int(os.environ.get('ML_EXECUTOR_WORKERS', 0)) \
+            or max(1, self.cpu_budget // self.threads_per_model)
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get('ML_EXECUTOR_MAX_QUEUE', 256))
+
+        # Caps pools in the importing thread; executor threads apply it again
+        # on start because OpenMP limits are per thread
+        self._limit_thread_pools()
+
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ml-infer',
+                                        initializer=self._limit_thread_pools)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+        logger.info(f"ML executor: {self.workers} workers x {self.threads_per_model} threads "
+                    f"(CPU budget {self.cpu_budget}, max queue {self.max_queue})")
+
+    def _limit_thread_pools(self):
+        if threadpool_limits is not None:
+            threadpool_limits(limits=self.threads_per_model)
+
+    def configure_models(self, models: Iterable) -> None:
+        """Pin sklearn's own parallelism to the per-model thread budget"""
+        for model in models:
+            if model is not None and 'n_jobs' in model.get_params():
+                model.set_params(n_jobs=self.threads_per_model)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Queue an inference call; raises ExecutorSaturated when the queue is full"""
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise ExecutorSaturated(f"ML inference queue is full ({self.queued} waiting)")
+            self.queued += 1
+
+        future = self._pool.submit(self._run, fn, args, kwargs)
+        future.add_done_callback(self._release_cancelled)
+        return future
+
+    def _release_cancelled(self, future: Future) -> None:
+        """A future cancelled while queued never reaches _run, so its queue
+        slot is given back here"""
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+                self.cancelled += 1
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """Run an inference call on the executor and wait for its result"""
+        return self.submit(fn, *args, **kwargs).result(timeout=timeout)
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.active -= 1
+                self.failed += 1
+            raise
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+        return result
+
+    def stats(self) -> Dict:
+        """Queue depth and throughput counters for metrics export"""
+        with self._lock:
+            stats = {
+                'workers': self.workers,
+                'threads_per_model': self.threads_per_model,
+                'cpu_budget': self.cpu_budget,
+                'queue_depth': self.queued,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'rejected': self.rejected
+            }
+        if threadpool_info is not None:
+            stats['native_pools'] = [
+                {'api': pool['internal_api'], 'num_threads': pool['num_threads']}
+                for pool in threadpool_info()
+            ]
+        return stats
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
@@ -1,27 +1,216 @@
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingClassifier
+from sklearn.ensemble import (RandomForestRegressor, GradientBoostingClassifier,
+                              HistGradientBoostingRegressor, HistGradientBoostingClassifier)
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.metrics import mean_squared_error, classification_report
+from sklearn.metrics import mean_squared_error, accuracy_score
+import sklearn
 import joblib
+import json
 import logging
+import tempfile
+import time
+from contextlib import contextmanager
 from typing import Dict, List, Tuple, Optional
 import os
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # no flock on Windows; model files are still replaced atomically
+    fcntl = None
+
+from forest_intervals import ForestQuantiles
+from ml_executor import MLExecutor
+from insight_rules import SuggestionTable
+from refund_surrogate import SurrogateRouter, distill_refund_surrogate, load_surrogate, save_surrogate
+
 logger = logging.getLogger(__name__)
 
+# Feature layouts shared by training and inference
+REFUND_FEATURES = ['age', 'income', 'dependents', 'itemized_deductions', 'withholding', 'filing_status']
+DEDUCTION_FEATURES = ['age', 'income', 'dependents', 'itemized_deductions']
+RISK_FEATURES = ['income', 'itemized_deductions', 'dependents', 'actual_refund']
+
+# Supported model families. Each entry builds fresh (unfitted) estimators for
+# the three models; 'scale_features' controls whether the refund predictor is
+# fed StandardScaler output (tree ensembles don't need it, but the original
+# forest family was trained that way and its pickles expect it).
+MODEL_FAMILIES = {
+    'random_forest': {
+        'description': 'RandomForestRegressor + GradientBoostingClassifier (original models)',
+        'scale_features': True,
+        'refund_predictor': lambda: RandomForestRegressor(
+            n_estimators=100,
+            max_depth=10,
+            random_state=42
+        ),
+        'deduction_optimizer': lambda: GradientBoostingClassifier(
+            n_estimators=100,
+            learning_rate=0.1,
+            max_depth=6,
+            random_state=42
+        ),
+        'risk_classifier': lambda: GradientBoostingClassifier(
+            n_estimators=100,
+            learning_rate=0.1,
+            max_depth=4,
+            random_state=42
+        )
+    },
+    'hist_gradient_boosting': {
+        'description': 'HistGradientBoosting models with native categorical filing_status',
+        'scale_features': False,
+        'refund_predictor': lambda: HistGradientBoostingRegressor(
+            max_iter=200,
+            learning_rate=0.1,
+            max_leaf_nodes=31,
+            categorical_features=[REFUND_FEATURES.index('filing_status')],
+            random_state=42
+        ),
+        'deduction_optimizer': lambda: HistGradientBoostingClassifier(
+            max_iter=100,
+            learning_rate=0.1,
+            max_depth=6,
+            random_state=42
+        ),
+        'risk_classifier': lambda: HistGradientBoostingClassifier(
+            max_iter=100,
+            learning_rate=0.1,
+            max_depth=4,
+            random_state=42
+        )
+    }
+}
+
+DEFAULT_MODEL_FAMILY = 'random_forest'
+
+# Quantiles used for the refund prediction interval (90% band)
+REFUND_INTERVAL_QUANTILES = (0.05, 0.95)
+
+# Tax planning suggestion rules (see insight_rules for the rule format)
+PLANNING_SUGGESTION_RULES = [
+    # Income-based suggestions
+    {
+        'when': [('income', '>', 50000)],
+        'savings': ('income', 0.15, 22500, 0.22),
+        'output': {
+            'category': 'Retirement Planning',
+            'suggestion': 'Consider maximizing 401(k) contributions',
+            'potential_savings': None,
+            'priority': 'high',
+            'implementation': 'Increase payroll deduction for retirement account'
+        }
+    },
+    {
+        'when': [('income', '>', 100000), ('filing_status', '==', 'single')],
+        'savings': 3650 * 0.24,
+        'output': {
+            'category': 'Tax-Advantaged Accounts',
+            'suggestion': 'Maximize HSA contributions if available',
+            'potential_savings': None,
+            'priority': 'high',
+            'implementation': 'Enroll in high-deductible health plan with HSA'
+        }
+    },
+    {
+        'when': [('income', '>', 100000), ('filing_status', '!=', 'single')],
+        'savings': 7300 * 0.24,
+        'output': {
+            'category': 'Tax-Advantaged Accounts',
+            'suggestion': 'Maximize HSA contributions if available',
+            'potential_savings': None,
+            'priority': 'high',
+            'implementation': 'Enroll in high-deductible health plan with HSA'
+        }
+    },
+    # Age-based suggestions
+    {
+        'when': [('age', '>=', 50)],
+        'savings': 7500 * 0.24,  # Additional 401(k) catch-up
+        'output': {
+            'category': 'Catch-up Contributions',
+            'suggestion': 'Take advantage of catch-up retirement contributions',
+            'potential_savings': None,
+            'priority': 'medium',
+            'implementation': 'Increase 401(k) contribution by $7,500'
+        }
+    },
+    # Family-based suggestions
+    {
+        'when': [('dependents', '>', 0)],
+        'savings': ('dependents', 2000, None),  # State tax deduction
+        'output': {
+            'category': 'Education Planning',
+            'suggestion': 'Consider 529 education savings plan',
+            'potential_savings': None,
+            'priority': 'medium',
+            'implementation': 'Open 529 account and set up automatic contributions'
+        }
+    },
+    # Business opportunity suggestions
+    {
+        'when': [('income', '>', 30000)],
+        'savings': 1500,
+        'output': {
+            'category': 'Business Deductions',
+            'suggestion': 'Track home office and business expenses',
+            'potential_savings': None,
+            'priority': 'low',
+            'implementation': 'Maintain detailed records of business-related expenses'
+        }
+    }
+]
+
+PLANNING_SUGGESTIONS = SuggestionTable(PLANNING_SUGGESTION_RULES)
+
+
+@contextmanager
+def models_lock(model_dir: str, shared: bool = False):
+    """Lock the model files against the other processes on the host:
+    shared while reading them, exclusive while replacing them"""
+    with open(os.path.join(model_dir, '.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def replace_file(path: str, write, mode: str = 'wb') -> None:
+    """Write ``path`` through ``write(file)`` into a temporary file next
+    to it, then rename it into place, so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f'.{os.path.basename(path)}-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 class TaxOptimizationML:
     """Machine Learning models for tax optimization and predictive suggestions"""
     
-    def __init__(self):
+    def __init__(self, model_family: Optional[str] = None, executor: Optional[MLExecutor] = None):
+        self.model_family = model_family or os.environ.get('ML_MODEL_FAMILY', DEFAULT_MODEL_FAMILY)
+        if self.model_family not in MODEL_FAMILIES:
+            raise ValueError(f"Unknown model family '{self.model_family}', "
+                             f"expected one of {sorted(MODEL_FAMILIES)}")
+        
         self.refund_predictor = None
         self.deduction_optimizer = None
         self.risk_classifier = None
         self.scaler = StandardScaler()
         self.label_encoders = {}
+        self.manifest = {}
         self.is_trained = False
+        self._forest_quantiles = None
+        self.surrogate_router = None
+        self.surrogate_max_error = float(os.environ.get('REFUND_SURROGATE_MAX_ERROR', 250))
         
         # Model file paths
         self.model_dir = "models"
@@ -29,20 +218,55 @@ class TaxOptimizationML:
         self.deduction_model_path = os.path.join(self.model_dir, "deduction_optimizer.pkl")
         self.risk_model_path = os.path.join(self.model_dir, "risk_classifier.pkl")
         self.scaler_path = os.path.join(self.model_dir, "scaler.pkl")
+        self.manifest_path = os.path.join(self.model_dir, "manifest.json")
+        self.surrogate_path = os.path.join(self.model_dir, "refund_surrogate.pkl")
         
         # Create models directory if it doesn't exist
         os.makedirs(self.model_dir, exist_ok=True)
         
         # Initialize or load models
         self._initialize_models()
+        self._load_surrogate()
+        
+        # Inference runs on a dedicated, CPU-budgeted pool
+        self.executor = executor or MLExecutor()
+        self.executor.configure_models([self.refund_predictor, self.deduction_optimizer, self.risk_classifier])
     
     def _initialize_models(self):
-        """Initialize ML models"""
+        """Load the saved models.
+        
+        Models are only trained here when none are saved, by the first
+        process to take the models lock; the others then load its files.
+        Saved models of another family are served as they are; retraining
+        is the explicit ``python ml_tax_optimizer.py train``.
+        """
         try:
-            self._load_models()
-            logger.info("ML models loaded successfully")
+            with models_lock(self.model_dir, shared=True):
+                self._load_models()
         except FileNotFoundError:
-            logger.info("No existing models found, creating new ones")
+            with models_lock(self.model_dir):
+                try:
+                    self._load_models()
+                except FileNotFoundError:
+                    logger.info("No existing models found, creating new ones")
+                    self._create_and_train_models()
+                    return
+        
+        saved_family = self.manifest.get('model_family', DEFAULT_MODEL_FAMILY)
+        if saved_family != self.model_family:
+            logger.warning(f"Saved models are '{saved_family}', not '{self.model_family}'; serving them as they "
+                           f"are until `python ml_tax_optimizer.py train --family {self.model_family}` is run")
+            self.model_family = saved_family
+        logger.info(f"ML models loaded successfully ({self.model_family})")
+    
+    def train(self, family: Optional[str] = None):
+        """Retrain every model (as ``family`` if given) and replace the
+        saved ones"""
+        if family is not None:
+            if family not in MODEL_FAMILIES:
+                raise ValueError(f"Unknown model family '{family}'")
+            self.model_family = family
+        with models_lock(self.model_dir):
             self._create_and_train_models()
     
     def _create_and_train_models(self):
@@ -51,15 +275,17 @@ class TaxOptimizationML:
         training_data = self._generate_synthetic_data(5000)
         
         # Train models
-        self._train_refund_predictor(training_data)
-        self._train_deduction_optimizer(training_data)
-        self._train_risk_classifier(training_data)
+        metrics = {
+            'refund_predictor': self._train_refund_predictor(training_data),
+            'deduction_optimizer': self._train_deduction_optimizer(training_data),
+            'risk_classifier': self._train_risk_classifier(training_data)
+        }
         
         # Save models
-        self._save_models()
+        self._save_models(metrics)
         self.is_trained = True
         
-        logger.info("ML models trained and saved successfully")
+        logger.info(f"ML models ({self.model_family}) trained and saved successfully")
     
     def _generate_synthetic_data(self, n_samples: int) -> pd.DataFrame:
         """Generate synthetic tax data for training"""
@@ -134,100 +360,204 @@ class TaxOptimizationML:
         
         return pd.DataFrame(data)
     
-    def _train_refund_predictor(self, data: pd.DataFrame):
+    def _train_refund_predictor(self, data: pd.DataFrame,
+                                family: Optional[str] = None,
+                                assign: bool = True) -> Dict:
         """Train model to predict refund amounts"""
-        # Prepare features
-        features = ['age', 'income', 'dependents', 'itemized_deductions', 'withholding']
-        categorical_features = ['filing_status']
+        family = family or self.model_family
+        spec = MODEL_FAMILIES[family]
         
-        X = data[features].copy()
+        # Prepare features (filing_status is label encoded and kept last);
+        # a fresh encoder, as serving depends on the current one
+        encoder = LabelEncoder()
         
-        # Encode categorical variables
-        for cat_feature in categorical_features:
-            if cat_feature not in self.label_encoders:
-                self.label_encoders[cat_feature] = LabelEncoder()
-            X[cat_feature] = self.label_encoders[cat_feature].fit_transform(data[cat_feature])
-        
-        X = X.join(pd.DataFrame(X.pop('filing_status')))
+        X = data[REFUND_FEATURES].copy()
+        X['filing_status'] = encoder.fit_transform(data['filing_status'])
         y = data['actual_refund']
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         
         # Scale features
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
+        scaler = StandardScaler()
+        if spec['scale_features']:
+            X_train = scaler.fit_transform(X_train)
+            X_test = scaler.transform(X_test)
+        else:
+            X_train = X_train.to_numpy(dtype=float)
+            X_test = X_test.to_numpy(dtype=float)
         
         # Train model
-        self.refund_predictor = RandomForestRegressor(
-            n_estimators=100,
-            max_depth=10,
-            random_state=42
-        )
-        self.refund_predictor.fit(X_train_scaled, y_train)
+        model = spec['refund_predictor']()
+        started = time.perf_counter()
+        model.fit(X_train, y_train)
+        train_seconds = time.perf_counter() - started
         
         # Evaluate
-        y_pred = self.refund_predictor.predict(X_test_scaled)
-        rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-        logger.info(f"Refund predictor RMSE: ${rmse:.2f}")
+        started = time.perf_counter()
+        y_pred = model.predict(X_test)
+        predict_seconds = time.perf_counter() - started
+        rmse = float(np.sqrt(mean_squared_error(y_test, y_pred)))
+        logger.info(f"Refund predictor ({family}) RMSE: ${rmse:.2f}")
+        
+        # Held-out residual quantiles back the interval for models that
+        # don't expose per-tree outputs
+        residual_quantiles = np.quantile(np.asarray(y_test) - y_pred, REFUND_INTERVAL_QUANTILES)
+        
+        if assign:
+            self.refund_predictor = model
+            self.label_encoders['filing_status'] = encoder
+            self._forest_quantiles = None
+            if spec['scale_features']:
+                self.scaler = scaler
+        
+        return {
+            'rmse': round(rmse, 2),
+            'residual_quantiles': [round(float(q), 2) for q in residual_quantiles],
+            'train_seconds': round(train_seconds, 4),
+            'predict_us_per_row': round(predict_seconds / len(X_test) * 1e6, 3),
+            'single_row_predict_us': self._time_single_row(model, X_test)
+        }
     
-    def _train_deduction_optimizer(self, data: pd.DataFrame):
+    def _train_deduction_optimizer(self, data: pd.DataFrame,
+                                   family: Optional[str] = None,
+                                   assign: bool = True) -> Dict:
         """Train model to predict optimization potential"""
-        features = ['age', 'income', 'dependents', 'itemized_deductions']
-        X = data[features]
+        family = family or self.model_family
+        X = data[DEDUCTION_FEATURES].to_numpy(dtype=float)
         y = data['optimization_potential']
         
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         
-        self.deduction_optimizer = GradientBoostingClassifier(
-            n_estimators=100,
-            learning_rate=0.1,
-            max_depth=6,
-            random_state=42
-        )
+        model = MODEL_FAMILIES[family]['deduction_optimizer']()
         
         # Convert to classification problem (high/medium/low optimization potential)
-        y_train_class = pd.cut(y_train, bins=3, labels=['low', 'medium', 'high'])
-        y_test_class = pd.cut(y_test, bins=3, labels=['low', 'medium', 'high'])
+        y_train_class, bin_edges = pd.cut(y_train, bins=3, labels=['low', 'medium', 'high'], retbins=True)
+        bin_edges[0], bin_edges[-1] = -np.inf, np.inf
+        y_test_class = pd.cut(y_test, bins=bin_edges, labels=['low', 'medium', 'high'])
         
-        self.deduction_optimizer.fit(X_train, y_train_class)
+        started = time.perf_counter()
+        model.fit(X_train, y_train_class)
+        train_seconds = time.perf_counter() - started
         
         # Evaluate
-        y_pred = self.deduction_optimizer.predict(X_test)
-        logger.info("Deduction optimizer trained successfully")
+        started = time.perf_counter()
+        y_pred = model.predict(X_test)
+        predict_seconds = time.perf_counter() - started
+        accuracy = float(accuracy_score(y_test_class.astype(str), y_pred.astype(str)))
+        logger.info(f"Deduction optimizer ({family}) trained successfully, accuracy {accuracy:.3f}")
+        
+        if assign:
+            self.deduction_optimizer = model
+        
+        return {
+            'accuracy': round(accuracy, 4),
+            'train_seconds': round(train_seconds, 4),
+            'predict_us_per_row': round(predict_seconds / len(X_test) * 1e6, 3),
+            'single_row_predict_us': self._time_single_row(model, X_test)
+        }
     
-    def _train_risk_classifier(self, data: pd.DataFrame):
+    def _train_risk_classifier(self, data: pd.DataFrame,
+                               family: Optional[str] = None,
+                               assign: bool = True) -> Dict:
         """Train model to classify audit risk"""
-        features = ['income', 'itemized_deductions', 'dependents', 'actual_refund']
-        X = data[features]
+        family = family or self.model_family
+        X = data[RISK_FEATURES].to_numpy(dtype=float)
         y = data['audit_risk']
         
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         
-        self.risk_classifier = GradientBoostingClassifier(
-            n_estimators=100,
-            learning_rate=0.1,
-            max_depth=4,
-            random_state=42
-        )
+        model = MODEL_FAMILIES[family]['risk_classifier']()
         
-        self.risk_classifier.fit(X_train, y_train)
+        started = time.perf_counter()
+        model.fit(X_train, y_train)
+        train_seconds = time.perf_counter() - started
         
         # Evaluate
-        y_pred = self.risk_classifier.predict(X_test)
-        logger.info("Risk classifier trained successfully")
+        started = time.perf_counter()
+        y_pred = model.predict(X_test)
+        predict_seconds = time.perf_counter() - started
+        accuracy = float(accuracy_score(y_test, y_pred))
+        logger.info(f"Risk classifier ({family}) trained successfully, accuracy {accuracy:.3f}")
+        
+        if assign:
+            self.risk_classifier = model
+        
+        return {
+            'accuracy': round(accuracy, 4),
+            'train_seconds': round(train_seconds, 4),
+            'predict_us_per_row': round(predict_seconds / len(X_test) * 1e6, 3),
+            'single_row_predict_us': self._time_single_row(model, X_test)
+        }
+    
+    def _time_single_row(self, model, X_test, repeats: int = 50) -> float:
+        """Median latency of a one-row predict call, in microseconds"""
+        row = np.asarray(X_test[:1], dtype=float)
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            model.predict(row)
+            timings.append(time.perf_counter() - started)
+        return round(float(np.median(timings)) * 1e6, 1)
     
-    def predict_refund_optimization(self, user_data: Dict) -> Dict:
-        """Predict potential refund optimization"""
+    def compare_model_families(self, n_samples: int = 5000,
+                               families: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """Train every model family on the same synthetic data and report
+        train time, predict time and accuracy side by side.
+        
+        The serving models on this instance are left untouched.
+        """
+        families = families or list(MODEL_FAMILIES)
+        data = self._generate_synthetic_data(n_samples)
+        
+        report = {}
+        for family in families:
+            if family not in MODEL_FAMILIES:
+                raise ValueError(f"Unknown model family '{family}'")
+            
+            report[family] = {
+                'description': MODEL_FAMILIES[family]['description'],
+                'refund_predictor': self._train_refund_predictor(data, family, assign=False),
+                'deduction_optimizer': self._train_deduction_optimizer(data, family, assign=False),
+                'risk_classifier': self._train_risk_classifier(data, family, assign=False)
+            }
+        
+        return report
+    
+    def predict_refund_optimization(self, user_data: Dict, fast: bool = False) -> Dict:
+        """Predict potential refund optimization.
+        
+        With ``fast`` the refund comes from the distilled surrogate when the
+        return is inside its domain and its error bound allows, and from the
+        forest otherwise. The surrogate's interval approximates the forest
+        interval widened by the surrogate's error, so it is reported with
+        the forest's coverage as a conservative bound.
+        """
         if not self.is_trained:
             return {'error': 'Models not trained'}
         
         try:
-            # Prepare input data
-            input_features = self._prepare_input_features(user_data)
-            
-            # Predict refund
-            predicted_refund = self.refund_predictor.predict([input_features])[0]
+            surrogate = self.surrogate_router.fast_estimate(user_data) \
+                if fast and self.surrogate_router is not None else None
+            if surrogate is not None and surrogate[2] is not None:
+                predicted_refund, _, (lower, upper) = surrogate
+                refund_interval = {
+                    'lower': round(lower, 2),
+                    'upper': round(upper, 2),
+                    'coverage': self.refund_interval_coverage()
+                }
+                refund_source = 'surrogate'
+            else:
+                # Predict refund together with its interval
+                input_features = self._prepare_input_features(user_data)
+                predicted, lower, upper = self._predict_refund_interval(self._refund_matrix([input_features]))
+                predicted_refund = float(predicted[0])
+                refund_interval = {
+                    'lower': round(float(lower[0]), 2),
+                    'upper': round(float(upper[0]), 2),
+                    'coverage': self.refund_interval_coverage()
+                }
+                refund_source = 'full_model'
             
             # Predict optimization potential
             optimization_features = [
@@ -245,16 +575,115 @@ class TaxOptimizationML:
             
             return {
                 'predicted_refund': round(predicted_refund, 2),
+                'refund_interval': refund_interval,
+                'refund_source': refund_source,
                 'optimization_potential': optimization_class,
                 'optimization_confidence': max(optimization_proba),
-                'recommendations': recommendations,
-                'model_confidence': 0.85
+                'recommendations': recommendations
             }
             
         except Exception as e:
             logger.error(f"Error in refund optimization prediction: {e}")
             return {'error': str(e)}
     
+    def submit_refund_optimization(self, user_data: Dict):
+        """Queue predict_refund_optimization on the inference executor"""
+        return self.executor.submit(self.predict_refund_optimization, user_data)
+    
+    def submit_audit_risk(self, user_data: Dict, tax_result: Dict):
+        """Queue assess_audit_risk on the inference executor"""
+        return self.executor.submit(self.assess_audit_risk, user_data, tax_result)
+    
+    def executor_stats(self) -> Dict:
+        """Inference queue depth and thread budget"""
+        return self.executor.stats()
+    
+    def predict_refund_batch(self, records: List[Dict]) -> List[Dict]:
+        """Predict refunds with intervals for many returns in one vectorized pass"""
+        if not self.is_trained:
+            return [{'error': 'Models not trained'} for _ in records]
+        if not records:
+            return []
+        
+        X = self._refund_matrix([self._prepare_input_features(record) for record in records])
+        predicted, lower, upper = self._predict_refund_interval(X)
+        coverage = self.refund_interval_coverage()
+        
+        return [
+            {
+                'predicted_refund': round(p, 2),
+                'refund_interval': {'lower': round(lo, 2), 'upper': round(hi, 2), 'coverage': coverage}
+            }
+            for p, lo, hi in zip(predicted.tolist(), lower.tolist(), upper.tolist())
+        ]
+    
+    def refund_interval_coverage(self) -> float:
+        """Nominal coverage of the refund intervals"""
+        return round(REFUND_INTERVAL_QUANTILES[1] - REFUND_INTERVAL_QUANTILES[0], 2)
+    
+    def _predict_refund_interval(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return (prediction, lower, upper) for a prepared refund matrix.
+        
+        Forests use the spread of their per-tree outputs; other families
+        shift the prediction by the held-out residual quantiles recorded in
+        the manifest.
+        """
+        if hasattr(self.refund_predictor, 'estimators_'):
+            if self._forest_quantiles is None:
+                self._forest_quantiles = ForestQuantiles(self.refund_predictor)
+            return self._forest_quantiles.predict_interval(X, REFUND_INTERVAL_QUANTILES)
+        
+        predicted = self.refund_predictor.predict(X)
+        refund_metrics = self.manifest.get('metrics', {}).get('refund_predictor', {})
+        low_q, high_q = refund_metrics.get('residual_quantiles', (0.0, 0.0))
+        return predicted, predicted + low_q, predicted + high_q
+    
+    def predict_refund_fast(self, user_data: Dict) -> Dict:
+        """Refund estimate for interactive use.
+        
+        Served by the distilled surrogate when its error bound for this
+        region is within ``surrogate_max_error``, otherwise by the full model.
+        """
+        if not self.is_trained:
+            return {'error': 'Models not trained'}
+        
+        if self.surrogate_router is None:
+            X = self._refund_matrix([self._prepare_input_features(user_data)])
+            return {'predicted_refund': round(float(self.refund_predictor.predict(X)[0]), 2),
+                    'error_bound': 0.0, 'source': 'full_model'}
+        
+        return self.surrogate_router.predict(user_data)
+    
+    def distill_refund_surrogate(self, **kwargs):
+        """Fit, save and start serving a surrogate of the refund predictor"""
+        surrogate = distill_refund_surrogate(self, **kwargs)
+        with models_lock(self.model_dir):
+            replace_file(self.surrogate_path, lambda f: save_surrogate(surrogate, f))
+            self.manifest['refund_surrogate'] = surrogate.summary()
+            self._write_manifest()
+        self.surrogate_router = SurrogateRouter(self, surrogate, self.surrogate_max_error)
+        return surrogate
+    
+    def surrogate_stats(self) -> Dict:
+        """Fraction of fast refund requests served by the surrogate"""
+        if self.surrogate_router is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.surrogate_router.stats()}
+    
+    def _load_surrogate(self):
+        """Serve a saved surrogate only if it was distilled from the current
+        models and carries refund intervals"""
+        surrogate = load_surrogate(self.surrogate_path)
+        if surrogate is None:
+            return
+        
+        if surrogate.model_trained_at != self.manifest.get('trained_at') or not surrogate.interval_cells:
+            logger.info("Saved refund surrogate is stale, run distill_refund_surrogate() to rebuild it")
+            return
+        
+        self.surrogate_router = SurrogateRouter(self, surrogate, self.surrogate_max_error)
+        logger.info(f"Refund surrogate loaded ({len(surrogate.cells)} cells)")
+    
     def assess_audit_risk(self, user_data: Dict, tax_result: Dict) -> Dict:
         """Assess audit risk based on tax data"""
         if not self.is_trained:
@@ -286,64 +715,18 @@ class TaxOptimizationML:
             return {'risk_level': 'unknown', 'confidence': 0}
     
     def get_tax_planning_suggestions(self, user_data: Dict) -> List[Dict]:
-        """Generate tax planning suggestions using ML insights"""
-        suggestions = []
-        
-        income = user_data['income']
-        age = user_data['age']
-        filing_status = user_data['filing_status']
-        dependents = user_data['dependents']
-        
-        # Income-based suggestions
-        if income > 50000:
-            suggestions.append({
-                'category': 'Retirement Planning',
-                'suggestion': 'Consider maximizing 401(k) contributions',
-                'potential_savings': min(22500, income * 0.15) * 0.22,
-                'priority': 'high',
-                'implementation': 'Increase payroll deduction for retirement account'
-            })
-        
-        if income > 100000:
-            suggestions.append({
-                'category': 'Tax-Advantaged Accounts',
-                'suggestion': 'Maximize HSA contributions if available',
-                'potential_savings': 3650 * 0.24 if filing_status == 'single' else 7300 * 0.24,
-                'priority': 'high',
-                'implementation': 'Enroll in high-deductible health plan with HSA'
-            })
-        
-        # Age-based suggestions
-        if age >= 50:
-            suggestions.append({
-                'category': 'Catch-up Contributions',
-                'suggestion': 'Take advantage of catch-up retirement contributions',
-                'potential_savings': 7500 * 0.24,  # Additional 401(k) catch-up
-                'priority': 'medium',
-                'implementation': 'Increase 401(k) contribution by $7,500'
-            })
-        
-        # Family-based suggestions
-        if dependents > 0:
-            suggestions.append({
-                'category': 'Education Planning',
-                'suggestion': 'Consider 529 education savings plan',
-                'potential_savings': 2000 * dependents,  # State tax deduction
-                'priority': 'medium',
-                'implementation': 'Open 529 account and set up automatic contributions'
-            })
-        
-        # Business opportunity suggestions
-        if income > 30000:
-            suggestions.append({
-                'category': 'Business Deductions',
-                'suggestion': 'Track home office and business expenses',
-                'potential_savings': 1500,
-                'priority': 'low',
-                'implementation': 'Maintain detailed records of business-related expenses'
-            })
-        
-        return suggestions
+        """Generate tax planning suggestions using ML insights
+        
+        The rules are precomputed into a decision table over their income,
+        age, dependents and filing status thresholds, so this is a lookup
+        plus the income-linear savings.
+        """
+        return PLANNING_SUGGESTIONS.suggest({
+            'income': user_data['income'],
+            'age': user_data['age'],
+            'filing_status': user_data['filing_status'],
+            'dependents': user_data['dependents']
+        })
     
     def _prepare_input_features(self, user_data: Dict) -> List:
         """Prepare input features for ML models"""
@@ -361,6 +744,14 @@ class TaxOptimizationML:
         
         return features
     
+    def _refund_matrix(self, rows) -> np.ndarray:
+        """Turn prepared refund feature rows into the matrix the refund
+        predictor was trained on (scaled only for families that need it)"""
+        X = np.asarray(rows, dtype=float)
+        if MODEL_FAMILIES[self.model_family]['scale_features']:
+            X = self.scaler.transform(X)
+        return X
+    
     def _generate_recommendations(self, user_data: Dict, optimization_class: str) -> List[Dict]:
         """Generate specific tax optimization recommendations"""
         recommendations = []
@@ -502,17 +893,39 @@ class TaxOptimizationML:
         else:
             return 'low'
     
-    def _save_models(self):
-        """Save trained models to disk"""
-        joblib.dump(self.refund_predictor, self.refund_model_path)
-        joblib.dump(self.deduction_optimizer, self.deduction_model_path)
-        joblib.dump(self.risk_classifier, self.risk_model_path)
-        joblib.dump(self.scaler, self.scaler_path)
+    def _save_models(self, metrics: Optional[Dict] = None):
+        """Save trained models to disk; callers hold the models lock"""
+        for model, path in ((self.refund_predictor, self.refund_model_path),
+                            (self.deduction_optimizer, self.deduction_model_path),
+                            (self.risk_classifier, self.risk_model_path),
+                            (self.scaler, self.scaler_path)):
+            replace_file(path, lambda f, model=model: joblib.dump(model, f))
         
         # Save label encoders
         for name, encoder in self.label_encoders.items():
             encoder_path = os.path.join(self.model_dir, f"{name}_encoder.pkl")
-            joblib.dump(encoder, encoder_path)
+            replace_file(encoder_path, lambda f, encoder=encoder: joblib.dump(encoder, f))
+        
+        # Record what was trained alongside the pickles
+        self.manifest = {
+            'model_family': self.model_family,
+            'trained_at': datetime.now().isoformat(),
+            'sklearn_version': sklearn.__version__,
+            'features': {
+                'refund_predictor': REFUND_FEATURES,
+                'deduction_optimizer': DEDUCTION_FEATURES,
+                'risk_classifier': RISK_FEATURES
+            },
+            'scale_features': MODEL_FAMILIES[self.model_family]['scale_features'],
+            'metrics': metrics or {}
+        }
+        self.surrogate_router = None
+        self._write_manifest()
+    
+    def _write_manifest(self):
+        """Persist the model manifest next to the pickles; callers hold the
+        models lock"""
+        replace_file(self.manifest_path, lambda f: json.dump(self.manifest, f, indent=2), mode='w')
     
     def _load_models(self):
         """Load trained models from disk"""
@@ -521,6 +934,13 @@ class TaxOptimizationML:
         self.risk_classifier = joblib.load(self.risk_model_path)
         self.scaler = joblib.load(self.scaler_path)
         
+        # Models saved before the manifest existed are the original forest family
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'model_family': DEFAULT_MODEL_FAMILY}
+        
         # Load label encoders
         encoder_files = [f for f in os.listdir(self.model_dir) if f.endswith('_encoder.pkl')]
         for encoder_file in encoder_files:
@@ -528,4 +948,34 @@ class TaxOptimizationML:
             encoder_path = os.path.join(self.model_dir, encoder_file)
             self.label_encoders[name] = joblib.load(encoder_path)
         
-        self.is_trained = True
\ No newline at end of file
+        self.is_trained = True
+
+
+def format_family_report(report: Dict[str, Dict]) -> str:
+    """Render the output of compare_model_families as a plain-text table"""
+    lines = [f"{'family':<24}{'model':<22}{'train s':>10}{'us/row':>10}{'1-row us':>10}  score"]
+    for family, models in report.items():
+        for model_name in ('refund_predictor', 'deduction_optimizer', 'risk_classifier'):
+            m = models[model_name]
+            score = f"rmse ${m['rmse']:,.2f}" if 'rmse' in m else f"acc {m['accuracy']:.3f}"
+            lines.append(f"{family:<24}{model_name:<22}{m['train_seconds']:>10.3f}"
+                         f"{m['predict_us_per_row']:>10.2f}{m['single_row_predict_us']:>10.1f}  {score}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Compare the model families, or retrain the saved models")
+    parser.add_argument('command', nargs='?', choices=['compare', 'train'], default='compare')
+    parser.add_argument('--family', choices=sorted(MODEL_FAMILIES),
+                        help="family to train (default ML_MODEL_FAMILY)")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    ml = TaxOptimizationML()
+    if args.command == 'train':
+        ml.train(args.family or os.environ.get('ML_MODEL_FAMILY', DEFAULT_MODEL_FAMILY))
+        print(json.dumps(ml.manifest, indent=2))
+    else:
+        print(format_family_report(ml.compare_model_families()))
@@ -0,0 +1,317 @@
+"""PDF version of the tax form.
+
+Everything that does not depend on the return (reportlab imports, paragraph
+and table styles, section headings and the disclaimer) is built once per
+process; a download only builds the data tables and the lines that carry
+the return's figures or today's date.
+
+    python pdf_forms.py          # per-PDF render time, cached vs rebuilt templates
+"""
+import copy
+import datetime as dt
+import logging
+import threading
+import time
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, Optional
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    REPORTLAB_AVAILABLE = True
+except ImportError:  # the text form stands in for the PDF without reportlab
+    REPORTLAB_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+SECTION_HEADINGS = ['Personal Information', 'Income', 'Deductions', 'Tax Calculation', 'Payments',
+                    'Final Result', 'AI-Powered Tax Insights']
+SUBHEADINGS = ['Optimization Analysis', 'Audit Risk Assessment', 'Tax Planning Suggestions']
+DISCLAIMER = [
+    "ENHANCED PROTOTYPE VERSION - FOR EDUCATIONAL PURPOSES ONLY",
+    "This AI-enhanced form includes predictive analytics and third-party integrations.",
+    "Not suitable for actual tax filing. Consult a qualified tax professional."
+]
+
+
+class PdfTemplates:
+    """Styles, table styles and static paragraphs shared by every PDF"""
+
+    def __init__(self):
+        styles = getSampleStyleSheet()
+        self.normal = styles['Normal']
+        self.title = ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=18,
+            spaceAfter=30,
+            alignment=1,
+            textColor=colors.darkblue
+        )
+        self.heading = ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=14,
+            spaceAfter=12,
+            textColor=colors.darkblue,
+            borderWidth=1,
+            borderColor=colors.darkblue,
+            borderPadding=5,
+            backColor=colors.lightgrey
+        )
+        self.subheading = ParagraphStyle(
+            'SubHeading',
+            parent=styles['Heading3'],
+            fontSize=12,
+            spaceAfter=8,
+            textColor=colors.black,
+            fontName='Helvetica-Bold'
+        )
+        self.footer = ParagraphStyle(
+            'Footer',
+            parent=styles['Normal'],
+            fontSize=8,
+            textColor=colors.grey,
+            alignment=1
+        )
+        # Final result box, keyed by "is a refund"
+        self.result = {
+            is_refund: ParagraphStyle(
+                'Result',
+                parent=styles['Normal'],
+                fontSize=16,
+                textColor=color,
+                alignment=1,
+                backColor=colors.lightgrey,
+                borderWidth=2,
+                borderColor=color,
+                borderPadding=10
+            )
+            for is_refund, color in ((True, colors.green), (False, colors.red))
+        }
+
+        def grid(label_color, align, font_size=10, padding=12, extra=()):
+            return TableStyle([
+                ('BACKGROUND', (0, 0), (0, -1), label_color),
+                ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+                align,
+                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+                ('FONTSIZE', (0, 0), (-1, -1), font_size),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), padding),
+                ('BACKGROUND', (1, 0), (1, -1), colors.white),
+                ('GRID', (0, 0), (-1, -1), 1, colors.black),
+                *extra
+            ])
+
+        left = ('ALIGN', (0, 0), (-1, -1), 'LEFT')
+        right = ('ALIGN', (1, 0), (1, -1), 'RIGHT')
+        self.personal_table = grid(colors.lightblue, left)
+        self.amount_table = grid(colors.lightblue, right)
+        self.deductions_table = grid(colors.lightblue, right, extra=(
+            ('BACKGROUND', (0, 2), (-1, 3), colors.lightyellow),
+            ('FONTNAME', (0, 2), (-1, 3), 'Helvetica-Bold')
+        ))
+        self.total_table = grid(colors.lightblue, right, extra=(
+            ('BACKGROUND', (0, -1), (-1, -1), colors.lightyellow),
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold')
+        ))
+        self.optimization_table = grid(colors.lightsteelblue, left)
+        self.risk_table = grid(colors.lightcoral, left)
+        self.suggestion_table = grid(colors.lightsteelblue, ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                                     font_size=9, padding=8)
+
+        # Parsing paragraph markup is the costly part of a Paragraph, so
+        # static ones are parsed here and shallow-copied into each document
+        self._static = {text: Paragraph(text, self.heading) for text in SECTION_HEADINGS}
+        self._static.update({text: Paragraph(text, self.subheading) for text in SUBHEADINGS})
+        self._static.update({text: Paragraph(text, self.footer) for text in DISCLAIMER})
+        self._static['title'] = Paragraph("U.S. Individual Income Tax Return (AI Enhanced)", self.title)
+
+    def paragraph(self, text: str):
+        return copy.copy(self._static[text])
+
+
+@lru_cache(maxsize=None)
+def templates() -> PdfTemplates:
+    return PdfTemplates()
+
+
+_stats_lock = threading.Lock()
+_stats = {'rendered': 0, 'failed': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+
+
+def pdf_stats() -> Dict:
+    """PDFs rendered in this process and their render time"""
+    with _stats_lock:
+        rendered = _stats['rendered']
+        return {
+            'rendered': rendered,
+            'failed': _stats['failed'],
+            'mean_ms': round(_stats['total_seconds'] / rendered * 1000, 3) if rendered else 0.0,
+            'max_ms': round(_stats['max_seconds'] * 1000, 3)
+        }
+
+
+def generate_pdf_form(user_data: Dict, tax_result: Dict, ml_insights: Optional[Dict] = None,
+                      api_enhancements: Optional[Dict] = None) -> BytesIO:
+    """Render the tax form as a PDF; raises when reportlab is missing so
+    callers can fall back to the text form"""
+    if not REPORTLAB_AVAILABLE:
+        raise Exception("PDF generation requires reportlab library")
+
+    started = time.perf_counter()
+    try:
+        buffer = _build(templates(), user_data, tax_result, ml_insights)
+    except Exception:
+        with _stats_lock:
+            _stats['failed'] += 1
+        raise
+    seconds = time.perf_counter() - started
+    with _stats_lock:
+        _stats['rendered'] += 1
+        _stats['total_seconds'] += seconds
+        _stats['max_seconds'] = max(_stats['max_seconds'], seconds)
+    return buffer
+
+
+def _build(t: PdfTemplates, user_data: Dict, tax_result: Dict, ml_insights: Optional[Dict]) -> BytesIO:
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=72, leftMargin=72,
+                            topMargin=72, bottomMargin=18)
+    story = []
+
+    # Title
+    story.append(t.paragraph('title'))
+    story.append(Paragraph(f"Tax Year {dt.datetime.now().year - 1}", t.normal))
+    story.append(Spacer(1, 20))
+
+    # Personal Information Section
+    story.append(t.paragraph('Personal Information'))
+    story.append(Table([
+        ['Filing Status:', user_data.get('filing_status', 'N/A').replace('_', ' ').title()],
+        ['Age:', str(user_data.get('age', 'N/A'))],
+        ['Number of Dependents:', str(user_data.get('dependents', 'N/A'))],
+        ['State:', user_data.get('state', 'N/A')]
+    ], colWidths=[2*inch, 3*inch], style=t.personal_table))
+    story.append(Spacer(1, 20))
+
+    # Income Section
+    story.append(t.paragraph('Income'))
+    story.append(Table([
+        ['Line 1 - Total Income:', f"${user_data.get('income', 0):,.2f}"]
+    ], colWidths=[3*inch, 2*inch], style=t.amount_table))
+    story.append(Spacer(1, 20))
+
+    # Deductions Section
+    story.append(t.paragraph('Deductions'))
+    story.append(Table([
+        ['Line 2a - Standard Deduction:', f"${tax_result.get('standard_deduction', 0):,.2f}"],
+        ['Line 2b - Itemized Deductions:', f"${user_data.get('itemized_deductions', 0):,.2f}"],
+        ['Line 3 - Total Deductions:', f"${tax_result.get('total_deductions', 0):,.2f}"],
+        ['Line 4 - Taxable Income:', f"${tax_result.get('taxable_income', 0):,.2f}"]
+    ], colWidths=[3*inch, 2*inch], style=t.deductions_table))
+    story.append(Spacer(1, 20))
+
+    # Tax Calculation Section
+    story.append(t.paragraph('Tax Calculation'))
+    tax_calc_data = [
+        ['Line 5 - Tax on Taxable Income:', f"${tax_result.get('federal_tax_before_credits', 0):,.2f}"]
+    ]
+    if tax_result.get('child_tax_credit', 0) > 0:
+        tax_calc_data.append(['Line 6 - Child Tax Credit:', f"${tax_result.get('child_tax_credit', 0):,.2f}"])
+    tax_calc_data.append(['Line 7 - Total Tax After Credits:', f"${tax_result.get('tax_owed', 0):,.2f}"])
+    story.append(Table(tax_calc_data, colWidths=[3*inch, 2*inch], style=t.total_table))
+    story.append(Spacer(1, 20))
+
+    # Payments Section
+    story.append(t.paragraph('Payments'))
+    story.append(Table([
+        ['Line 8 - Federal Income Tax Withheld:', f"${user_data.get('withholding', 0):,.2f}"]
+    ], colWidths=[3*inch, 2*inch], style=t.amount_table))
+    story.append(Spacer(1, 20))
+
+    # Final Result Section
+    story.append(t.paragraph('Final Result'))
+    is_refund = tax_result.get('refund_or_owe', 0) > 0
+    if is_refund:
+        result_text = f"REFUND: ${tax_result.get('refund_or_owe', 0):,.2f}"
+    else:
+        result_text = f"AMOUNT OWED: ${abs(tax_result.get('refund_or_owe', 0)):,.2f}"
+    story.append(Paragraph(f"<b>{result_text}</b>", t.result[is_refund]))
+    story.append(Spacer(1, 20))
+
+    # AI Insights Section (if available)
+    if ml_insights:
+        story.append(PageBreak())
+        story.append(t.paragraph('AI-Powered Tax Insights'))
+
+        optimization = ml_insights.get('optimization', {})
+        if optimization:
+            story.append(t.paragraph('Optimization Analysis'))
+            story.append(Table([
+                ['Optimization Potential:', optimization.get('optimization_potential', 'Unknown').title()],
+                ['Confidence Level:', f"{optimization.get('optimization_confidence', 0)*100:.0f}%"]
+            ], colWidths=[2*inch, 3*inch], style=t.optimization_table))
+            story.append(Spacer(1, 15))
+
+        audit_risk = ml_insights.get('audit_risk', {})
+        if audit_risk:
+            story.append(t.paragraph('Audit Risk Assessment'))
+            story.append(Table([
+                ['Risk Level:', audit_risk.get('risk_level', 'Unknown').title()],
+                ['Risk Probability:', f"{audit_risk.get('risk_probability', 0)*100:.1f}%"]
+            ], colWidths=[2*inch, 3*inch], style=t.risk_table))
+            story.append(Spacer(1, 15))
+
+        planning_suggestions = ml_insights.get('planning_suggestions', [])
+        if planning_suggestions:
+            story.append(t.paragraph('Tax Planning Suggestions'))
+            for suggestion in planning_suggestions[:3]:
+                story.append(Table([
+                    ['Category:', suggestion.get('category', 'General')],
+                    ['Suggestion:', suggestion.get('suggestion', 'No suggestion available')],
+                    ['Potential Savings:', f"${suggestion.get('potential_savings', 0):,.0f}"],
+                    ['Priority:', suggestion.get('priority', 'Medium').title()],
+                    ['Effort:', suggestion.get('effort', 'Medium').title()]
+                ], colWidths=[1.5*inch, 3.5*inch], style=t.suggestion_table))
+                story.append(Spacer(1, 10))
+
+    # Footer
+    story.append(Spacer(1, 30))
+    story.append(Paragraph(
+        f"Generated by AI Tax Return Agent on {dt.datetime.now().strftime('%B %d, %Y')}", t.footer))
+    story.append(Spacer(1, 10))
+    story.extend(t.paragraph(line) for line in DISCLAIMER)
+
+    doc.build(story)
+    buffer.seek(0)
+    return buffer
+
+
+if __name__ == '__main__':
+    from insight_rules import INSIGHT_ENGINE
+    from tax_engine import calculate_federal_tax
+
+    user_data = {'income': 85000.0, 'filing_status': 'married_joint', 'age': 40, 'dependents': 2,
+                 'itemized_deductions': 0.0, 'withholding': 9000.0, 'state': 'NY'}
+    tax_result = calculate_federal_tax(user_data)
+    ml_insights = INSIGHT_ENGINE.generate(user_data, tax_result)
+    runs = 100
+
+    generate_pdf_form(user_data, tax_result, ml_insights)
+    started = time.perf_counter()
+    for _ in range(runs):
+        generate_pdf_form(user_data, tax_result, ml_insights)
+    cached_ms = (time.perf_counter() - started) / runs * 1000
+
+    started = time.perf_counter()
+    for _ in range(runs):
+        templates.cache_clear()
+        generate_pdf_form(user_data, tax_result, ml_insights)
+    rebuilt_ms = (time.perf_counter() - started) / runs * 1000
+
+    print(f"PDF render: {cached_ms:.2f} ms with cached templates, {rebuilt_ms:.2f} ms rebuilding them per PDF")
@@ -0,0 +1,161 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Per-upstream token buckets and daily quotas shared by every worker on
+    the host through one SQLite database.
+
+    Each call takes one token. Buckets refill at ``rate`` tokens per second
+    up to ``burst``; a separate counter stops all calls for the rest of the
+    day once ``daily_quota`` is used. Callers that find the bucket empty
+    wait for the next token if it arrives within ``max_wait`` seconds
+    (queue) and are refused otherwise (fallback).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.environ.get('API_RATE_LIMIT_DB') \
+            or os.path.join(tempfile.gettempdir(), 'tax_agent_rate_limits.db')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.limits = {}
+        self.counters = {}
+
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS token_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                day TEXT NOT NULL,
+                used_today INTEGER NOT NULL
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def configure(self, name: str, rate: float, burst: float, daily_quota: int, max_wait: float) -> None:
+        self.limits[name] = {'rate': rate, 'burst': burst, 'daily_quota': daily_quota, 'max_wait': max_wait}
+        self.counters[name] = {'granted': 0, 'queued': 0, 'denied_rate': 0, 'denied_quota': 0}
+
+    def configure_from_env(self, name: str) -> None:
+        """Limits from API_<NAME>_RATE, _BURST, _DAILY_QUOTA and _RATE_MAX_WAIT"""
+        prefix = f'API_{name.upper()}_'
+        self.configure(
+            name,
+            rate=float(os.environ.get(prefix + 'RATE', 10)),
+            burst=float(os.environ.get(prefix + 'BURST', 20)),
+            daily_quota=int(os.environ.get(prefix + 'DAILY_QUOTA', 50000)),
+            max_wait=float(os.environ.get(prefix + 'RATE_MAX_WAIT', 0.25))
+        )
+
+    def _count(self, name: str, counter: str) -> None:
+        with self._lock:
+            self.counters[name][counter] += 1
+
+    def _take(self, name: str) -> float:
+        """Try to take a token. Returns 0 on success, the seconds until the
+        next token when the bucket is empty, or -1 when the quota is spent."""
+        limits = self.limits[name]
+        conn = self._connect()
+        now = time.time()
+        today = date.today().isoformat()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at, day, used_today FROM token_buckets WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                tokens, used_today = limits['burst'], 0
+            else:
+                tokens = min(limits['burst'], row[0] + (now - row[1]) * limits['rate'])
+                used_today = row[3] if row[2] == today else 0
+
+            if used_today >= limits['daily_quota']:
+                result = -1.0
+            elif tokens >= 1:
+                tokens -= 1
+                used_today += 1
+                result = 0.0
+            else:
+                result = (1 - tokens) / limits['rate']
+
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at, day, used_today) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (name, tokens, now, today, used_today)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def acquire(self, name: str, max_wait: Optional[float] = None) -> bool:
+        """Take a token for one call to ``name``, waiting up to ``max_wait``
+        (default: the upstream's configured max_wait). Upstreams without
+        configured limits are never throttled."""
+        if name not in self.limits:
+            return True
+
+        if max_wait is None:
+            max_wait = self.limits[name]['max_wait']
+        deadline = time.monotonic() + max_wait
+        queued = False
+        while True:
+            wait = self._take(name)
+            if wait == 0:
+                self._count(name, 'granted')
+                if queued:
+                    self._count(name, 'queued')
+                return True
+            if wait < 0:
+                self._count(name, 'denied_quota')
+                return False
+            if time.monotonic() + wait > deadline:
+                self._count(name, 'denied_rate')
+                return False
+            queued = True
+            time.sleep(wait)
+
+    def remaining(self, name: str) -> Dict:
+        """Tokens available now and calls left in today's quota"""
+        limits = self.limits[name]
+        row = self._connect().execute(
+            "SELECT tokens, updated_at, day, used_today FROM token_buckets WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            tokens, used_today = limits['burst'], 0
+        else:
+            tokens = min(limits['burst'], row[0] + (time.time() - row[1]) * limits['rate'])
+            used_today = row[3] if row[2] == date.today().isoformat() else 0
+        return {
+            'tokens': round(tokens, 2),
+            'used_today': used_today,
+            'quota_remaining': max(0, limits['daily_quota'] - used_today)
+        }
+
+    def stats(self, name: str) -> Dict:
+        with self._lock:
+            counters = dict(self.counters.get(name, {}))
+        if name in self.limits:
+            counters.update(self.remaining(name))
+            counters.update({k: self.limits[name][k] for k in ('rate', 'burst', 'daily_quota')})
+        return counters
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the snapshot or of any cached response changes;
+# snapshots with another version are ignored and rebuilt
+SNAPSHOT_VERSION = 2
+
+DEFAULT_SNAPSHOT_PATH = os.path.join('snapshots', 'reference_data.json')
+
+
+def snapshot_path() -> str:
+    return os.environ.get('API_SNAPSHOT_PATH', DEFAULT_SNAPSHOT_PATH)
+
+
+def prefetch_reference_data(api, tax_year: int = 2023, previous: Optional[Dict] = None) -> Dict:
+    """Fetch every reference lookup from the upstreams and prime the cache.
+
+    Returns namespace -> key -> value. A lookup that fails keeps its value
+    from ``previous`` (the last snapshot), so a partial outage never
+    shrinks the snapshot.
+    """
+    previous = previous or {}
+    data = {}
+    failed = 0
+    for namespace, key, fetch in api.reference_fetchers(tax_year):
+        try:
+            value = fetch()
+            api.cache.set(namespace, key, value)
+        except Exception as e:
+            value = previous.get(namespace, {}).get(key)
+            failed += 1
+            logger.warning(f"Prefetch of {namespace}:{key} failed, keeping snapshot value: {e}")
+        if value is not None:
+            data.setdefault(namespace, {})[key] = value
+
+    logger.info(f"Prefetched {sum(len(v) for v in data.values())} reference entries ({failed} failed)")
+    return data
+
+
+def write_snapshot(data: Dict, path: Optional[str] = None, tax_year: int = 2023) -> str:
+    """Write a versioned snapshot atomically: readers see the old file or
+    the complete new one, never a partial write"""
+    path = path or snapshot_path()
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'created_ts': time.time(),
+        'tax_year': tax_year,
+        'namespaces': data
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    logger.info(f"Wrote reference snapshot v{SNAPSHOT_VERSION} to {path}")
+    return path
+
+
+def load_snapshot(path: Optional[str] = None) -> Optional[Dict]:
+    """Read a snapshot file; None if missing, unreadable or another version"""
+    path = path or snapshot_path()
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable reference snapshot {path}: {e}")
+        return None
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        logger.warning(f"Ignoring reference snapshot {path}: version {snapshot.get('version')}, "
+                       f"expected {SNAPSHOT_VERSION}")
+        return None
+    return snapshot
+
+
+def apply_snapshot(api, snapshot: Dict) -> int:
+    """Seed the cache from a snapshot without overwriting fresher entries,
+    and keep it on ``api`` as the fallback for unreachable upstreams.
+
+    Entries are only as fresh as the snapshot: one older than a
+    namespace's TTL loads stale, so the first read serves it and refreshes
+    it in the background.
+    """
+    api.snapshot = snapshot['namespaces']
+    written_at = snapshot.get('created_ts', 0)
+    loaded = 0
+    for namespace, entries in snapshot['namespaces'].items():
+        for key, value in entries.items():
+            if api.cache.get(namespace, key) is None:
+                api.cache.set(namespace, key, value, fetched_at=written_at)
+                loaded += 1
+    return loaded
+
+
+def refresh_snapshot(api, path: Optional[str] = None, tax_year: int = 2023) -> Dict:
+    """Prefetch everything and rewrite the snapshot file"""
+    path = path or snapshot_path()
+    previous = load_snapshot(path)
+    data = prefetch_reference_data(api, tax_year, previous['namespaces'] if previous else None)
+    write_snapshot(data, path, tax_year)
+    api.snapshot = data
+    return data
+
+
+def warm_start(api, path: Optional[str] = None, max_age: Optional[float] = None,
+               tax_year: int = 2023) -> Dict:
+    """Load the snapshot into the cache before the app takes traffic.
+
+    Without a usable snapshot the reference data is prefetched inline, so
+    the first requests still find a warm cache. A snapshot older than
+    ``max_age`` seconds is served at once and rebuilt in the background.
+    """
+    path = path or snapshot_path()
+    max_age = max_age if max_age is not None else float(os.environ.get('API_SNAPSHOT_MAX_AGE', 24 * 3600))
+    started = time.perf_counter()
+
+    snapshot = load_snapshot(path)
+    if snapshot is None:
+        try:
+            refresh_snapshot(api, path, tax_year)
+        except OSError as e:
+            logger.warning(f"Could not write reference snapshot {path}: {e}")
+        status = 'prefetched'
+    else:
+        loaded = apply_snapshot(api, snapshot)
+        status = f'loaded {loaded} entries'
+        age = time.time() - snapshot.get('created_ts', 0)
+        if age > max_age:
+            threading.Thread(target=_refresh_quietly, args=(api, path, tax_year),
+                             name='snapshot-refresh', daemon=True).start()
+            status += f', rebuilding (age {age / 3600:.1f}h)'
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Reference data warm start: {status} in {elapsed_ms:.1f} ms")
+    return {'status': status, 'seconds': round(elapsed_ms / 1000, 4), 'path': path}
+
+
+def _refresh_quietly(api, path: str, tax_year: int) -> None:
+    try:
+        refresh_snapshot(api, path, tax_year)
+    except Exception as e:
+        logger.warning(f"Background snapshot rebuild failed: {e}")
+
+
+if __name__ == '__main__':
+    from third_party_apis import TaxAPIIntegration
+
+    logging.basicConfig(level=logging.INFO)
+    data = refresh_snapshot(TaxAPIIntegration())
+    print(f"Snapshot {snapshot_path()}: " + ', '.join(f"{ns}={len(entries)}" for ns, entries in data.items()))
@@ -0,0 +1,273 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from deadlines import deadline_at, run_with_context
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in each stage's latency estimate
+LATENCY_EWMA_ALPHA = 0.2
+
+# A stage skipped for its latency estimate still runs every Nth time so the
+# estimate can recover once the upstream speeds up again
+SKIP_PROBE_INTERVAL = 20
+
+# Last good values kept for stages that declare a cache_key
+LAST_VALUE_CACHE_SIZE = 1024
+
+
+class Stage:
+    """One unit of work in a request pipeline.
+
+    ``fn`` is called as ``fn(inputs)`` where ``inputs`` maps each stage in
+    ``depends_on`` to its value. ``deadline`` is measured from the moment the
+    stage starts; a stage that misses it (or raises) resolves to
+    the last good value stored under ``cache_key``, then to
+    ``fallback(inputs)``, otherwise to None. Stages can be pinned to their
+    own ``executor`` (e.g. the ML executor).
+    """
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any], deadline: float,
+                 depends_on: Sequence[str] = (), fallback: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 executor: Optional[Executor] = None, required: bool = False,
+                 cache_key: Optional[str] = None):
+        self.name = name
+        self.fn = fn
+        self.deadline = deadline
+        self.depends_on = tuple(depends_on)
+        self.fallback = fallback
+        self.executor = executor
+        self.required = required
+        self.cache_key = cache_key
+
+
+class StageFailed(Exception):
+    """Raised when a required stage errors or misses its deadline"""
+
+
+class RequestPipeline:
+    """Runs the stages of a request concurrently on a shared executor.
+
+    Stages start as soon as their dependencies resolve, so request latency
+    follows the slowest dependency chain instead of the sum of all stages.
+    The calling thread only coordinates: it waits for the next completion
+    or the nearest stage deadline, whichever comes first.
+
+    Each request also has a latency budget. Optional stages are cut off
+    when the budget runs out, and are not started at all when their recent
+    latency says they would overrun what is left of it. Those stages are
+    served degraded from their last cached value or fallback instead.
+
+    Each stage runs under its own deadline (see deadlines.py), so upstream
+    calls inside it give up when the stage does rather than running on.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, budget: Optional[float] = None):
+        self.max_workers = max_workers or int(os.environ.get('PIPELINE_WORKERS', 16))
+        self.budget = budget or float(os.environ.get('REQUEST_LATENCY_BUDGET', 1.0))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pipeline')
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._last_values = OrderedDict()
+        self.requests = 0
+        self.degraded_requests = 0
+
+    def run(self, stages: List[Stage], budget: Optional[float] = None) -> Dict[str, Any]:
+        """Run ``stages`` within ``budget`` seconds (the pipeline default if
+        omitted) and return their values, timings and the stages that timed
+        out, failed or were served degraded"""
+        budget = budget or self.budget
+        by_name = {stage.name: stage for stage in stages}
+        for stage in stages:
+            missing = [dep for dep in stage.depends_on if dep not in by_name]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages {missing}")
+
+        values = {}
+        timings = {}
+        timed_out = []
+        errors = {}
+        degraded = []
+        running = {}  # future -> (stage, started, inputs)
+        waiting = list(stages)
+        request_started = time.perf_counter()
+        budget_ends = request_started + budget
+
+        def stage_deadline(stage, started):
+            # Required stages have no substitute, so only their own deadline applies
+            if stage.required:
+                return started + stage.deadline
+            return min(started + stage.deadline, budget_ends)
+
+        def start_ready():
+            # Loop because a stage that fails to submit resolves immediately
+            # and may unblock its dependents
+            progressed = True
+            while progressed:
+                progressed = False
+                for stage in [s for s in waiting if all(dep in values for dep in s.depends_on)]:
+                    progressed = True
+                    waiting.remove(stage)
+                    inputs = {dep: values[dep] for dep in stage.depends_on}
+                    executor = stage.executor or self._executor
+                    started = time.perf_counter()
+                    if not stage.required and self._should_skip(stage.name, budget_ends - started):
+                        resolve(stage, started, inputs, skipped=True)
+                        continue
+                    try:
+                        future = executor.submit(run_with_context(
+                            self._run_stage, stage.fn, inputs, stage_deadline(stage, started)))
+                    except Exception as e:  # e.g. a saturated ML executor
+                        resolve(stage, started, inputs, error=e)
+                        continue
+                    running[future] = (stage, started, inputs)
+
+        def resolve(stage, started, inputs, value=None, error=None, expired=False, skipped=False):
+            timings[stage.name] = round(time.perf_counter() - started, 6)
+            if error is None and not expired and not skipped:
+                values[stage.name] = value
+                if stage.cache_key is not None:
+                    self._remember(stage.name, stage.cache_key, value)
+            else:
+                if expired:
+                    timed_out.append(stage.name)
+                elif error is not None:
+                    errors[stage.name] = str(error)
+                    logger.error(f"Pipeline stage '{stage.name}' failed: {error}")
+                if stage.required:
+                    raise StageFailed(f"Required stage '{stage.name}' "
+                                      f"{'timed out' if expired else 'failed'}: {error or ''}".rstrip(': '))
+                values[stage.name] = self._degraded_value(stage, inputs)
+                degraded.append(stage.name)
+            self._record(stage.name, timings[stage.name], expired, error is not None, skipped)
+
+        start_ready()
+        while running:
+            now = time.perf_counter()
+            next_deadline = min(stage_deadline(stage, started) for stage, started, _ in running.values())
+            done, _ = wait(list(running), timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage, started, inputs = running.pop(future)
+                try:
+                    resolve(stage, started, inputs, value=future.result())
+                except StageFailed:
+                    raise
+                except Exception as e:
+                    resolve(stage, started, inputs, error=e)
+
+            # Give up on stages past their deadline; their threads finish in
+            # the background and the result is discarded
+            now = time.perf_counter()
+            for future, (stage, started, inputs) in list(running.items()):
+                if now >= stage_deadline(stage, started):
+                    running.pop(future)
+                    future.cancel()
+                    resolve(stage, started, inputs, expired=True)
+
+            start_ready()
+
+        if waiting:
+            # Only possible with a dependency cycle
+            raise ValueError(f"Stages never became ready: {[stage.name for stage in waiting]}")
+
+        with self._lock:
+            self.requests += 1
+            self.degraded_requests += bool(degraded)
+
+        return {
+            'values': values,
+            'timings': timings,
+            'timed_out': timed_out,
+            'errors': errors,
+            'degraded': degraded,
+            'total_seconds': round(time.perf_counter() - request_started, 6)
+        }
+
+    @staticmethod
+    def _run_stage(fn: Callable[[Dict[str, Any]], Any], inputs: Dict[str, Any], deadline: float):
+        # Upstream calls made by the stage see its deadline and size their
+        # timeouts to it instead of outliving the stage
+        with deadline_at(deadline):
+            return fn(inputs)
+
+    def _should_skip(self, name: str, remaining: float) -> bool:
+        """Skip a stage whose latency estimate exceeds the remaining budget"""
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None or stats['latency_estimate'] < remaining:
+                return False
+            stats['skips_in_a_row'] += 1
+            if stats['skips_in_a_row'] >= SKIP_PROBE_INTERVAL:
+                stats['skips_in_a_row'] = 0
+                return False
+            return True
+
+    def _degraded_value(self, stage: Stage, inputs: Dict[str, Any]):
+        if stage.cache_key is not None:
+            with self._lock:
+                cached = self._last_values.get((stage.name, stage.cache_key))
+            if cached is not None:
+                return cached
+        return stage.fallback(inputs) if stage.fallback else None
+
+    def _remember(self, name: str, cache_key: str, value) -> None:
+        with self._lock:
+            self._last_values[(name, cache_key)] = value
+            self._last_values.move_to_end((name, cache_key))
+            while len(self._last_values) > LAST_VALUE_CACHE_SIZE:
+                self._last_values.popitem(last=False)
+
+    def _record(self, name: str, seconds: float, expired: bool, failed: bool, skipped: bool):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'runs': 0, 'timeouts': 0, 'errors': 0, 'skipped': 0,
+                                                  'degraded': 0, 'total_seconds': 0.0,
+                                                  'latency_estimate': 0.0, 'skips_in_a_row': 0})
+            stats['runs'] += 1
+            stats['timeouts'] += expired
+            stats['errors'] += failed
+            stats['skipped'] += skipped
+            stats['degraded'] += expired or failed or skipped
+            if not skipped:
+                stats['total_seconds'] += seconds
+                stats['skips_in_a_row'] = 0
+                if expired:
+                    # The cut-off is only a lower bound on the real latency
+                    stats['latency_estimate'] = max(stats['latency_estimate'], seconds)
+                elif stats['runs'] - stats['skipped'] == 1:
+                    stats['latency_estimate'] = seconds
+                else:
+                    stats['latency_estimate'] += LATENCY_EWMA_ALPHA * (seconds - stats['latency_estimate'])
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per-stage run, timeout, error and degradation counts plus latency"""
+        with self._lock:
+            return {
+                name: {
+                    'runs': s['runs'],
+                    'timeouts': s['timeouts'],
+                    'errors': s['errors'],
+                    'skipped': s['skipped'],
+                    'degraded': s['degraded'],
+                    'degraded_rate': round(s['degraded'] / s['runs'], 4) if s['runs'] else 0.0,
+                    'mean_seconds': round(s['total_seconds'] / (s['runs'] - s['skipped']), 6)
+                    if s['runs'] > s['skipped'] else 0.0,
+                    'latency_estimate': round(s['latency_estimate'], 6)
+                }
+                for name, s in self._stats.items()
+            }
+
+    def request_stats(self) -> Dict:
+        """Share of requests that served at least one degraded stage"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'degraded_requests': self.degraded_requests,
+                'degraded_rate': round(self.degraded_requests / self.requests, 4) if self.requests else 0.0,
+                'budget_seconds': self.budget
+            }
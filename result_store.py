@@ -0,0 +1,276 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tax_engine import ENGINE_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Bump when templates or the PDF/text layouts change, so stored artifacts
+# rendered with the old layout are no longer found
+ARTIFACT_VERSION = 1
+
+# Input fields that determine a result, with how each is normalized
+RESULT_INPUTS = {
+    'income': lambda value: round(float(value), 2),
+    'filing_status': str,
+    'age': int,
+    'dependents': int,
+    'itemized_deductions': lambda value: round(float(value), 2),
+    'withholding': lambda value: round(float(value), 2),
+    'state': lambda value: str(value).upper()
+}
+
+
+def result_id(user_data: Dict) -> str:
+    """Content hash of a return's normalized inputs and the engine and
+    layout versions; equal inputs always map to the same id"""
+    normalized = {name: normalize(user_data.get(name, 0)) for name, normalize in RESULT_INPUTS.items()}
+    normalized['_versions'] = [ENGINE_VERSION, ARTIFACT_VERSION]
+    payload = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+class ResultStore:
+    """Computed returns and their rendered artifacts, keyed by result_id.
+
+    A result is stored once per id together with whatever has been
+    rendered from it (HTML pages, PDF bytes, text form), each with an
+    ETag. Each stored result also has a version (a hash of its content),
+    and artifacts are looked up by id and version, so a view never gets
+    an artifact rendered from content that has since been replaced.
+
+    Artifacts live in SQLite, shared by the workers on the host, with a
+    byte-bounded in-process LRU in front so repeat views skip the
+    database as well as the renderer. Results expire ``ttl`` seconds
+    after they were last stored. The same file holds the progress of
+    bulk exports, so any worker on the host can report it. Ids are only
+    known on the host that stored them.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None,
+                 memory_bytes: Optional[int] = None, cleanup_interval: Optional[float] = None):
+        self.path = path or os.environ.get('RESULT_STORE_DB') \
+            or os.path.join(tempfile.gettempdir(), 'tax_agent_results.db')
+        self.ttl = ttl or float(os.environ.get('RESULT_STORE_TTL', 7 * 24 * 3600))
+        self.memory_bytes = memory_bytes or int(os.environ.get('RESULT_STORE_MEMORY_BYTES', 64 * 1024 * 1024))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # (result_id, version, kind) -> (body, etag)
+        self._memory_used = 0
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.renders = 0
+
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                result_id TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                data BLOB NOT NULL,
+                degraded INTEGER NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS results_expires ON results (expires_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                result_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                body BLOB NOT NULL,
+                etag TEXT NOT NULL,
+                PRIMARY KEY (result_id, kind)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS export_jobs (
+                job_id TEXT PRIMARY KEY,
+                progress TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+        self.cleanup_interval = cleanup_interval or float(os.environ.get('RESULT_STORE_CLEANUP_INTERVAL', 3600))
+        self._stop = threading.Event()
+        threading.Thread(target=self._cleanup_loop, name='result-store-cleanup', daemon=True).start()
+        logger.info(f"Result store at {self.path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def put(self, result: Dict) -> Tuple[str, str]:
+        """Store a computed return (user_data, tax_result, ml_insights,
+        api_enhancements) and return its (id, version).
+
+        Storing different content under an existing id drops the
+        artifacts rendered from the old content. A degraded result never
+        replaces a complete one. Storing the same content again only
+        writes once a tenth of the ttl has passed, to push back expiry.
+        """
+        rid = result_id(result['user_data'])
+        encoded = json.dumps(result, sort_keys=True).encode()
+        version = hashlib.sha256(encoded).hexdigest()[:16]
+        degraded = bool(result.get('api_enhancements', {}).get('degraded_stages'))
+
+        conn = self._connect()
+        row = conn.execute("SELECT version, expires_at FROM results WHERE result_id = ?", (rid,)).fetchone()
+        if row is not None and row[0] == version and row[1] > time.time() + self.ttl * 0.9:
+            return rid, version
+
+        data = zlib.compress(encoded)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT version, degraded FROM results WHERE result_id = ?", (rid,)).fetchone()
+            if row is not None and (row[0] == version or (degraded and not row[1])):
+                conn.execute("UPDATE results SET expires_at = ? WHERE result_id = ?", (time.time() + self.ttl, rid))
+                conn.execute("COMMIT")
+                return rid, row[0]
+            conn.execute("INSERT OR REPLACE INTO results (result_id, version, data, degraded, expires_at) "
+                         "VALUES (?, ?, ?, ?, ?)", (rid, version, data, int(degraded), time.time() + self.ttl))
+            conn.execute("DELETE FROM artifacts WHERE result_id = ?", (rid,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rid, version
+
+    def get(self, rid: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT data FROM results WHERE result_id = ? AND expires_at > ?", (rid, time.time())
+        ).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def get_many(self, rids: List[str]) -> Dict[str, Dict]:
+        """Stored results for ``rids`` in one query; ids that are unknown
+        or expired are left out"""
+        rows = self._connect().execute(
+            f"SELECT result_id, data FROM results WHERE result_id IN ({','.join('?' * len(rids))}) "
+            "AND expires_at > ?", (*rids, time.time())
+        ).fetchall()
+        return {rid: json.loads(zlib.decompress(data)) for rid, data in rows}
+
+    def result_ids(self) -> Iterator[str]:
+        """Ids of every unexpired result"""
+        cursor = self._connect().execute(
+            "SELECT result_id FROM results WHERE expires_at > ? ORDER BY rowid", (time.time(),))
+        for (rid,) in cursor:
+            yield rid
+
+    def artifact(self, rid: str, version: str, kind: str, render) -> Tuple[bytes, str]:
+        """(body, etag) of an artifact of a stored result, rendering it
+        with ``render()`` only the first time it is asked for"""
+        key = (rid, version, kind)
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return cached
+
+        row = self._connect().execute(
+            "SELECT body, etag FROM artifacts JOIN results USING (result_id) "
+            "WHERE result_id = ? AND version = ? AND kind = ?", key
+        ).fetchone()
+        if row is not None:
+            artifact = (bytes(row[0]), row[1])
+            with self._lock:
+                self.store_hits += 1
+        else:
+            body = render()
+            if isinstance(body, str):
+                body = body.encode()
+            artifact = (body, hashlib.sha256(body).hexdigest()[:32])
+            # Only kept while the result still has this version
+            self._connect().execute(
+                "INSERT OR REPLACE INTO artifacts (result_id, kind, body, etag) "
+                "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM results WHERE result_id = ? AND version = ?)",
+                (rid, kind, artifact[0], artifact[1], rid, version)
+            )
+            with self._lock:
+                self.renders += 1
+
+        self._remember(key, artifact)
+        return artifact
+
+    def _remember(self, key, artifact) -> None:
+        size = len(artifact[0])
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_used -= len(previous[0])
+            self._memory[key] = artifact
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, (body, _) = self._memory.popitem(last=False)
+                self._memory_used -= len(body)
+
+    def put_export_progress(self, progress: Dict) -> None:
+        """Publish the progress of an export to the other workers"""
+        self._connect().execute(
+            "INSERT OR REPLACE INTO export_jobs (job_id, progress, updated_at) VALUES (?, ?, ?)",
+            (progress['job_id'], json.dumps(progress), time.time())
+        )
+
+    def export_progress(self, job_id: str) -> Optional[Dict]:
+        """Progress of an export as last published by the worker running it"""
+        row = self._connect().execute(
+            "SELECT progress FROM export_jobs WHERE job_id = ? AND updated_at > ?", (job_id, time.time() - self.ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cleanup(self) -> int:
+        """Delete expired results, their artifacts and old export progress"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM artifacts WHERE result_id IN "
+                         "(SELECT result_id FROM results WHERE expires_at <= ?)", (time.time(),))
+            removed = conn.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),)).rowcount
+            conn.execute("DELETE FROM export_jobs WHERE updated_at <= ?", (time.time() - self.ttl,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    def _cleanup_loop(self):
+        while not self._stop.wait(self.cleanup_interval):
+            try:
+                removed = self.cleanup()
+            except Exception as e:
+                logger.warning(f"Result store cleanup failed: {e}")
+                continue
+            if removed:
+                logger.debug(f"Result store cleanup removed {removed} expired results")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'store_hits': self.store_hits,
+                'renders': self.renders,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_used,
+                'path': self.path
+            }
+
+    def close(self) -> None:
+        self._stop.set()
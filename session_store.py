@@ -0,0 +1,183 @@
+import logging
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from typing import Optional
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+# A session read again within this many seconds of its last write keeps its
+# expiry; refreshing it on every request would make every page view a write
+TOUCH_INTERVAL = 60
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data lives in the store; the cookie only carries ``sid``"""
+
+    def __init__(self, initial=None, sid: Optional[str] = None, expires_at: float = 0.0):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        self.expires_at = expires_at
+        self.modified = False
+        self.accessed = False
+
+    # Reads count as access too, as in Flask's SecureCookieSession, so a
+    # response that depends on the session varies on the cookie
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.accessed = True
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Flask sessions stored server-side in one SQLite database per host.
+
+    Session data is tagged JSON (Flask's own session format) compressed
+    with zlib; the cookie holds only a random session id signed with the
+    app's secret key, so a forged id is rejected without a lookup. Rows
+    expire after PERMANENT_SESSION_LIFETIME and a background thread
+    deletes expired ones.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, path: Optional[str] = None, cleanup_interval: Optional[float] = None):
+        self.path = path or os.environ.get('SESSION_DB') \
+            or os.path.join(tempfile.gettempdir(), 'tax_agent_sessions.db')
+        self._local = threading.local()
+
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._connect().execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at)")
+
+        self.cleanup_interval = cleanup_interval or float(os.environ.get('SESSION_CLEANUP_INTERVAL', 300))
+        self._stop = threading.Event()
+        threading.Thread(target=self._cleanup_loop, name='session-cleanup', daemon=True).start()
+        logger.info(f"Server-side sessions at {self.path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection, reopened after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _signer(self, app) -> Signer:
+        return Signer(app.secret_key, salt='server-side-session')
+
+    def open_session(self, app, request) -> ServerSideSession:
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie or not app.secret_key:
+            return ServerSideSession()
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return ServerSideSession()
+
+        row = self._connect().execute(
+            "SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?", (sid, time.time())
+        ).fetchone()
+        if row is None:
+            return ServerSideSession()
+        try:
+            data = self.serializer.loads(zlib.decompress(row[0]).decode())
+        except (zlib.error, ValueError) as e:
+            logger.warning(f"Discarding unreadable session: {e}")
+            return ServerSideSession()
+        return ServerSideSession(data, sid=sid, expires_at=row[1])
+
+    def save_session(self, app, session: ServerSideSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session.accessed:
+            # The request never looked at its session (the JSON API):
+            # neither refresh it nor send the cookie, so shared caches
+            # never see a session id
+            return
+        response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.sid is not None:
+                self._connect().execute("DELETE FROM sessions WHERE sid = ?", (session.sid,))
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        if session.modified or session.expires_at - now < lifetime - TOUCH_INTERVAL:
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(16)
+            session.expires_at = now + lifetime
+            data = zlib.compress(self.serializer.dumps(dict(session)).encode())
+            self._connect().execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+                (session.sid, data, session.expires_at)
+            )
+        elif not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def cleanup(self) -> int:
+        """Delete expired sessions; returns how many were removed"""
+        return self._connect().execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def _cleanup_loop(self):
+        while not self._stop.wait(self.cleanup_interval):
+            try:
+                removed = self.cleanup()
+            except Exception as e:
+                logger.warning(f"Session cleanup failed: {e}")
+                continue
+            if removed:
+                logger.debug(f"Session cleanup removed {removed} expired sessions")
+
+    def close(self) -> None:
+        self._stop.set()
@@ -0,0 +1,106 @@
+"""Local stand-in for the taxee, smartystreets and BLS APIs.
+
+Serves the same payloads as TaxAPIIntegration's mocks over HTTP, with knobs
+for latency and failures, so the pooled client's timeouts, retries and
+circuit breaker can be exercised without the real services:
+
+    python stub_api_server.py --port 8765 --latency-ms 50 --jitter-ms 200 --failure-rate 0.1
+    TAX_API_LIVE=1 TAX_API_BASE_URL=http://127.0.0.1:8765 python app.py
+
+A small --hang-rate (say 0.03) gives the long tail that hedged requests are
+meant to cut; compare p99 and the hedge counters in /metrics with
+API_TAXEE_HEDGE=0 and =1.
+"""
+import argparse
+import json
+import logging
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from api_cache import MemoryCache
+from third_party_apis import TaxAPIIntegration
+
+logger = logging.getLogger(__name__)
+
+mocks = TaxAPIIntegration(cache=MemoryCache(), live=False)
+
+ROUTES = {
+    '/v2/federal': lambda q: mocks._mock_tax_brackets_api(q.get('filing_status', 'single'),
+                                                          int(q.get('year', 2023))),
+    '/v2/state': lambda q: mocks._mock_state_tax_api(q.get('state', 'CA'), float(q.get('income', 0))),
+    '/v2/state/schedule': lambda q: mocks._mock_state_schedule_api(q.get('state', 'CA')),
+    '/tax-deductions/v1': lambda q: mocks._mock_deductions_api(q.get('filing_status', 'single'),
+                                                               float(q.get('income', 0)), q.get('location')),
+    '/publicAPI/v2/timeseries/data': lambda q: {
+        'adjustment': mocks._mock_inflation_api(int(q.get('base_year', 2022)), int(q.get('current_year', 2023)))
+    }
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers GETs for ROUTES after the configured delay or failure"""
+
+    settings = argparse.Namespace(latency_ms=0, jitter_ms=0, failure_rate=0.0, hang_rate=0.0, hang_seconds=30)
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real upstreams
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = ROUTES.get(url.path)
+        if route is None:
+            return self._send(404, {'error': 'not found'})
+
+        settings = self.settings
+        time.sleep((settings.latency_ms + random.uniform(0, settings.jitter_ms)) / 1000)
+        if random.random() < settings.hang_rate:
+            time.sleep(settings.hang_seconds)
+        if random.random() < settings.failure_rate:
+            return self._send(503, {'error': 'injected failure'})
+
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self._send(200, route(query))
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host: str = '127.0.0.1', port: int = 8765, **settings) -> ThreadingHTTPServer:
+    """Create a stub server with the given latency/failure settings; call
+    ``serve_forever`` on it (possibly from a thread) to start answering"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {
+        'settings': argparse.Namespace(**{**vars(StubHandler.settings), **settings})
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0, help='fixed delay added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='extra uniform random delay')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='fraction of requests that stall')
+    parser.add_argument('--hang-seconds', type=float, default=30, help='how long a stalled request waits')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = serve(args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                   failure_rate=args.failure_rate, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds)
+    logger.info(f"Stub tax APIs listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,174 @@
+import numpy as np
+from typing import Dict, List, Sequence
+
+# Bump when a change here or in the insight rules changes results for the
+# same inputs; stored results are addressed by inputs plus this version
+ENGINE_VERSION = 1
+
+# Standard deductions for 2023
+STANDARD_DEDUCTIONS = {
+    'single': 13850,
+    'married_joint': 27700,
+    'married_separate': 13850,
+    'head_of_household': 20800
+}
+
+# Simplified tax calculation (2023 brackets): (lower, upper, rate)
+TAX_BRACKETS = {
+    'single': [
+        (0, 11000, 0.10),
+        (11000, 44725, 0.12),
+        (44725, 95375, 0.22),
+        (95375, 182100, 0.24),
+        (182100, 231250, 0.32),
+        (231250, 578125, 0.35),
+        (578125, float('inf'), 0.37)
+    ],
+    'married_joint': [
+        (0, 22000, 0.10),
+        (22000, 89450, 0.12),
+        (89450, 190750, 0.22),
+        (190750, 364200, 0.24),
+        (364200, 462500, 0.32),
+        (462500, 693750, 0.35),
+        (693750, float('inf'), 0.37)
+    ],
+    'married_separate': [
+        (0, 11000, 0.10),
+        (11000, 44725, 0.12),
+        (44725, 95375, 0.22),
+        (95375, 182100, 0.24),
+        (182100, 231250, 0.32),
+        (231250, 346875, 0.35),
+        (346875, float('inf'), 0.37)
+    ],
+    'head_of_household': [
+        (0, 15700, 0.10),
+        (15700, 59850, 0.12),
+        (59850, 95350, 0.22),
+        (95350, 182100, 0.24),
+        (182100, 231250, 0.32),
+        (231250, 578100, 0.35),
+        (578100, float('inf'), 0.37)
+    ]
+}
+
+CHILD_TAX_CREDIT = 2000
+
+# Bracket tables as arrays, one row per filing status, for the batch path.
+# Every status has the same number of brackets.
+_STATUS_INDEX = {status: i for i, status in enumerate(TAX_BRACKETS)}
+_BRACKET_WIDTH = np.array([[upper - lower for lower, upper, _ in brackets] for brackets in TAX_BRACKETS.values()])
+_RATES = [[rate for _, _, rate in brackets] for brackets in TAX_BRACKETS.values()]
+_BRACKET_RATE = np.array(_RATES)
+
+
+def calculate_federal_tax(processed_data: Dict) -> Dict:
+    """Compute the federal tax result for validated, processed form data"""
+    income = processed_data['income']
+    filing_status = processed_data['filing_status']
+    dependents = processed_data['dependents']
+    itemized_deductions = processed_data['itemized_deductions']
+    withholding = processed_data['withholding']
+
+    # Use standard deduction if itemized is less
+    deduction = max(STANDARD_DEDUCTIONS.get(filing_status, 13850), itemized_deductions)
+    taxable_income = max(0, income - deduction)
+
+    brackets = TAX_BRACKETS.get(filing_status, TAX_BRACKETS['single'])
+    total_tax = 0
+    remaining_income = taxable_income
+
+    for i, (min_income, max_income, rate) in enumerate(brackets):
+        if remaining_income <= 0:
+            break
+
+        if i == 0:  # First bracket
+            bracket_income = min(remaining_income, max_income)
+        else:
+            bracket_income = min(remaining_income, max_income - brackets[i-1][1])
+
+        total_tax += bracket_income * rate
+        remaining_income -= bracket_income
+
+    # Child tax credit (simplified)
+    child_credit = min(dependents * CHILD_TAX_CREDIT, total_tax)
+    final_tax = max(0, total_tax - child_credit)
+
+    # Calculate refund/amount owed
+    refund_or_owe = withholding - final_tax
+
+    tax_result = {
+        'total_income': income,
+        'total_deductions': deduction,
+        'standard_deduction': STANDARD_DEDUCTIONS.get(filing_status, 13850),
+        'taxable_income': taxable_income,
+        'federal_tax_before_credits': total_tax,
+        'child_tax_credit': child_credit,
+        'tax_owed': final_tax,
+        'withholding': withholding,
+        'refund_or_owe': refund_or_owe,
+        'is_refund': refund_or_owe > 0,
+        'effective_tax_rate': round((final_tax / income) * 100, 1) if income > 0 else 0,
+        'marginal_tax_rate': 0
+    }
+
+    # Calculate marginal tax rate based on the highest bracket used
+    for min_income, max_income, rate in brackets:
+        if taxable_income > min_income:
+            tax_result['marginal_tax_rate'] = round(rate * 100, 1)
+        if taxable_income <= max_income:
+            break
+
+    return tax_result
+
+
+def calculate_federal_tax_batch(records: Sequence[Dict]) -> List[Dict]:
+    """Federal tax results for many returns at once.
+
+    The bracket walk runs once per bracket over all returns as arrays,
+    with the same operations in the same order as calculate_federal_tax,
+    so each result equals the single-return one.
+    """
+    if not records:
+        return []
+    status = np.array([_STATUS_INDEX.get(record['filing_status'], 0) for record in records])
+    deductions = [max(STANDARD_DEDUCTIONS.get(record['filing_status'], 13850), record['itemized_deductions'])
+                  for record in records]
+    taxable = [max(0, record['income'] - deduction) for record, deduction in zip(records, deductions)]
+
+    remaining = np.array(taxable, dtype=float)
+    total_tax = np.zeros(len(records))
+    marginal = np.full(len(records), -1)
+    for i in range(_BRACKET_RATE.shape[1]):
+        bracket_income = np.clip(remaining, 0, _BRACKET_WIDTH[status, i])
+        total_tax += bracket_income * _BRACKET_RATE[status, i]
+        remaining -= bracket_income
+        marginal = np.where(remaining + bracket_income > 0, i, marginal)
+
+    dependents = np.array([record['dependents'] for record in records], dtype=float)
+    child_credit = np.minimum(dependents * CHILD_TAX_CREDIT, total_tax)
+    final_tax = np.maximum(0, total_tax - child_credit)
+    withholding = np.array([record['withholding'] for record in records], dtype=float)
+    refund_or_owe = withholding - final_tax
+
+    results = []
+    for record, deduction, taxable_income, tax, credit, owed, refund, status_index, bracket in zip(
+            records, deductions, taxable, total_tax.tolist(), child_credit.tolist(), final_tax.tolist(),
+            refund_or_owe.tolist(), status.tolist(), marginal.tolist()):
+        income = record['income']
+        results.append({
+            'total_income': income,
+            'total_deductions': deduction,
+            'standard_deduction': STANDARD_DEDUCTIONS.get(record['filing_status'], 13850),
+            'taxable_income': taxable_income,
+            'federal_tax_before_credits': tax,
+            'child_tax_credit': credit,
+            'tax_owed': owed,
+            'withholding': record['withholding'],
+            'refund_or_owe': refund,
+            'is_refund': refund > 0,
+            'effective_tax_rate': round((owed / income) * 100, 1) if income > 0 else 0,
+            'marginal_tax_rate': round(_RATES[status_index][bracket] * 100, 1) if bracket >= 0 else 0
+        })
+    return results
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import pytest
+
+_data_dir = tempfile.mkdtemp(prefix='tax_agent_test_')
+os.environ.setdefault('SESSION_DB', os.path.join(_data_dir, 'sessions.db'))
+os.environ.setdefault('RESULT_STORE_DB', os.path.join(_data_dir, 'results.db'))
+os.environ.setdefault('API_CACHE_DB', os.path.join(_data_dir, 'api_cache.db'))
+
+from app import app  # noqa: E402
+
+FORM = {'income': '60000', 'filing_status': 'married_joint', 'age': '40', 'dependents': '1',
+        'itemized_deductions': '0', 'withholding': '5000', 'state': 'CA'}
+
+
+@pytest.fixture
+def client():
+    client = app.test_client()
+    # A browser session first, so the API requests below carry its cookie
+    client.post('/calculate', data=FORM)
+    assert client.get_cookie(app.config['SESSION_COOKIE_NAME']) is not None
+    return client
+
+
+def test_cacheable_api_response_sets_no_cookie(client):
+    response = client.get('/api/v1/calculate', query_string=FORM)
+    assert response.status_code == 200
+    assert 'public' in response.headers['Cache-Control']
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_api_post_is_not_public(client):
+    response = client.post('/api/v1/calculate', json=FORM)
+    assert response.status_code == 200
+    assert 'public' not in response.headers['Cache-Control']
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_session_page_varies_on_cookie(client):
+    response = client.get('/tax_form')
+    assert response.status_code == 200
+    assert 'Cookie' in response.headers.get('Vary', '')
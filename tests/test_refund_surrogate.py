@@ -0,0 +1,46 @@
+import math
+
+from refund_surrogate import RefundSurrogate, SurrogateRouter
+
+
+def make_surrogate():
+    # One cell per income bin for married_joint with one dependent, each a
+    # refund of 10% of withholding with a small error bound
+    cells = {('married_joint', 1, bin_index): (0.0, 0.0, 0.0, 0.1, 0.0, 50.0) for bin_index in range(3)}
+    interval_cells = {key: (-100.0, 100.0) for key in cells}
+    return RefundSurrogate([50000.0, 100000.0], cells, 0.99, interval_cells=interval_cells,
+                           interval_coverage=0.9)
+
+
+def make_return(**overrides):
+    user_data = {'income': 60000.0, 'filing_status': 'married_joint', 'age': 40, 'dependents': 1,
+                 'itemized_deductions': 0.0, 'withholding': 6000.0}
+    user_data.update(overrides)
+    return user_data
+
+
+def test_fast_estimate_inside_domain():
+    router = SurrogateRouter(None, make_surrogate(), max_error=250)
+    estimate, error_bound, interval = router.fast_estimate(make_return())
+    assert estimate == 600.0
+    assert error_bound == 50.0
+    assert interval == (500.0, 700.0)
+    assert router.stats()['fast_path'] == 1
+
+
+def test_withholding_beyond_sampled_ratio_uses_full_model():
+    router = SurrogateRouter(None, make_surrogate(), max_error=250)
+    user_data = make_return(withholding=59000.0)
+    assert router.fast_estimate(user_data) is None
+    assert math.isinf(router.surrogate.predict(user_data)[1])
+    stats = router.stats()
+    assert stats['out_of_domain'] == 1
+    assert stats['full_model'] == 1
+    assert stats['fast_path'] == 0
+
+
+def test_income_outside_sampled_range_uses_full_model():
+    router = SurrogateRouter(None, make_surrogate(), max_error=250)
+    assert router.fast_estimate(make_return(income=900000.0, withholding=1000.0)) is None
+    assert router.fast_estimate(make_return(income=8000.0, withholding=100.0)) is None
+    assert router.stats()['out_of_domain'] == 2
@@ -1,50 +1,78 @@
 import requests
 import json
 import logging
+import os
+import threading
 from datetime import datetime
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Optional, List
+
+from api_cache import BackgroundRefresher, CacheBackend, SingleFlight, create_cache
+from api_client import client_from_env
+from rate_limiter import RateLimiter
 
 logger = logging.getLogger(__name__)
 
+FILING_STATUSES = ['single', 'married_joint', 'married_separate', 'head_of_household']
+
+STATES = [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID',
+    'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO',
+    'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA',
+    'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY'
+]
+
 class TaxAPIIntegration:
     """Integration with third-party tax APIs for enhanced calculations"""
     
-    def __init__(self):
-        # API endpoints (using mock endpoints for demo)
-        self.tax_brackets_api = "https://api.taxee.io/v2/federal"
-        self.state_tax_api = "https://api.taxee.io/v2/state"
-        self.deduction_api = "https://api.smartystreets.com/tax-deductions/v1"
-        self.inflation_api = "https://api.bls.gov/publicAPI/v2/timeseries/data"
+    def __init__(self, cache: Optional[CacheBackend] = None, live: Optional[bool] = None):
+        # API endpoints (mocked unless TAX_API_LIVE=1; TAX_API_BASE_URL
+        # points every upstream at one host, e.g. stub_api_server.py)
+        base_url = os.environ.get('TAX_API_BASE_URL', '').rstrip('/')
+        self.tax_brackets_api = (base_url or "https://api.taxee.io") + "/v2/federal"
+        self.state_tax_api = (base_url or "https://api.taxee.io") + "/v2/state"
+        self.state_schedule_api = (base_url or "https://api.taxee.io") + "/v2/state/schedule"
+        self.deduction_api = (base_url or "https://api.smartystreets.com") + "/tax-deductions/v1"
+        self.inflation_api = (base_url or "https://api.bls.gov") + "/publicAPI/v2/timeseries/data"
         
-        # API keys (should be in environment variables)
+        # API keys
         self.api_keys = {
-            'taxee': 'demo_key_12345',
-            'smartystreets': 'demo_key_67890',
-            'bls': 'demo_key_abcde'
+            'taxee': os.environ.get('TAXEE_API_KEY', 'demo_key_12345'),
+            'smartystreets': os.environ.get('SMARTYSTREETS_API_KEY', 'demo_key_67890'),
+            'bls': os.environ.get('BLS_API_KEY', 'demo_key_abcde')
+        }
+        
+        # One pooled, circuit-broken, rate-limited HTTP client per upstream;
+        # token buckets and daily quotas are shared by all workers on the host
+        self.live = live if live is not None else os.environ.get('TAX_API_LIVE') == '1'
+        self.rate_limiter = RateLimiter()
+        self.clients = {
+            name: client_from_env(name, key, self.rate_limiter)
+            for name, key in self.api_keys.items()
         }
         
-        # Cache for API responses
-        self.cache = {}
-        self.cache_timeout = 3600  # 1 hour
+        # Cache for API responses (bounded, per-namespace TTLs, shared by
+        # the workers on this host unless API_CACHE_BACKEND=memory)
+        self.cache = cache or create_cache()
+        self.single_flight = SingleFlight(self.cache)
+        
+        # Stale-while-revalidate and refresh-ahead of popular keys
+        self.refresher = BackgroundRefresher(self.single_flight)
+        self.refresh_ahead_fraction = float(os.environ.get('API_CACHE_REFRESH_AHEAD', 0.1))
+        self.refresh_ahead_min_hits = int(os.environ.get('API_CACHE_REFRESH_AHEAD_HITS', 10))
+        self._key_hits = {}
+        self._key_hits_lock = threading.Lock()
+        
+        # Last reference snapshot loaded (namespace -> key -> value), served
+        # when an upstream is unreachable and the cache has nothing
+        self.snapshot = {}
     
     def get_current_tax_brackets(self, filing_status: str, tax_year: int = 2023) -> Dict:
         """Fetch current tax brackets from third-party API"""
-        cache_key = f"brackets_{filing_status}_{tax_year}"
-        
-        # Check cache first
-        if self._is_cached(cache_key):
-            logger.info(f"Using cached tax brackets for {filing_status}")
-            return self.cache[cache_key]['data']
-        
         try:
-            # Mock API call (in production, replace with actual API)
-            brackets_data = self._mock_tax_brackets_api(filing_status, tax_year)
-            
-            # Cache the response
-            self._cache_response(cache_key, brackets_data)
-            
-            logger.info(f"Retrieved tax brackets from API for {filing_status}")
-            return brackets_data
+            return self._get_or_fetch(
+                'brackets', f"{filing_status}_{tax_year}",
+                lambda: self._fetch_brackets(filing_status, tax_year),
+                f"tax brackets for {filing_status}")
             
         except Exception as e:
             logger.error(f"Error fetching tax brackets: {e}")
@@ -52,30 +80,37 @@ class TaxAPIIntegration:
             return self._get_fallback_brackets(filing_status)
     
     def get_state_tax_info(self, state: str, income: float) -> Dict:
-        """Fetch state tax information"""
-        cache_key = f"state_{state}_{int(income/1000)}"
-        
-        if self._is_cached(cache_key):
-            return self.cache[cache_key]['data']
+        """Fetch state tax information
         
+        Only the state's rate schedule comes from the API (and the cache,
+        one entry per state); the tax for this income is computed locally.
+        """
         try:
-            state_data = self._mock_state_tax_api(state, income)
-            self._cache_response(cache_key, state_data)
-            
-            logger.info(f"Retrieved state tax info for {state}")
-            return state_data
+            return self._compute_state_tax(self.get_state_schedule(state), state, income)
             
         except Exception as e:
             logger.error(f"Error fetching state tax info: {e}")
             return {'state_tax': 0, 'state_rate': 0, 'deductions': 0}
     
+    def get_state_schedule(self, state: str) -> Dict:
+        """Fetch a state's tax rate schedule and deduction rules"""
+        state = state.upper()
+        return self._get_or_fetch(
+            'state_schedules', state,
+            lambda: self._fetch_state_schedule(state),
+            f"tax schedule for {state}")
+    
     def get_enhanced_deductions(self, filing_status: str, income: float, 
                               location: str = None) -> Dict:
         """Get enhanced deduction recommendations from API"""
         try:
-            deductions_data = self._mock_deductions_api(filing_status, income, location)
-            logger.info("Retrieved enhanced deductions from API")
-            return deductions_data
+            return self._get_or_fetch(
+                'deductions', f"{filing_status}_{int(income/1000)}_{location}",
+                lambda: self._request(
+                    'smartystreets', self.deduction_api,
+                    {'filing_status': filing_status, 'income': income, 'location': location},
+                    lambda: self._mock_deductions_api(filing_status, income, location)),
+                "enhanced deductions")
             
         except Exception as e:
             logger.error(f"Error fetching deductions: {e}")
@@ -85,9 +120,10 @@ class TaxAPIIntegration:
                                 current_year: int = 2023) -> float:
         """Get inflation adjustment factor"""
         try:
-            adjustment = self._mock_inflation_api(base_year, current_year)
-            logger.info(f"Retrieved inflation adjustment: {adjustment}")
-            return adjustment
+            return self._get_or_fetch(
+                'inflation', f"{base_year}_{current_year}",
+                lambda: self._fetch_inflation(base_year, current_year),
+                f"inflation adjustment {base_year}-{current_year}")
             
         except Exception as e:
             logger.error(f"Error fetching inflation data: {e}")
@@ -104,7 +140,53 @@ class TaxAPIIntegration:
             logger.error(f"Error validating calculations: {e}")
             return {'is_valid': True, 'confidence': 0.85, 'suggestions': []}
     
-    # Mock API methods (replace with actual API calls in production)
+    def _request(self, upstream: str, url: str, params: Dict, mock: Callable[[], Dict]) -> Dict:
+        """Call the live upstream, or its mock when running without one.
+        
+        Live calls go through the upstream's pooled client, which raises
+        once retries are exhausted or its circuit is open; callers catch
+        that and fall back.
+        """
+        if not self.live:
+            return mock()
+        return self.clients[upstream].get_json(url, params)
+    
+    def _fetch_brackets(self, filing_status: str, tax_year: int) -> Dict:
+        return self._request(
+            'taxee', self.tax_brackets_api, {'filing_status': filing_status, 'year': tax_year},
+            lambda: self._mock_tax_brackets_api(filing_status, tax_year))
+    
+    def _fetch_state_schedule(self, state: str) -> Dict:
+        return self._request(
+            'taxee', self.state_schedule_api, {'state': state},
+            lambda: self._mock_state_schedule_api(state))
+    
+    def _fetch_inflation(self, base_year: int, current_year: int) -> float:
+        return self._request(
+            'bls', self.inflation_api, {'base_year': base_year, 'current_year': current_year},
+            lambda: {'adjustment': self._mock_inflation_api(base_year, current_year)})['adjustment']
+    
+    def reference_fetchers(self, tax_year: int = 2023) -> List:
+        """(namespace, cache key, fetch) for every reference lookup that
+        does not depend on a taxpayer's income, for prefetch and snapshots"""
+        fetchers = [
+            ('brackets', f"{filing_status}_{tax_year}",
+             lambda filing_status=filing_status: self._fetch_brackets(filing_status, tax_year))
+            for filing_status in FILING_STATUSES
+        ]
+        fetchers.extend(
+            ('state_schedules', state, lambda state=state: self._fetch_state_schedule(state))
+            for state in STATES
+        )
+        fetchers.append(('inflation', f"{tax_year - 1}_{tax_year}",
+                         lambda: self._fetch_inflation(tax_year - 1, tax_year)))
+        return fetchers
+    
+    def client_stats(self) -> Dict:
+        """Request, retry, circuit breaker and quota counters per upstream"""
+        return {name: client.stats() for name, client in self.clients.items()}
+    
+    # Mock API methods (also served by stub_api_server.py)
     def _mock_tax_brackets_api(self, filing_status: str, tax_year: int) -> Dict:
         """Mock tax brackets API response"""
         brackets = {
@@ -136,8 +218,30 @@ class TaxAPIIntegration:
             'last_updated': datetime.now().isoformat()
         }
     
+    def _compute_state_tax(self, schedule: Dict, state: str, income: float) -> Dict:
+        """State tax for one income from a cached rate schedule"""
+        state_tax = 0
+        rate = 0
+        for bracket in schedule['brackets']:
+            if income <= bracket['min']:
+                break
+            state_tax += (min(income, bracket['max']) - bracket['min']) * bracket['rate']
+            rate = bracket['rate']
+        
+        return {
+            'state': state,
+            'state_tax_rate': rate,
+            'state_tax_owed': state_tax,
+            'state_deductions': schedule['state_deduction'],
+            'local_taxes': income * schedule['local_rate']
+        }
+    
     def _mock_state_tax_api(self, state: str, income: float) -> Dict:
         """Mock state tax API response"""
+        return self._compute_state_tax(self._mock_state_schedule_api(state), state, income)
+    
+    def _mock_state_schedule_api(self, state: str) -> Dict:
+        """Mock state tax schedule API response (flat-rate schedules)"""
         state_rates = {
             'CA': 0.133, 'NY': 0.1090, 'TX': 0.0, 'FL': 0.0,
             'WA': 0.0, 'NV': 0.0, 'TN': 0.0, 'IL': 0.0495,
@@ -145,14 +249,13 @@ class TaxAPIIntegration:
         }
         
         rate = state_rates.get(state.upper(), 0.05)  # Default 5% if state not found
-        state_tax = income * rate if rate > 0 else 0
         
         return {
-            'state': state,
-            'state_tax_rate': rate,
-            'state_tax_owed': state_tax,
-            'state_deductions': 5000 if rate > 0 else 0,
-            'local_taxes': income * 0.01 if state.upper() in ['NY', 'CA'] else 0
+            'state': state.upper(),
+            'brackets': [{'min': 0, 'max': float('inf'), 'rate': rate}] if rate > 0 else [],
+            'state_deduction': 5000 if rate > 0 else 0,
+            'local_rate': 0.01 if state.upper() in ['NY', 'CA'] else 0,
+            'last_updated': datetime.now().isoformat()
         }
     
     def _mock_deductions_api(self, filing_status: str, income: float, 
@@ -232,19 +335,51 @@ class TaxAPIIntegration:
         """Fallback tax brackets if API fails"""
         return self._mock_tax_brackets_api(filing_status, 2023)
     
-    def _is_cached(self, cache_key: str) -> bool:
-        """Check if data is in cache and not expired"""
-        if cache_key not in self.cache:
-            return False
+    def _get_or_fetch(self, namespace: str, cache_key: str, fetch: Callable, description: str):
+        """Return the cached response, or fetch and cache it.
         
-        cache_time = self.cache[cache_key]['timestamp']
-        current_time = datetime.now().timestamp()
+        Concurrent misses for the same key, in this process or in other
+        workers sharing the cache, wait for one upstream call instead of
+        each making their own. Stale entries are returned immediately and
+        refreshed in the background, and keys read often are refreshed
+        just before they go stale, so steady-state requests never wait on
+        an upstream refresh.
+        """
+        entry = self.cache.get_entry(namespace, cache_key)
+        if entry is not None:
+            value, fresh_for = entry
+            if fresh_for <= 0 or (fresh_for < self.cache.ttl_for(namespace) * self.refresh_ahead_fraction
+                                  and self._is_popular(namespace, cache_key)):
+                if self.refresher.schedule(namespace, cache_key, fetch):
+                    logger.info(f"Refreshing {description} in the background")
+            return value
         
-        return (current_time - cache_time) < self.cache_timeout
+        try:
+            value, fetched = self.single_flight.fill(namespace, cache_key, fetch)
+        except Exception as e:
+            snapshot_value = self.snapshot.get(namespace, {}).get(cache_key)
+            if snapshot_value is None:
+                raise
+            logger.warning(f"Serving {description} from reference snapshot: {e}")
+            return snapshot_value
+        if fetched:
+            logger.info(f"Retrieved {description} from API")
+        return value
+    
+    def _is_popular(self, namespace: str, cache_key: str) -> bool:
+        """Count a read of a key close to going stale; popular once it has
+        been read refresh_ahead_min_hits times in that window"""
+        with self._key_hits_lock:
+            if len(self._key_hits) > 10000:
+                self._key_hits.clear()
+            hits = self._key_hits.get((namespace, cache_key), 0) + 1
+            if hits >= self.refresh_ahead_min_hits:
+                self._key_hits.pop((namespace, cache_key), None)
+                return True
+            self._key_hits[(namespace, cache_key)] = hits
+            return False
     
-    def _cache_response(self, cache_key: str, data: Dict) -> None:
-        """Cache API response"""
-        self.cache[cache_key] = {
-            'data': data,
-            'timestamp': datetime.now().timestamp()
-        }
\ No newline at end of file
+    def cache_stats(self) -> Dict:
+        """Hit/miss/eviction counters of the response cache, fill coalescing
+        and background refreshes"""
+        return {**self.cache.stats(), **self.single_flight.stats(), **self.refresher.stats()}